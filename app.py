@@ -11,16 +11,34 @@ A modern web interface for the Infobip SMS application with features:
 - Responsive design
 """
 
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for
-from werkzeug.utils import secure_filename
+from flask import Flask, Response, render_template, request, jsonify, flash, redirect, url_for, g
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NEED_DATA
 import os
+import hmac
 import json
 import time
 from datetime import datetime
 from typing import List, Dict
 
 # Import our SMS client
-from sms_application import SMSClient, format_response
+from sms_application import SMSClient, SMSAPIError, MAX_RECIPIENTS, format_response
+from sms_cache import SharedTTLCache
+from sms_queue import SMSOutbox
+from sms_reports import (DeliveryReportStore, ReportIngestor, ReportSyncer, parse_timestamp,
+                         report_problem, sync_reports)
+from sms_metrics import REGISTRY, CONTENT_TYPE, RequestMetrics, SnapshotDirectory
+from sms_contacts import (ContactListStore, UploadTooLarge, iter_decompressed, iter_lines,
+                          iter_rows, iter_phone_column, read_phone_numbers,
+                          CHUNK_SIZE, DEFAULT_PREVIEW_SIZE)
+from sms_numbers import normalize_number, normalize_numbers, normalize_stream
+from sms_segments import estimate_campaign, estimate_personalized
+from sms_templates import MessageTemplate, TemplateError, iter_rendered
+from sms_jobs import JobStore, SendJobRunner, FINISHED as JOB_FINISHED
+from sms_idempotency import SendCache, IdempotencyConflict, request_fingerprint
+from sms_coalesce import SendCoalescer
+from sms_schedule import ScheduleStore, parse_send_time
+from sms_breaker import EndpointSet, CLOSED, HALF_OPEN, OPEN
 
 # Configuration
 try:
@@ -32,41 +50,344 @@ except ImportError:
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'  # Change this in production
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-app.config['UPLOAD_FOLDER'] = 'uploads'
-
-# Ensure upload folder exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Upload size limit, enforced while streaming (also on gunzipped content)
+app.config['MAX_UPLOAD_BYTES'] = int(os.environ.get('SMS_MAX_UPLOAD_BYTES', 256 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_UPLOAD_BYTES']
+app.config['OUTBOX_PATH'] = os.environ.get('SMS_OUTBOX_PATH', 'outbox.db')
+app.config['REPORTS_PATH'] = os.environ.get('SMS_REPORTS_PATH', 'reports.db')
+# Seconds between pulls of polled delivery reports into the store; 0 disables
+app.config['REPORTS_SYNC_INTERVAL'] = float(os.environ.get('SMS_REPORTS_SYNC_INTERVAL', 0))
+# Balance cache shared by all worker processes (ages in seconds)
+app.config['CACHE_PATH'] = os.environ.get('SMS_CACHE_PATH', 'cache.db')
+app.config['BALANCE_TTL'] = float(os.environ.get('SMS_BALANCE_TTL', 60))
+app.config['BALANCE_STALE_TTL'] = float(os.environ.get('SMS_BALANCE_STALE_TTL', 300))
+app.config['BALANCE_ERROR_TTL'] = float(os.environ.get('SMS_BALANCE_ERROR_TTL', 600))
+# Directory of uploaded contact lists, referenced by list_id
+app.config['CONTACTS_PATH'] = os.environ.get('SMS_CONTACTS_PATH', 'contacts')
+# Seconds an uploaded list is kept before it is removed; 0 keeps lists
+app.config['CONTACT_LIST_TTL'] = float(os.environ.get('SMS_CONTACT_LIST_TTL', 24 * 3600))
+# Background send jobs: progress database, concurrent jobs per worker, and
+# how long one progress stream stays open before the browser reconnects
+app.config['JOBS_PATH'] = os.environ.get('SMS_JOBS_PATH', 'jobs.db')
+app.config['JOB_WORKERS'] = int(os.environ.get('SMS_JOB_WORKERS', 2))
+app.config['JOB_STREAM_TIMEOUT'] = float(os.environ.get('SMS_JOB_STREAM_TIMEOUT', 20))
+# Idempotency keys and recent sends, shared by all workers: keys are kept
+# for IDEMPOTENCY_TTL seconds (at most IDEMPOTENCY_MAX_KEYS of them), and
+# a (recipient, text) pair sent within SEND_DEDUP_WINDOW seconds is
+# skipped (0 disables)
+app.config['SEND_CACHE_PATH'] = os.environ.get('SMS_SEND_CACHE_PATH', 'sends.db')
+app.config['IDEMPOTENCY_TTL'] = float(os.environ.get('SMS_IDEMPOTENCY_TTL', 24 * 3600))
+app.config['IDEMPOTENCY_MAX_KEYS'] = int(os.environ.get('SMS_IDEMPOTENCY_MAX_KEYS', 10000))
+app.config['SEND_DEDUP_WINDOW'] = float(os.environ.get('SMS_SEND_DEDUP_WINDOW', 0))
+# Inline sends of up to MAX_RECIPIENTS numbers arriving within
+# COALESCE_WINDOW seconds of each other share upstream requests (up to
+# COALESCE_MAX_BATCH recipients each); 0 sends every request on its own
+app.config['COALESCE_WINDOW'] = float(os.environ.get('SMS_COALESCE_WINDOW', 0))
+app.config['COALESCE_MAX_BATCH'] = int(os.environ.get('SMS_COALESCE_MAX_BATCH', 1000))
+# Scheduled sends; the messages are sent by the sms_schedule.py process
+# watching the same database
+app.config['SCHEDULE_PATH'] = os.environ.get('SMS_SCHEDULE_PATH', 'schedule.db')
+# Connections to Infobip, shared by all threads of a worker: pool size
+# (0 sizes it for bulk sends), whether threads wait for a free connection
+# instead of opening extra ones, connect/read timeouts, seconds after
+# which an idle connection is replaced, and idle seconds before TCP
+# keep-alive probes (0 disables)
+app.config['POOL_SIZE'] = int(os.environ.get('SMS_POOL_SIZE', 0))
+app.config['POOL_BLOCK'] = os.environ.get('SMS_POOL_BLOCK', '').lower() in ('1', 'true', 'yes')
+app.config['CONNECT_TIMEOUT'] = float(os.environ.get('SMS_CONNECT_TIMEOUT', 5))
+app.config['READ_TIMEOUT'] = float(os.environ.get('SMS_READ_TIMEOUT', 30))
+app.config['IDLE_TIMEOUT'] = float(os.environ.get('SMS_IDLE_TIMEOUT', 55))
+app.config['TCP_KEEPALIVE'] = float(os.environ.get('SMS_TCP_KEEPALIVE', 0))
+# Alternate API base URLs (comma separated, e.g. other regional hosts)
+# used while API_BASE_URL's circuit is open. A circuit opens when at
+# least BREAKER_MIN_CALLS recent calls were made and BREAKER_FAILURE_RATE
+# of them failed or took over BREAKER_SLOW_CALL seconds; it probes again
+# after BREAKER_RESET_TIMEOUT seconds
+app.config['FALLBACK_URLS'] = os.environ.get('SMS_FALLBACK_URLS', '')
+app.config['BREAKER_FAILURE_RATE'] = float(os.environ.get('SMS_BREAKER_FAILURE_RATE', 0.5))
+app.config['BREAKER_MIN_CALLS'] = int(os.environ.get('SMS_BREAKER_MIN_CALLS', 10))
+app.config['BREAKER_SLOW_CALL'] = float(os.environ.get('SMS_BREAKER_SLOW_CALL', 10))
+app.config['BREAKER_RESET_TIMEOUT'] = float(os.environ.get('SMS_BREAKER_RESET_TIMEOUT', 30))
+# Directory where worker processes share Prometheus metrics; empty keeps
+# them per process (fine for a single worker)
+app.config['METRICS_DIR'] = os.environ.get('SMS_METRICS_DIR', '')
+# Public URL of /webhooks/delivery-reports; empty disables push reports
+app.config['NOTIFY_URL'] = os.environ.get('SMS_NOTIFY_URL', '')
+# Shared secret expected as ?token= on webhook calls; the webhook refuses
+# every call while it is empty
+app.config['WEBHOOK_TOKEN'] = os.environ.get('SMS_WEBHOOK_TOKEN', '')
+if app.config['NOTIFY_URL'] and not app.config['WEBHOOK_TOKEN']:
+    print("⚠️ SMS_NOTIFY_URL is set but SMS_WEBHOOK_TOKEN is not: "
+          "pushed delivery reports will be refused")
+# Calling code applied to numbers in national format, e.g. 254
+app.config['DEFAULT_COUNTRY'] = os.environ.get('SMS_DEFAULT_COUNTRY', '')
+# Price of one SMS segment for /api/estimate (optional)
+app.config['PRICE_PER_SEGMENT'] = os.environ.get('SMS_PRICE_PER_SEGMENT', '')
 
 # Initialize SMS client
-sms_client = SMSClient(API_KEY, API_BASE_URL, SENDER_ID)
+sms_client = SMSClient(API_KEY, API_BASE_URL, SENDER_ID,
+                       notify_url=app.config['NOTIFY_URL'] or None,
+                       default_country=app.config['DEFAULT_COUNTRY'] or None,
+                       send_cache=SendCache(app.config['SEND_CACHE_PATH'],
+                                            key_ttl=app.config['IDEMPOTENCY_TTL'],
+                                            max_keys=app.config['IDEMPOTENCY_MAX_KEYS'],
+                                            dedup_window=app.config['SEND_DEDUP_WINDOW']),
+                       connect_timeout=app.config['CONNECT_TIMEOUT'],
+                       read_timeout=app.config['READ_TIMEOUT'],
+                       pool_size=app.config['POOL_SIZE'] or None,
+                       pool_block=app.config['POOL_BLOCK'],
+                       idle_timeout=app.config['IDLE_TIMEOUT'] or None,
+                       tcp_keepalive=app.config['TCP_KEEPALIVE'] or None,
+                       endpoints=EndpointSet(
+                           [API_BASE_URL] + app.config['FALLBACK_URLS'].split(','),
+                           failure_rate=app.config['BREAKER_FAILURE_RATE'],
+                           min_calls=app.config['BREAKER_MIN_CALLS'],
+                           slow_call=app.config['BREAKER_SLOW_CALL'] or None,
+                           reset_timeout=app.config['BREAKER_RESET_TIMEOUT']))
+
+# Outbox is opened on first use so importing the app has no side effects
+_outbox = None
+
+def get_outbox():
+    global _outbox
+    if _outbox is None:
+        _outbox = SMSOutbox(app.config['OUTBOX_PATH'])
+    return _outbox
+
+_contact_store = None
+
+def get_contact_store():
+    global _contact_store
+    if _contact_store is None:
+        _contact_store = ContactListStore(app.config['CONTACTS_PATH'],
+                                          retention=app.config['CONTACT_LIST_TTL'])
+    return _contact_store
+
+_job_store = None
+_job_runner = None
+
+def get_job_store():
+    global _job_store
+    if _job_store is None:
+        _job_store = JobStore(app.config['JOBS_PATH'])
+    return _job_store
+
+def get_job_runner():
+    global _job_runner
+    if _job_runner is None:
+        _job_runner = SendJobRunner(sms_client, get_job_store(), workers=app.config['JOB_WORKERS'])
+    return _job_runner
+
+_coalescer = None
+
+def get_coalescer():
+    global _coalescer
+    if _coalescer is None and app.config['COALESCE_WINDOW'] > 0:
+        _coalescer = SendCoalescer(sms_client, window=app.config['COALESCE_WINDOW'],
+                                   max_batch=app.config['COALESCE_MAX_BATCH'])
+    return _coalescer
+
+_schedule_store = None
+
+def get_schedule_store():
+    global _schedule_store
+    if _schedule_store is None:
+        _schedule_store = ScheduleStore(app.config['SCHEDULE_PATH'])
+    return _schedule_store
+
+_balance_cache = None
+
+def get_balance_cache():
+    global _balance_cache
+    if _balance_cache is None:
+        _balance_cache = SharedTTLCache(app.config['CACHE_PATH'],
+                                        ttl=app.config['BALANCE_TTL'],
+                                        stale_ttl=app.config['BALANCE_STALE_TTL'],
+                                        error_ttl=app.config['BALANCE_ERROR_TTL'])
+    return _balance_cache
+
+def _permanent_api_error(e):
+    """Status code of errors worth caching (bad key or missing permission)"""
+    if isinstance(e, SMSAPIError) and e.status_code in (401, 403):
+        return e.status_code
+    return None
+
+_report_store = None
+_report_syncer = None
+
+def get_report_store():
+    global _report_store, _report_syncer
+    if _report_store is None:
+        _report_store = DeliveryReportStore(app.config['REPORTS_PATH'])
+        if app.config['REPORTS_SYNC_INTERVAL'] > 0:
+            _report_syncer = ReportSyncer(sms_client, _report_store,
+                                          app.config['REPORTS_SYNC_INTERVAL'])
+            _report_syncer.start()
+    return _report_store
+
+_report_ingestor = None
+
+def get_report_ingestor():
+    global _report_ingestor
+    if _report_ingestor is None:
+        _report_ingestor = ReportIngestor(get_report_store())
+    return _report_ingestor
 
-# Allowed file extensions for phone number uploads
+http_metrics = RequestMetrics(REGISTRY)
+_metrics_dir = None
+
+def get_metrics_dir():
+    global _metrics_dir
+    if _metrics_dir is None and app.config['METRICS_DIR']:
+        _metrics_dir = SnapshotDirectory(REGISTRY, app.config['METRICS_DIR'])
+    return _metrics_dir
+
+CIRCUIT_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+def _process_metrics():
+    """Scrape-time metrics of this worker process"""
+    import psutil
+    process = psutil.Process(os.getpid())
+    labels = {'pid': str(os.getpid())}
+    retry = sms_client.retry_policy.snapshot()
+    budget = retry.pop('budget_tokens')
+    pool = sms_client.pool_stats()
+    pool.pop('hit_ratio')
+    circuits = sms_client.endpoints.snapshot()
+    families = [
+        ('sms_process_resident_memory_bytes', 'gauge', 'Resident memory of the worker',
+         [(labels, process.memory_info().rss)]),
+        ('sms_process_threads', 'gauge', 'Threads in the worker', [(labels, process.num_threads())]),
+        ('sms_retry_events_total', 'counter', 'Retry policy events of the worker',
+         [(dict(labels, event=event), value) for event, value in sorted(retry.items())]),
+        ('sms_retry_budget_tokens', 'gauge', 'Retries the worker may still spend',
+         [(labels, budget)]),
+        ('sms_http_pool_events_total', 'counter',
+         'Connection pool events of the worker: hits (connection reused), misses (new '
+         'connection), reaped, discarded and exhausted',
+         [(dict(labels, event=event), value) for event, value in sorted(pool.items())]),
+        ('sms_circuit_state', 'gauge',
+         'Circuit breaker state per API endpoint: 0 closed, 1 half-open, 2 open',
+         [(dict(labels, url=c['url']), CIRCUIT_STATE_VALUES[c['state']]) for c in circuits]),
+        ('sms_circuit_events_total', 'counter',
+         'Circuit breaker events per API endpoint: calls, failures, slow calls, '
+         'rejected calls and times opened',
+         [(dict(labels, url=c['url'], event=event), c[event]) for c in circuits
+          for event in ('calls', 'failures', 'slow_calls', 'rejected', 'opened')]),
+    ]
+    if _coalescer is not None:
+        families.append(('sms_coalescer_events_total', 'counter',
+                         'Coalesced sends of the worker: calls, recipients, batches and '
+                         'upstream requests',
+                         [(dict(labels, event=event), value)
+                          for event, value in sorted(_coalescer.stats.items())]))
+    if _balance_cache is not None:
+        families.append(('sms_balance_cache_events_total', 'counter',
+                         'Balance cache lookups of the worker by result',
+                         [(dict(labels, result=result), value)
+                          for result, value in sorted(_balance_cache.stats.items())]))
+    return families
+
+REGISTRY.add_collector(_process_metrics)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_metrics.observe(route, request.method, response.status_code,
+                             time.perf_counter() - start)
+        metrics_dir = get_metrics_dir()
+        if metrics_dir is not None:
+            metrics_dir.flush()
+    return response
+
+# Allowed file extensions for phone number uploads (optionally gzipped)
 ALLOWED_EXTENSIONS = {'txt', 'csv'}
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    name = filename.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return '.' in name and name.rsplit('.', 1)[1] in ALLOWED_EXTENSIONS
 
-def parse_phone_numbers_from_file(filepath):
-    """Extract phone numbers from uploaded file"""
-    phone_numbers = []
+def read_phone_numbers_from_file(filepath, column=0):
+    """Extract raw phone number entries from uploaded file"""
     try:
-        with open(filepath, 'r', encoding='utf-8') as file:
-            for line in file:
-                line = line.strip()
-                if line and not line.startswith('#'):  # Skip comments
-                    # Handle CSV format (take first column)
-                    if ',' in line:
-                        phone = line.split(',')[0].strip()
-                    else:
-                        phone = line
-                    
-                    if phone:
-                        phone_numbers.append(phone)
-    except Exception as e:
+        with open(filepath, 'rb') as file:
+            return list(read_phone_numbers(file, column))
+    except (OSError, ValueError) as e:
         print(f"Error reading file: {e}")
-    
-    return phone_numbers
+        return []
+
+def parse_phone_numbers_from_file(filepath, default_country=None, column=0):
+    """Extract unique E.164 phone numbers from uploaded file"""
+    with open(filepath, 'rb') as file:
+        return normalize_stream(read_phone_numbers(file, column), default_country)['numbers']
+
+def _multipart_events(stream, boundary):
+    """Yield multipart events while reading the request body in chunks"""
+    decoder = MultipartDecoder(boundary)
+    finished = False
+    while True:
+        event = decoder.next_event()
+        if event is NEED_DATA:
+            if finished:
+                raise ValueError('Incomplete multipart upload')
+            chunk = stream.read(CHUNK_SIZE)
+            finished = not chunk
+            decoder.receive_data(chunk or None)
+        elif isinstance(event, Epilogue):
+            return
+        else:
+            yield event
+
+def open_upload_stream(field='file', form=None):
+    """
+    Locate a file field in a multipart request without buffering it
+
+    Args:
+        field: Name of the file field
+        form: Dict that receives the text fields sent before the file
+
+    Returns:
+        (filename, generator of content chunks), or (None, None) if the
+        request has no such field
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return None, None
+
+    events = _multipart_events(request.stream, boundary.encode('latin-1'))
+    values = {}
+    current = None
+    for event in events:
+        if isinstance(event, File) and event.name == field:
+            if form is not None:
+                form.update((name, bytes(value).decode('utf-8', 'replace'))
+                            for name, value in values.items())
+
+            def content():
+                for data in events:
+                    if not isinstance(data, Data):
+                        break
+                    yield data.data
+                    if not data.more_data:
+                        break
+            return event.filename, content()
+        if isinstance(event, Data):
+            if current is not None:
+                current += event.data
+        elif isinstance(event, Field) and not isinstance(event, File):
+            current = values.setdefault(event.name, bytearray())
+        else:
+            # The content of other files is skipped
+            current = None
+    return None, None
 
 @app.route('/')
 def index():
@@ -93,37 +414,104 @@ def balance():
     """Account balance page"""
     return render_template('balance.html')
 
+def read_send_request(data):
+    """
+    Recipients and message of a send request body
+    
+    Returns:
+        ((phone_numbers, message, sender, callback_data), None), or
+        (None, error response) if the request is incomplete
+    """
+    phone_numbers = data.get('phone_numbers', [])
+    message = data.get('message', '').strip()
+    sender = data.get('sender', '').strip() or None
+    callback_data = data.get('callback_data') or None
+    
+    list_id = data.get('list_id')
+    if list_id:
+        # Recipients of an uploaded list are read from the server-side store
+        try:
+            phone_numbers = get_contact_store().numbers(list_id)
+        except (KeyError, ValueError):
+            return None, (jsonify({'error': f'Contact list not found: {list_id}'}), 404)
+    
+    if not phone_numbers:
+        return None, (jsonify({'error': 'No phone numbers provided'}), 400)
+    
+    if not message:
+        return None, (jsonify({'error': 'Message is required'}), 400)
+    
+    # Convert single phone number to list
+    if isinstance(phone_numbers, str):
+        phone_numbers = [phone_numbers]
+    
+    # Clean phone numbers
+    phone_numbers = [p.strip() for p in phone_numbers if p.strip()]
+    return (phone_numbers, message, sender, callback_data), None
+
+def request_idempotency_key(data):
+    """Idempotency key from the Idempotency-Key header or the request body"""
+    return request.headers.get('Idempotency-Key') or data.get('idempotency_key') or None
+
+def idempotency_conflict(e):
+    """409 while the key's first request runs, 422 for a key reused with other data"""
+    return jsonify({'error': str(e)}), 409 if e.in_progress else 422
+
 @app.route('/api/send-sms', methods=['POST'])
 def api_send_sms():
-    """API endpoint to send SMS"""
+    """API endpoint to send SMS
+    
+    A request repeated with the same Idempotency-Key header (or
+    idempotency_key field) gets the first request's result, marked
+    'replayed', without sending again.
+    """
     try:
         data = request.get_json()
+        send, error = read_send_request(data)
+        if error:
+            return error
+        phone_numbers, message, sender, callback_data = send
+        key = request_idempotency_key(data)
         
-        phone_numbers = data.get('phone_numbers', [])
-        message = data.get('message', '').strip()
-        sender = data.get('sender', '').strip() or None
-        
-        if not phone_numbers:
-            return jsonify({'error': 'No phone numbers provided'}), 400
-        
-        if not message:
-            return jsonify({'error': 'Message is required'}), 400
-        
-        # Convert single phone number to list
-        if isinstance(phone_numbers, str):
-            phone_numbers = [phone_numbers]
-        
-        # Clean phone numbers
-        phone_numbers = [p.strip() for p in phone_numbers if p.strip()]
+        if data.get('queue'):
+            # Hand the batch to the outbox worker instead of sending inline
+            normalized = normalize_numbers(phone_numbers, sms_client.default_country)
+            if normalized['rejects']:
+                phone, reason = normalized['rejects'][0]
+                return jsonify({'error': f'Invalid phone number format: {phone} ({reason})',
+                                'rejects': normalized['rejects'][:100]}), 400
+            
+            def enqueue():
+                return get_outbox().enqueue(normalized['numbers'], message, sender=sender)
+            
+            if key:
+                fingerprint = request_fingerprint('queue', normalized['numbers'], message, sender)
+                queued = sms_client.send_cache.run(key, fingerprint, enqueue)
+            else:
+                queued = enqueue()
+            return jsonify({
+                'success': True,
+                'queued': queued['count'],
+                'batch_id': queued['batch_id'],
+                'replayed': queued.get('replayed', False)
+            }), 202
         
         start_time = time.time()
-        response = sms_client.send_sms(phone_numbers, message, sender=sender)
+        coalescer = get_coalescer()
+        if coalescer is not None and len(phone_numbers) <= MAX_RECIPIENTS:
+            # Small sends from concurrent requests share upstream requests
+            response = coalescer.send(phone_numbers, message, sender=sender,
+                                      callback_data=callback_data, idempotency_key=key)
+        else:
+            response = sms_client.send_bulk(phone_numbers, message, sender=sender,
+                                            callback_data=callback_data, idempotency_key=key)
         end_time = time.time()
         
         # Process response
         messages = response.get('messages', [])
+        failed_recipients = response.get('failedRecipients', [])
         success_count = sum(1 for msg in messages if msg.get('status', {}).get('groupName') == 'PENDING')
-        total_count = len(messages)
+        total_count = len(messages) + len(failed_recipients)
         
         result = {
             'success': True,
@@ -131,62 +519,349 @@ def api_send_sms():
             'successful': success_count,
             'failed': total_count - success_count,
             'bulk_id': response.get('bulkId'),
+            'bulk_ids': response.get('bulkIds', []),
+            'failed_recipients': failed_recipients,
+            'duplicates': response.get('duplicates', 0),
+            'suppressed': len(response.get('suppressed', [])),
+            'replayed': response.get('replayed', False),
+            'coalesced': response.get('coalesced', 0),
+            'chunks': response.get('chunks', []),
             'duration': round(end_time - start_time, 3),
             'messages': messages
         }
         
         return jsonify(result)
         
+    except IdempotencyConflict as e:
+        return idempotency_conflict(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/outbox/<batch_id>')
+def api_outbox_status(batch_id):
+    """API endpoint to check progress of a queued batch"""
+    counts = get_outbox().batch_status(batch_id)
+    if not counts:
+        return jsonify({'error': 'Unknown batch ID'}), 404
+    
+    return jsonify({
+        'success': True,
+        'batch_id': batch_id,
+        'total': sum(counts.values()),
+        'counts': counts
+    })
+
+@app.route('/api/jobs', methods=['POST'])
+def api_submit_job():
+    """
+    API endpoint to start a send in the background
+    
+    Takes the same body as /api/send-sms and returns a job ID straight
+    away; progress is at /api/jobs/<job_id> and streamed from
+    /api/jobs/<job_id>/events.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        send, error = read_send_request(data)
+        if error:
+            return error
+        phone_numbers, message, sender, callback_data = send
+        
+        try:
+            job = get_job_runner().submit(phone_numbers, message, sender=sender,
+                                          callback_data=callback_data,
+                                          idempotency_key=request_idempotency_key(data))
+        except IdempotencyConflict as e:
+            return idempotency_conflict(e)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if job is None:
+            return jsonify({'error': 'Too many send jobs in progress, retry later'}), 503
+        
+        return jsonify({
+            'success': True,
+            'job': job,
+            'status_url': url_for('api_job_status', job_id=job['job_id']),
+            'events_url': url_for('api_job_events', job_id=job['job_id'])
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """API endpoint to check progress of a send job"""
+    job = get_job_store().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job ID'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs/<job_id>/events')
+def api_job_events(job_id):
+    """
+    Server-Sent Events stream of a send job's progress
+    
+    Sends a 'progress' event on every change and a final 'done' event.
+    Streams end after JOB_STREAM_TIMEOUT seconds so they never hold a
+    worker for long; EventSource reconnects with Last-Event-ID and picks
+    up where it left off.
+    """
+    store = get_job_store()
+    if store.get(job_id) is None:
+        return jsonify({'error': 'Unknown job ID'}), 404
+    
+    try:
+        since_version = int(request.headers.get('Last-Event-ID', -1))
+    except ValueError:
+        since_version = -1
+    timeout = app.config['JOB_STREAM_TIMEOUT']
+    
+    def events():
+        yield 'retry: 1000\n\n'
+        for job in store.watch(job_id, since_version, timeout=timeout):
+            event = 'done' if job['status'] in JOB_FINISHED else 'progress'
+            yield f"id: {job['version']}\nevent: {event}\ndata: {json.dumps(job)}\n\n"
+    
+    return Response(events(), content_type='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/schedules', methods=['POST'])
+def api_create_schedule():
+    """
+    API endpoint to schedule a send
+    
+    Takes the /api/send-sms body plus 'send_at' (ISO 8601 or Unix time),
+    'timezone', 'window' ('HH:MM-HH:MM' local hours messages are held
+    to), 'recurrence' ('hourly', 'daily' or 'weekly'), 'until', and
+    'recipient_timezones' mapping numbers to their own time zones.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        send, error = read_send_request(data)
+        if error:
+            return error
+        phone_numbers, message, sender, callback_data = send
+        
+        normalized = normalize_numbers(phone_numbers, sms_client.default_country)
+        if normalized['rejects']:
+            phone, reason = normalized['rejects'][0]
+            return jsonify({'error': f'Invalid phone number format: {phone} ({reason})',
+                            'rejects': normalized['rejects'][:100]}), 400
+        
+        try:
+            zone = data.get('timezone') or 'UTC'
+            send_at = data.get('send_at')
+            send_at = parse_send_time(send_at, zone) if send_at not in (None, '') else time.time()
+            until = data.get('until')
+            until = parse_send_time(until, zone) if until not in (None, '') else None
+            # Per-recipient zones are keyed by the number as the client sent it
+            zones = {}
+            for phone, tz in (data.get('recipient_timezones') or {}).items():
+                number, _ = normalize_number(phone, sms_client.default_country)
+                if number:
+                    zones[number] = tz
+            scheduled = get_schedule_store().add(
+                ((number, zones.get(number)) for number in normalized['numbers']),
+                message, send_at, sender=sender, callback_data=callback_data, zone=zone,
+                window=data.get('window') or None, recurrence=data.get('recurrence') or None,
+                until=until)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'success': True,
+            'schedule_id': scheduled['schedule_id'],
+            'count': scheduled['count'],
+            'next_due': scheduled['next_due'],
+            'status_url': url_for('api_schedule', schedule_id=scheduled['schedule_id'])
+        }), 201
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/schedules/<schedule_id>', methods=['GET', 'DELETE'])
+def api_schedule(schedule_id):
+    """API endpoint to check or cancel a scheduled send"""
+    store = get_schedule_store()
+    if request.method == 'DELETE':
+        cancelled = store.cancel(schedule_id)
+        if cancelled is None:
+            return jsonify({'error': 'Unknown schedule ID'}), 404
+        return jsonify({'success': True, 'schedule_id': schedule_id, 'cancelled': cancelled})
+    
+    schedule = store.get(schedule_id)
+    if schedule is None:
+        return jsonify({'error': 'Unknown schedule ID'}), 404
+    return jsonify({'success': True, 'schedule': schedule})
+
+@app.route('/api/estimate', methods=['POST'])
+def api_estimate():
+    """API endpoint to price a send without contacting Infobip"""
+    data = request.get_json(silent=True) or {}
+    message = data.get('message', '').strip()
+    
+    if not message:
+        return jsonify({'error': 'Message is required'}), 400
+    
+    phone_numbers = data.get('phone_numbers')
+    if phone_numbers is not None:
+        if isinstance(phone_numbers, str):
+            phone_numbers = [phone_numbers]
+        recipients = len(normalize_numbers(phone_numbers, sms_client.default_country)['numbers'])
+    else:
+        try:
+            recipients = int(data.get('recipients', 1))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'recipients must be a number'}), 400
+    
+    price = app.config['PRICE_PER_SEGMENT']
+    estimate = estimate_campaign(message, recipients, float(price) if price else None)
+    return jsonify({'success': True, 'estimate': estimate})
+
+@app.route('/api/estimate-template', methods=['POST'])
+def api_estimate_template():
+    """API endpoint to price a personalized send from a CSV upload
+
+    Multipart form with a 'message' field holding the template, sent
+    before the 'file' field. Placeholders like {name} are filled from
+    each row's columns; ?column= selects the phone column and ?preview=
+    the number of rendered rows returned with their segment counts. The
+    file is rendered and counted as it arrives, nothing is stored.
+    """
+    try:
+        form = {}
+        filename, content = open_upload_stream('file', form)
+        if content is None:
+            return jsonify({'error': 'No file uploaded'}), 400
+        if not allowed_file(filename):
+            return jsonify({'error': 'Invalid file format. Only .txt and .csv files '
+                                     '(optionally .gz) are allowed'}), 400
+        message = form.get('message', '').strip()
+        if not message:
+            return jsonify({'error': 'A message template is required, '
+                                     'sent before the file'}), 400
+        
+        template = MessageTemplate(message)
+        preview = min(int(request.args.get('preview', DEFAULT_PREVIEW_SIZE)), 100)
+        chunks = iter_decompressed(content, app.config['MAX_UPLOAD_BYTES'])
+        rendered = iter_rendered(iter_rows(iter_lines(chunks)), template,
+                                 request.args.get('column', 0))
+        price = app.config['PRICE_PER_SEGMENT']
+        estimate = estimate_personalized(rendered, float(price) if price else None, preview)
+        
+        return jsonify({'success': True, 'fields': template.fields, 'estimate': estimate})
+        
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return too_large(None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/webhooks/delivery-reports', methods=['POST'])
+def delivery_report_webhook():
+    """Receive delivery reports pushed by Infobip to the notifyUrl"""
+    token = app.config['WEBHOOK_TOKEN']
+    if not token:
+        return jsonify({'error': 'Webhook disabled: SMS_WEBHOOK_TOKEN is not set'}), 403
+    if not hmac.compare_digest(request.args.get('token', ''), token):
+        return jsonify({'error': 'Invalid token'}), 403
+    
+    data = request.get_json(silent=True)
+    reports = data.get('results') if isinstance(data, dict) else None
+    if not isinstance(reports, list):
+        return jsonify({'error': 'Expected a "results" array'}), 400
+    for index, report in enumerate(reports):
+        problem = report_problem(report)
+        if problem:
+            return jsonify({'error': f'Invalid report at results[{index}]: {problem}'}), 400
+    
+    # Acknowledge straight away; the ingestor writes in the background
+    if not get_report_ingestor().submit(reports):
+        return jsonify({'error': 'Report queue is full, retry later'}), 503
+    
+    return jsonify({'accepted': len(reports)}), 202
+
 @app.route('/api/upload-phones', methods=['POST'])
 def api_upload_phones():
-    """API endpoint to upload phone numbers file"""
+    """API endpoint to upload phone numbers file
+
+    The body is parsed as it arrives: no temp file is written and only the
+    unique numbers are kept in memory. ?column= selects the phone column of
+    a CSV by index or header name.
+    """
     try:
-        if 'file' not in request.files:
+        filename, content = open_upload_stream('file')
+        if content is None:
             return jsonify({'error': 'No file uploaded'}), 400
         
-        file = request.files['file']
-        if file.filename == '':
+        if filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            timestamp = str(int(time.time()))
-            filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Parse phone numbers
-            phone_numbers = parse_phone_numbers_from_file(filepath)
-            
-            # Clean up uploaded file
-            os.remove(filepath)
-            
-            if not phone_numbers:
-                return jsonify({'error': 'No valid phone numbers found in file'}), 400
-            
-            return jsonify({
-                'success': True,
-                'phone_numbers': phone_numbers,
-                'count': len(phone_numbers)
-            })
+        if not allowed_file(filename):
+            return jsonify({'error': 'Invalid file format. Only .txt and .csv files '
+                                     '(optionally .gz) are allowed'}), 400
+        
+        # Parse and canonicalize phone numbers
+        chunks = iter_decompressed(content, app.config['MAX_UPLOAD_BYTES'])
+        raw_numbers = iter_phone_column(iter_rows(iter_lines(chunks)),
+                                        request.args.get('column', 0))
+        normalized = normalize_stream(raw_numbers, app.config['DEFAULT_COUNTRY'] or None)
         
-        return jsonify({'error': 'Invalid file format. Only .txt and .csv files are allowed'}), 400
+        if not normalized['numbers']:
+            return jsonify({'error': 'No valid phone numbers found in file',
+                            'rejects': normalized['rejects']}), 400
         
+        # Keep the list server-side; the browser only gets its ID and a preview
+        store = get_contact_store()
+        contact_list = store.create(normalized['numbers'], filename=filename,
+                                    duplicates=normalized['duplicates'],
+                                    rejected=normalized['rejected'])
+        
+        return jsonify({
+            'success': True,
+            'list_id': contact_list['list_id'],
+            'count': contact_list['count'],
+            'preview': normalized['numbers'][:DEFAULT_PREVIEW_SIZE],
+            'duplicates': normalized['duplicates'],
+            'rejected': normalized['rejected'],
+            'rejects': normalized['rejects']
+        })
+        
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return too_large(None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/contact-lists/<list_id>', methods=['GET', 'DELETE'])
+def api_contact_list(list_id):
+    """API endpoint to inspect or delete an uploaded contact list"""
+    try:
+        store = get_contact_store()
+        info = store.info(list_id)
+        if info is None:
+            return jsonify({'error': 'Contact list not found'}), 404
+        
+        if request.method == 'DELETE':
+            store.delete(list_id)
+            return jsonify({'success': True, 'deleted': list_id})
+        
+        return jsonify(dict(info, success=True, preview=store.preview(list_id)))
+    except ValueError:
+        return jsonify({'error': 'Contact list not found'}), 404
+
 @app.route('/api/balance')
 def api_balance():
-    """API endpoint to check account balance"""
+    """API endpoint to check account balance (cached, see BALANCE_TTL)"""
     try:
-        balance_info = sms_client.check_account_balance()
-        return jsonify({
-            'success': True,
-            'balance': balance_info
-        })
+        entry = get_balance_cache().get('balance', sms_client.check_account_balance,
+                                        cache_error=_permanent_api_error)
+        freshness = {'cached': entry['cached'], 'age': entry['age'], 'stale': entry['stale']}
+        if entry['error'] is not None:
+            return jsonify(dict(freshness, success=False, error=entry['error']))
+        return jsonify(dict(freshness, success=True, balance=entry['value']))
     except Exception as e:
         return jsonify({
             'success': False,
@@ -195,25 +870,61 @@ def api_balance():
 
 @app.route('/api/reports')
 def api_reports():
-    """API endpoint to get delivery reports"""
+    """API endpoint to page through delivery reports in the local store
+
+    Pages are keyset-paginated: pass the returned next_cursor as ?cursor=
+    to get the following page. sort is -sent (newest first) or sent.
+    """
     try:
-        bulk_id = request.args.get('bulk_id')
-        limit = int(request.args.get('limit', 50))
+        phone = request.args.get('phone')
+        if phone:
+            phone = normalize_number(phone, sms_client.default_country)[0] or phone
         
-        kwargs = {'limit': limit}
-        if bulk_id:
-            kwargs['bulk_id'] = bulk_id
+        sort = request.args.get('sort', '-sent')
+        if sort not in ('-sent', 'sent'):
+            return jsonify({'success': False, 'error': 'sort must be -sent or sent'}), 400
         
-        reports_response = sms_client.get_delivery_reports(**kwargs)
+        filters = {
+            'bulk_id': request.args.get('bulk_id'),
+            'message_id': request.args.get('message_id'),
+            'recipient': phone,
+            'status': request.args.get('status'),
+            'since': parse_timestamp(request.args.get('since')),
+            'until': parse_timestamp(request.args.get('until'))
+        }
+        cursor = request.args.get('cursor')
         
-        # Extract the results array from the API response
-        reports = reports_response.get('results', [])
+        store = get_report_store()
+        reports, next_cursor = store.page(limit=int(request.args.get('limit', 50)),
+                                          cursor=cursor, ascending=(sort == 'sent'),
+                                          **filters)
+        last_sync = store.get_state('last_sync')
         
-        return jsonify({
+        result = {
             'success': True,
             'reports': reports,
-            'total': len(reports)
+            'total': len(reports),
+            'next_cursor': next_cursor,
+            'synced_at': float(last_sync) if last_sync else None
+        }
+        if not cursor:
+            # Size of the whole result set, for the first page only
+            result['matching'] = store.count(**filters)
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
         })
+
+@app.route('/api/reports/sync', methods=['POST'])
+def api_reports_sync():
+    """API endpoint to pull pending delivery reports from Infobip into the store"""
+    try:
+        totals = sync_reports(sms_client, get_report_store())
+        return jsonify(dict(totals, success=True))
     except Exception as e:
         return jsonify({
             'success': False,
@@ -222,7 +933,8 @@ def api_reports():
 
 @app.errorhandler(413)
 def too_large(e):
-    return jsonify({'error': 'File too large. Maximum size is 16MB'}), 413
+    limit_mb = app.config['MAX_UPLOAD_BYTES'] // (1024 * 1024)
+    return jsonify({'error': f'File too large. Maximum size is {limit_mb}MB'}), 413
 
 @app.errorhandler(404)
 def not_found(e):
@@ -232,26 +944,59 @@ def not_found(e):
 def internal_error(e):
     return render_template('500.html'), 500
 
+def upstream_status() -> str:
+    """'healthy', 'degraded' (a circuit is not closed) or 'unavailable' (all open)"""
+    endpoints = sms_client.endpoints
+    if endpoints.healthy:
+        return 'healthy'
+    return 'degraded' if endpoints.available else 'unavailable'
+
 @app.route('/health')
 def health_check():
     """Health check endpoint for monitoring"""
     from datetime import datetime
     import sys
+    # Always 200 while the process answers: this is the container's
+    # liveness check, and a restart does not bring Infobip back. Circuit
+    # state is reported in the body; /ready turns it into a status code
     return jsonify({
         'status': 'healthy',
+        'upstream_status': upstream_status(),
         'timestamp': datetime.now().isoformat(),
         'version': '2.0.0-apple-inspired',
         'python_version': sys.version,
-        'app_name': 'SMS Web Application'
+        'app_name': 'SMS Web Application',
+        'upstream': sms_client.endpoints.snapshot()
     })
 
+@app.route('/ready')
+def readiness_check():
+    """Readiness endpoint: 503 while every API endpoint's circuit is open"""
+    status = upstream_status()
+    return jsonify({
+        'status': status,
+        'upstream': sms_client.endpoints.snapshot()
+    }), 503 if status == 'unavailable' else 200
+
 @app.route('/metrics')
 def metrics():
-    """Basic metrics endpoint"""
+    """
+    Metrics endpoint
+    
+    Serves the Prometheus text format to scrapers (Accept: text/plain or
+    ?format=prometheus) and a JSON summary of this process otherwise.
+    """
     import os
     import psutil
     from datetime import datetime
     
+    scraper = any(mimetype.startswith(('text/plain', 'application/openmetrics-text'))
+                  for mimetype, _ in request.accept_mimetypes)
+    if scraper or request.args.get('format') == 'prometheus':
+        metrics_dir = get_metrics_dir()
+        snapshots = metrics_dir.collect() if metrics_dir is not None else None
+        return Response(REGISTRY.render(snapshots), content_type=CONTENT_TYPE)
+    
     try:
         process = psutil.Process(os.getpid())
         memory_info = process.memory_info()
@@ -261,7 +1006,11 @@ def metrics():
             'memory_usage_mb': round(memory_info.rss / 1024 / 1024, 2),
             'cpu_percent': process.cpu_percent(),
             'uptime_seconds': round(time.time() - process.create_time(), 2),
-            'threads': process.num_threads()
+            'threads': process.num_threads(),
+            'sms_client': sms_client.retry_policy.snapshot(),
+            'connection_pool': sms_client.pool_stats(),
+            'balance_cache': dict(_balance_cache.stats) if _balance_cache else {},
+            'coalescer': dict(_coalescer.stats) if _coalescer else {}
         })
     except Exception as e:
         return jsonify({
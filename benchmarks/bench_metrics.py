@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark for metrics instrumentation overhead
+
+Times what SMSClient adds to every upstream request attempt (two
+perf_counter calls and a histogram observation) and what the web app
+adds to every request, single-threaded and with threads contending for
+the same series as in send_bulk.
+
+Run with: python benchmarks/bench_metrics.py [calls]
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sms_metrics import ClientMetrics, Registry, RequestMetrics
+
+# Overhead is judged against a fast (same-region) Infobip round trip
+UPSTREAM_LATENCY = 0.001
+TARGET_FRACTION = 0.01
+THREADS = 8
+
+
+def instrumented_call(metrics: ClientMetrics, attempt):
+    """The per-attempt wrapper used by SMSClient._call"""
+    start = time.perf_counter()
+    result = attempt()
+    metrics.observe_call('send', '2xx', time.perf_counter() - start)
+    return result
+
+
+def best_of(func, calls: int, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(calls)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    client_metrics = ClientMetrics(Registry())
+    request_metrics = RequestMetrics(Registry())
+    attempt = dict
+
+    def bare(n):
+        for _ in range(n):
+            attempt()
+
+    def client(n):
+        for _ in range(n):
+            instrumented_call(client_metrics, attempt)
+
+    def web(n):
+        for _ in range(n):
+            request_metrics.observe('/api/send-sms', 'POST', 200, 0.004)
+
+    def contended(n):
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            list(executor.map(client, [n // THREADS] * THREADS))
+
+    baseline = best_of(bare, calls)
+    results = [
+        ('SMSClient attempt', best_of(client, calls) - baseline),
+        ('Flask request', best_of(web, calls)),
+        (f'SMSClient attempt, {THREADS} threads', best_of(contended, calls) - baseline),
+    ]
+
+    worst = 0.0
+    for name, elapsed in results:
+        per_call = elapsed / calls
+        worst = max(worst, per_call)
+        print(f"{name:<32} {per_call * 1e9:8.0f} ns/call "
+              f"({per_call / UPSTREAM_LATENCY:.3%} of a {UPSTREAM_LATENCY * 1000:g} ms request)")
+
+    print("✅ Meets" if worst <= UPSTREAM_LATENCY * TARGET_FRACTION else "❌ Above",
+          f"target of {TARGET_FRACTION:.0%} of a {UPSTREAM_LATENCY * 1000:g} ms request")
+
+
+if __name__ == '__main__':
+    main()
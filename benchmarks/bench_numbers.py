@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Benchmark for phone number normalization
+
+Generates a mix of international, separator-formatted and national
+numbers (with some duplicates) and reports normalize_numbers throughput.
+
+Run with: python benchmarks/bench_numbers.py [count]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sms_numbers import normalize_numbers
+
+TARGET_PER_SECOND = 1_000_000
+
+
+def make_numbers(count: int, seed: int = 42):
+    """Build count numbers in the formats seen in real uploads"""
+    rng = random.Random(seed)
+    numbers = []
+    for i in range(count):
+        local = str(rng.randrange(700000000, 799999999))
+        style = i % 4
+        if style == 0:
+            numbers.append('+254' + local)
+        elif style == 1:
+            numbers.append(f'+254 {local[:3]}-{local[3:]}')
+        elif style == 2:
+            numbers.append('254' + local)
+        else:
+            numbers.append('0' + local)
+    return numbers
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    numbers = make_numbers(count)
+
+    best = float('inf')
+    for _ in range(5):
+        start = time.perf_counter()
+        result = normalize_numbers(numbers, default_country='254')
+        best = min(best, time.perf_counter() - start)
+
+    rate = count / best
+    print(f"Normalized {count:,} numbers in {best:.3f}s "
+          f"({rate:,.0f} numbers/s, single thread)")
+    print(f"  unique: {len(result['numbers']):,}  duplicates: {result['duplicates']:,}  "
+          f"rejects: {len(result['rejects']):,}")
+    print("✅ Meets" if rate >= TARGET_PER_SECOND else "❌ Below",
+          f"target of {TARGET_PER_SECOND:,} numbers/s")
+
+
+if __name__ == '__main__':
+    main()
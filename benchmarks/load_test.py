@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Load test for the web app's /api/send-sms
+
+Drives the endpoint at a series of target request rates (open loop: each
+request is sent on schedule whether or not earlier ones have finished, and
+its latency counts from when it was due) and reports p50/p95/p99 latency,
+achieved requests and messages per second, and errors for every step. The
+first step that misses its rate, errors or p99 target marks the saturation
+point of the server configuration under test.
+
+With --spawn it starts the Infobip emulator (sms_emulator.py) and gunicorn
+itself, with a throwaway config.py pointing the app at the emulator and
+its databases in a temporary directory, so runs cost nothing and leave no
+state behind:
+
+    python benchmarks/load_test.py --spawn --workers 4 --threads 8 --rates 20,50,100,200
+
+Without --spawn it targets an app that is already running (--url), which
+should itself be pointed at an emulator.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import aiohttp
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Constants
+DEFAULT_URL = 'http://127.0.0.1:5001'
+DEFAULT_RATES = '10,25,50,100'
+DEFAULT_DURATION = 20.0
+DEFAULT_RECIPIENTS = 1
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_IN_FLIGHT = 2000
+DEFAULT_SLO_P99 = 1.0
+DEFAULT_MAX_ERROR_RATE = 0.01
+# A step that achieves less than this share of its target rate is saturated
+MIN_RATE_SHARE = 0.95
+APP_PORT = 5011
+EMULATOR_PORT = 8089
+STARTUP_TIMEOUT = 30.0
+TEXT = 'Load test message'
+
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values), max(1, math.ceil(fraction * len(sorted_values)))) - 1
+    return sorted_values[index]
+
+
+def summarize(rate: float, results: List[Dict], elapsed: float) -> Dict:
+    """
+    Summarize one step
+
+    Args:
+        rate: Target requests per second
+        results: One dict per request with 'latency' (seconds), 'ok' and
+            'messages' (recipients accepted upstream)
+        elapsed: Seconds from the first request being due to the last
+            response
+
+    Returns:
+        Dict with counts, achieved 'rps' and 'mps', and 'p50', 'p95',
+        'p99' and 'max' latency in seconds
+    """
+    latencies = sorted(result['latency'] for result in results if result['ok'])
+    errors = sum(1 for result in results if not result['ok'])
+    elapsed = elapsed or 1.0
+    return {
+        'target_rps': rate,
+        'requests': len(results),
+        'errors': errors,
+        'error_rate': errors / len(results) if results else 0.0,
+        'rps': len(latencies) / elapsed,
+        'mps': sum(result['messages'] for result in results) / elapsed,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else None
+    }
+
+
+def saturated(step: Dict, slo_p99: float, max_error_rate: float) -> Optional[str]:
+    """Why a step counts as saturated, or None if it kept up"""
+    if step['rps'] < step['target_rps'] * MIN_RATE_SHARE:
+        return f"achieved {step['rps']:.1f} of {step['target_rps']:g} req/s"
+    if step['error_rate'] > max_error_rate:
+        return f"{step['error_rate']:.1%} errors"
+    if step['p99'] is not None and step['p99'] > slo_p99:
+        return f"p99 {step['p99'] * 1000:.0f} ms over {slo_p99 * 1000:.0f} ms"
+    return None
+
+
+async def run_step(session: aiohttp.ClientSession, url: str, rate: float, duration: float,
+                   recipients: int, max_in_flight: int) -> Dict:
+    """Send requests at rate for duration seconds and summarize them"""
+    semaphore = asyncio.Semaphore(max_in_flight)
+    results = []
+    count = int(rate * duration)
+    started = time.perf_counter()
+
+    async def one(index: int, due: float):
+        # Distinct numbers per request keep the app from deduplicating them
+        numbers = [f'2547{(index * recipients + i) % 10 ** 8:08d}' for i in range(recipients)]
+        result = {'ok': False, 'messages': 0}
+        async with semaphore:
+            try:
+                async with session.post(url, json={'phone_numbers': numbers,
+                                                   'message': TEXT}) as response:
+                    body = await response.json(content_type=None)
+                    result['ok'] = response.status == 200 and bool(body.get('success'))
+                    result['messages'] = body.get('successful', 0) if result['ok'] else 0
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                pass
+        result['latency'] = time.perf_counter() - due
+        results.append(result)
+
+    tasks = []
+    for index in range(count):
+        due = started + index / rate
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(one(index, due)))
+    await asyncio.gather(*tasks)
+    return summarize(rate, results, time.perf_counter() - started)
+
+
+async def run_load(url: str, rates: List[float], duration: float, recipients: int,
+                   timeout: float, max_in_flight: int, slo_p99: float,
+                   max_error_rate: float, stop_at_saturation: bool = True) -> List[Dict]:
+    """Run each rate step in turn, printing a row per step"""
+    steps = []
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        print(f"  {'Target':>7} {'Sent':>7} {'Errors':>7} {'Req/s':>8} {'Msg/s':>8} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for rate in rates:
+            step = await run_step(session, f'{url}/api/send-sms', rate, duration,
+                                  recipients, max_in_flight)
+            step['saturated'] = saturated(step, slo_p99, max_error_rate)
+            steps.append(step)
+            print(f"  {rate:>7g} {step['requests']:>7} {step['errors']:>7} {step['rps']:>8.1f} "
+                  f"{step['mps']:>8.1f} {_ms(step['p50']):>8} {_ms(step['p95']):>8} "
+                  f"{_ms(step['p99']):>8}" + (f"  ⚠️ {step['saturated']}" if step['saturated'] else ''))
+            if step['saturated'] and stop_at_saturation:
+                break
+    return steps
+
+
+def _ms(seconds: Optional[float]) -> str:
+    return '-' if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def _wait_for(url: str, process: subprocess.Popen, name: str):
+    """Poll url until it answers, failing if process exits first"""
+    import requests
+
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited with code {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{name} did not start within {STARTUP_TIMEOUT:g}s")
+
+
+@contextmanager
+def spawn_stack(workers: int, threads: int, worker_class: str, gunicorn_args: str,
+                emulator_args: str) -> Iterator[Dict]:
+    """
+    Start the Infobip emulator and the web app under gunicorn
+
+    Yields:
+        Dict with the app 'url' and the 'emulator' URL
+    """
+    processes = []
+    with tempfile.TemporaryDirectory(prefix='sms-load-') as workdir:
+        emulator_url = f'http://127.0.0.1:{EMULATOR_PORT}'
+        with open(os.path.join(workdir, 'config.py'), 'w') as f:
+            f.write(f'API_BASE_URL = "{emulator_url}"\n'
+                    'SENDER_ID = "LoadTest"\n'
+                    'API_KEY = "load-test"\n')
+        env = dict(os.environ,
+                   PYTHONPATH=os.pathsep.join([workdir, REPO_DIR]),
+                   SMS_OUTBOX_PATH=os.path.join(workdir, 'outbox.db'),
+                   SMS_REPORTS_PATH=os.path.join(workdir, 'reports.db'),
+                   SMS_CACHE_PATH=os.path.join(workdir, 'cache.db'),
+                   SMS_JOBS_PATH=os.path.join(workdir, 'jobs.db'),
+                   SMS_SEND_CACHE_PATH=os.path.join(workdir, 'sends.db'),
+                   SMS_CONTACTS_PATH=os.path.join(workdir, 'contacts'),
+                   SMS_METRICS_DIR=os.path.join(workdir, 'metrics'))
+        try:
+            emulator = subprocess.Popen(
+                [sys.executable, os.path.join(REPO_DIR, 'sms_emulator.py'),
+                 '--port', str(EMULATOR_PORT)] + shlex.split(emulator_args),
+                cwd=workdir, env=env)
+            processes.append(emulator)
+            _wait_for(f'{emulator_url}/emulator/stats', emulator, 'Emulator')
+
+            app_url = f'http://127.0.0.1:{APP_PORT}'
+            gunicorn = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{APP_PORT}',
+                 '--workers', str(workers), '--threads', str(threads),
+                 '--worker-class', worker_class, '--timeout', '30', '--log-level', 'warning']
+                + shlex.split(gunicorn_args) + ['app:app'],
+                cwd=workdir, env=env)
+            processes.append(gunicorn)
+            _wait_for(f'{app_url}/health', gunicorn, 'gunicorn')
+            yield {'url': app_url, 'emulator': emulator_url}
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+def report_saturation(steps: List[Dict]):
+    """Print the saturation point found by a run"""
+    for previous, step in zip([None] + steps, steps):
+        if step['saturated']:
+            kept_up = f"; last good step {previous['target_rps']:g} req/s" if previous else ''
+            print(f"📈 Saturated at {step['target_rps']:g} req/s ({step['saturated']}){kept_up}")
+            return
+    if steps:
+        print(f"✅ Kept up with every step, up to {steps[-1]['target_rps']:g} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test /api/send-sms at target request rates')
+    parser.add_argument('--url', default=DEFAULT_URL,
+                        help=f'Base URL of a running app (default {DEFAULT_URL}; ignored with --spawn)')
+    parser.add_argument('--rates', default=DEFAULT_RATES,
+                        help=f'Comma-separated target requests per second (default {DEFAULT_RATES})')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help=f'Seconds per rate step (default {DEFAULT_DURATION:g})')
+    parser.add_argument('--recipients', type=int, default=DEFAULT_RECIPIENTS,
+                        help=f'Phone numbers per request (default {DEFAULT_RECIPIENTS})')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f'Per-request timeout in seconds (default {DEFAULT_TIMEOUT:g})')
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help=f'Cap on concurrent requests (default {DEFAULT_MAX_IN_FLIGHT})')
+    parser.add_argument('--slo-p99', type=float, default=DEFAULT_SLO_P99,
+                        help=f'p99 latency in seconds above which a step is saturated '
+                             f'(default {DEFAULT_SLO_P99:g})')
+    parser.add_argument('--max-error-rate', type=float, default=DEFAULT_MAX_ERROR_RATE,
+                        help=f'Error rate above which a step is saturated '
+                             f'(default {DEFAULT_MAX_ERROR_RATE:g})')
+    parser.add_argument('--all-steps', action='store_true',
+                        help='Keep going after the first saturated step')
+    parser.add_argument('--json', help='Write the step results to this file')
+    spawn = parser.add_argument_group('spawned stack (--spawn)')
+    spawn.add_argument('--spawn', action='store_true',
+                       help='Start the emulator and gunicorn for the run')
+    spawn.add_argument('--workers', type=int, default=4, help='gunicorn workers (default 4)')
+    spawn.add_argument('--threads', type=int, default=1, help='Threads per worker (default 1)')
+    spawn.add_argument('--worker-class', default='sync', help='gunicorn worker class (default sync)')
+    spawn.add_argument('--gunicorn-args', default='', help='Extra gunicorn arguments')
+    spawn.add_argument('--emulator-args', default='',
+                       help="Extra sms_emulator.py arguments, e.g. '--latency uniform:50,300'")
+    args = parser.parse_args()
+
+    rates = [float(rate) for rate in args.rates.split(',') if rate.strip()]
+
+    def run(url: str) -> List[Dict]:
+        print(f"🚀 Load testing {url}/api/send-sms: {args.duration:g}s per step, "
+              f"{args.recipients} recipients per request")
+        return asyncio.run(run_load(url, rates, args.duration, args.recipients, args.timeout,
+                                    args.max_in_flight, args.slo_p99, args.max_error_rate,
+                                    stop_at_saturation=not args.all_steps))
+
+    if args.spawn:
+        print(f"🧪 Starting emulator and gunicorn ({args.workers} {args.worker_class} workers, "
+              f"{args.threads} threads each)")
+        try:
+            with spawn_stack(args.workers, args.threads, args.worker_class, args.gunicorn_args,
+                             args.emulator_args) as stack:
+                steps = run(stack['url'])
+                import requests
+                upstream = requests.get(f"{stack['emulator']}/emulator/stats", timeout=5).json()
+                print(f"📡 Emulator: {upstream['requests']} requests, {upstream['messages']} "
+                      f"messages, {upstream['throttled']} throttled, "
+                      f"{upstream['injected_errors']} errors injected")
+        except RuntimeError as e:
+            print(f"❌ Error: {e} (is gunicorn installed? pip install gunicorn)")
+            sys.exit(1)
+    else:
+        steps = run(args.url.rstrip('/'))
+
+    report_saturation(steps)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(steps, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the client-side hot paths
+
+Times phone number validation, send payload construction, result
+formatting, contact file parsing and template rendering at realistic sizes (1k, 100k and 1M
+recipients by default). Each run is appended to history.jsonl and
+compared with the committed baseline.json; a case that is more than
+--threshold slower than its baseline (scaled by a calibration workload
+timed with each run) fails the run.
+
+Changes to these code paths should come with numbers: run the suite
+before and after, and commit the refreshed baseline (--save-baseline)
+with the change.
+
+Run with: python benchmarks/run.py [--sizes 1000,100000] [--cases format_response]
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from typing import Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [BENCH_DIR, os.path.join(BENCH_DIR, '..')]
+
+# The modules under test read credentials at import time; nothing here
+# talks to the API, so placeholder values do when config.py is absent
+try:
+    import config  # noqa: F401
+except ImportError:
+    sys.modules['config'] = types.SimpleNamespace(
+        API_BASE_URL='https://api.example.com', SENDER_ID='Benchmark', API_KEY='benchmark')
+
+from bench_numbers import make_numbers
+from sms_application import SMSClient, MAX_RECIPIENTS, format_response
+from sms_segments import estimate_personalized
+from sms_templates import MessageTemplate, iter_rendered
+
+# Constants
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.25
+# Fast cases repeat until they have used MIN_TIME seconds (at most
+# MAX_RUNS runs); slow ones stop repeating after TIME_BUDGET seconds
+MIN_TIME = 0.5
+MAX_RUNS = 200
+TIME_BUDGET = 10.0
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+HISTORY_PATH = os.path.join(BENCH_DIR, 'history.jsonl')
+TEXT = 'Your verification code is 123456. It expires in 10 minutes.'
+
+# Case name -> setup(size) returning the zero-argument callable to time
+CASES: Dict[str, Callable[[int], Callable[[], None]]] = {}
+
+
+def case(name: str):
+    """Register a benchmark setup function under name"""
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+def make_client() -> SMSClient:
+    return SMSClient('benchmark', 'https://api.example.com', 'Benchmark', default_country='254')
+
+
+@case('validate_phone_number')
+def bench_validate(size: int):
+    """SMSClient._validate_phone_number over mixed-format numbers"""
+    client = make_client()
+    numbers = make_numbers(size)
+
+    def run():
+        validate = client._validate_phone_number
+        for number in numbers:
+            validate(number)
+    return run
+
+
+@case('send_payloads')
+def bench_send_payloads(size: int):
+    """What send_sms does before the HTTP call, for size recipients in batches"""
+    client = make_client()
+    numbers = make_numbers(size)
+
+    def run():
+        to, _ = client._normalize_recipients(numbers)
+        for i in range(0, len(to), MAX_RECIPIENTS):
+            json.dumps(client._build_payload(to[i:i + MAX_RECIPIENTS], TEXT))
+    return run
+
+
+@case('format_response')
+def bench_format_response(size: int):
+    """format_response with details for a send to size recipients"""
+    response = {'bulkId': 'bench-bulk', 'messages': [
+        {'to': f'+2547{i:08d}', 'messageId': f'msg-{i}', 'smsCount': 1,
+         'status': {'groupName': 'PENDING' if i % 20 else 'REJECTED',
+                    'description': 'Message sent to next instance'}}
+        for i in range(size)
+    ]}
+
+    def run():
+        format_response(response, show_details=True)
+    return run
+
+
+@case('parse_phone_numbers_from_file')
+def bench_parse_file(size: int):
+    """The web app's upload parser on a CSV of size rows"""
+    import atexit
+    import app
+
+    numbers = make_numbers(size)
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+        f.write('phone,name\n')
+        for i, number in enumerate(numbers):
+            f.write(f'{number},Customer {i}\n')
+    atexit.register(os.remove, f.name)
+
+    def run():
+        app.parse_phone_numbers_from_file(f.name, '254', column='phone')
+    return run
+
+
+@case('render_template')
+def bench_render_template(size: int):
+    """Rendering a two-placeholder template per CSV row, with segment counts"""
+    numbers = make_numbers(size)
+    rows = [['phone', 'name', 'balance']]
+    rows.extend([number, f'Customer {i}', str(i % 5000)] for i, number in enumerate(numbers))
+    template = MessageTemplate('Hi {name}, your balance is {balance} KES. '
+                               'Pay by Friday to avoid late fees.')
+
+    def run():
+        estimate_personalized(iter_rendered(rows, template, 'phone'))
+    return run
+
+
+def measure(func: Callable[[], None], repeat: int) -> float:
+    """Best wall time of at least repeat runs, with the garbage collector paused"""
+    best = float('inf')
+    spent = 0.0
+    runs = 0
+    while runs < repeat or (spent < MIN_TIME and runs < MAX_RUNS):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = min(best, elapsed)
+        spent += elapsed
+        runs += 1
+        if spent > TIME_BUDGET:
+            break
+    return best
+
+
+def calibrate() -> float:
+    """
+    Time a fixed pure-Python workload
+
+    Results are compared as multiples of this figure, so a baseline taken
+    on a faster or slower machine still applies.
+    """
+    def reference():
+        table = {}
+        for i in range(200_000):
+            key = f'+2547{i:08d}'
+            table[key[-4:]] = table.get(key[-4:], 0) + len(key.strip('+'))
+    return measure(reference, DEFAULT_REPEAT)
+
+
+def environment() -> Dict:
+    """Where the numbers were taken"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def load_baseline(path: str) -> Dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def run_suite(cases: List[str], sizes: List[int], repeat: int = DEFAULT_REPEAT,
+              report: Callable[[str], None] = print) -> Dict[str, Dict[str, float]]:
+    """
+    Time each case at each size
+
+    Returns:
+        {case: {str(size): best seconds}}
+    """
+    results = {}
+    for name in cases:
+        results[name] = {}
+        for size in sizes:
+            seconds = measure(CASES[name](size), repeat)
+            results[name][str(size)] = round(seconds, 6)
+            report(f"  {name:<30} {size:>10,} {seconds:>10.4f}s "
+                   f"{seconds / size * 1e9:>10,.0f} ns/item")
+    return results
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Compare a run with a baseline
+
+    Returns:
+        Descriptions of cases slower than baseline by more than threshold
+    """
+    regressions = []
+    base_results = baseline.get('results', {})
+    # Scale the baseline by the relative speed of the two machines
+    scale = 1.0
+    if results.get('calibration') and baseline.get('calibration'):
+        scale = results['calibration'] / baseline['calibration']
+    for name, by_size in results['results'].items():
+        for size, seconds in by_size.items():
+            base = base_results.get(name, {}).get(size)
+            if not base:
+                continue
+            change = seconds / (base * scale) - 1
+            marker = '❌' if change > threshold else '✅'
+            print(f"  {marker} {name:<30} {int(size):>10,} {change:>+8.1%}")
+            if change > threshold:
+                regressions.append(f"{name} at {int(size):,}: {change:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Client-side hot path benchmarks')
+    parser.add_argument('--cases', default=','.join(CASES),
+                        help=f"Comma-separated cases (default all: {', '.join(CASES)})")
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='Comma-separated recipient counts (default 1000,100000,1000000)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f'Runs per case, best kept (default {DEFAULT_REPEAT})')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Allowed slowdown against the baseline (default {DEFAULT_THRESHOLD})')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='Baseline results file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Write this run as the new baseline instead of comparing')
+    parser.add_argument('--history', default=HISTORY_PATH,
+                        help='File each run is appended to (empty to skip)')
+    args = parser.parse_args()
+
+    cases = [name.strip() for name in args.cases.split(',') if name.strip()]
+    unknown = [name for name in cases if name not in CASES]
+    if unknown:
+        parser.error(f"Unknown cases: {', '.join(unknown)}")
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    run = environment()
+    print(f"⏱️ Benchmarks at {run['commit'] or 'unknown commit'} "
+          f"(Python {run['python']}, {run['cpus']} CPUs)")
+    calibration = calibrate()
+    run['results'] = run_suite(cases, sizes, args.repeat)
+    # Like the cases, calibration keeps its best time, here from either end of the run
+    run['calibration'] = round(min(calibration, calibrate()), 6)
+    print(f"  {'calibration':<30} {'':>10} {run['calibration']:>10.4f}s")
+
+    if args.history:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(run) + '\n')
+
+    if args.save_baseline:
+        baseline = load_baseline(args.baseline)
+        merged = baseline.get('results', {})
+        if baseline.get('calibration'):
+            # Keep earlier entries comparable with this run's calibration
+            scale = run['calibration'] / baseline['calibration']
+            merged = {name: {size: round(seconds * scale, 6) for size, seconds in by_size.items()}
+                      for name, by_size in merged.items()}
+        for name, by_size in run['results'].items():
+            merged.setdefault(name, {}).update(by_size)
+        with open(args.baseline, 'w') as f:
+            json.dump(dict(run, results=merged), f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"💾 Baseline saved to {args.baseline}")
+        return
+
+    baseline = load_baseline(args.baseline)
+    if not baseline:
+        print("ℹ️ No baseline to compare with; create one with --save-baseline")
+        return
+
+    print(f"📊 Against baseline from {baseline.get('commit') or 'unknown commit'} "
+          f"(threshold {args.threshold:+.0%}):")
+    if baseline.get('python') != run['python']:
+        print(f"⚠️ Baseline was taken with Python {baseline.get('python')}; "
+              "interpreter changes can move these numbers on their own")
+    regressions = compare(run, baseline, args.threshold)
+    if regressions:
+        print(f"❌ {len(regressions)} regressions: {'; '.join(regressions)}")
+        sys.exit(1)
+    print("✅ No regressions")
+
+
+if __name__ == '__main__':
+    main()
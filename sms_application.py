@@ -7,13 +7,33 @@ Supports single and bulk SMS sending with interactive and CLI modes.
 """
 
 import requests
+import csv
+import io
 import json
 import argparse
 import sys
 import time
-from typing import List, Dict, Optional, Union
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from typing import List, Dict, Optional, Tuple, Union, Iterable, Sequence, Callable, TextIO
 from datetime import datetime
 
+from sms_contacts import read_phone_numbers
+from sms_idempotency import SendCache, DEFAULT_SEND_CACHE_PATH, request_fingerprint
+from sms_metrics import CLIENT_METRICS, ClientMetrics, request_outcome
+from sms_numbers import normalize_number, normalize_numbers, normalize_stream
+from sms_queue import SMSOutbox
+from sms_reports import DeliveryReportStore, DEFAULT_REPORTS_PATH, parse_timestamp, sync_reports
+from sms_retry import RetryPolicy, not_acted_on
+from sms_schedule import (ScheduleStore, DEFAULT_SCHEDULE_PATH, RECURRENCES, get_zone,
+                          parse_send_time)
+from sms_segments import segment_text, estimate_campaign, estimate_personalized
+from sms_templates import MessageTemplate, read_rendered
+from sms_trace import FileSpanExporter, PhaseBreakdown, Tracer
+from sms_transport import PooledAdapter, DEFAULT_IDLE_TIMEOUT
+from sms_breaker import CircuitOpenError, EndpointSet, is_endpoint_failure
+
 # Configuration - Import from config.py
 try:
     from config import API_BASE_URL, SENDER_ID, API_KEY
@@ -26,11 +46,145 @@ except ImportError:
 MAX_SMS_LENGTH = 160
 MAX_RECIPIENTS = 100
 DEFAULT_TIMEOUT = 30
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_MAX_WORKERS = 8
+MAX_MESSAGES_PER_REQUEST = 1000
+MAX_REQUEST_BYTES = 1024 * 1024
+
+class SMSAPIError(requests.RequestException):
+    """
+    Infobip API failure that keeps the upstream status code
+    
+    `unsent` is True when Infobip cannot have acted on the request (see
+    sms_retry.not_acted_on, or every circuit was open), so sending it
+    again cannot deliver a message twice.
+    """
+    
+    def __init__(self, message: str, status_code: Optional[int] = None,
+                 attempts: int = 1, response=None, unsent: bool = False):
+        super().__init__(message, response=response)
+        self.status_code = status_code
+        self.attempts = attempts
+        self.unsent = unsent
+
+def warn_if_multipart(text: str):
+    """Warn on stderr when text will be split into several SMS parts"""
+    segments = segment_text(text.strip())
+    if segments['segments'] > 1:
+        print(f"Warning: SMS text is {segments['characters']} characters ({segments['encoding']}). "
+              f"It will be sent as {segments['segments']} parts.", file=sys.stderr)
+
+def normalize_recipients(to: Union[str, List[str]],
+                         default_country: Optional[str] = None) -> Tuple[List[str], int]:
+    """
+    Canonicalize recipients to unique E.164 numbers
+
+    Returns:
+        Tuple of (numbers, duplicates removed)
+
+    Raises:
+        ValueError: On the first invalid number
+    """
+    if isinstance(to, str):
+        to = [to]
+
+    result = normalize_numbers(to, default_country)
+    if result['rejects']:
+        phone, reason = result['rejects'][0]
+        raise ValueError(f"Invalid phone number format: {phone} ({reason})")
+
+    return result['numbers'], result['duplicates']
+
+def build_message(destinations: List[Dict], text: str, sender: str,
+                  notify_url: Optional[str] = None,
+                  callback_data: Optional[str] = None) -> Dict:
+    """Build a single message object for the advanced endpoint"""
+    return {
+        "from": sender,
+        "destinations": destinations,
+        "text": text.strip(),
+        "notifyUrl": notify_url or "",
+        "notifyContentType": "application/json",
+        "callbackData": callback_data or "",
+        "validityPeriod": 720  # 12 hours in minutes
+    }
+
+def build_payload(to: List[str], text: str, sender: str,
+                  notify_url: Optional[str] = None,
+                  callback_data: Optional[str] = None) -> Dict:
+    """Build the /sms/2/text/advanced payload for one message"""
+    destinations = [{"to": phone} for phone in to]
+
+    # Note: deliveryTimeWindow removed to avoid API validation errors;
+    # sends held to local time windows go through sms_schedule instead
+    return {"messages": [build_message(destinations, text, sender, notify_url, callback_data)]}
+
+def merge_chunks(outcomes: List[Dict], duration: float) -> Dict:
+    """Merge per-batch outcomes into a single send_bulk result"""
+    messages = []
+    bulk_ids = []
+    failed_recipients = []
+    chunks = []
+
+    for outcome in outcomes:
+        response = outcome['response'] or {}
+        bulk_id = response.get('bulkId')
+
+        if outcome['error']:
+            failed_recipients.extend(outcome['recipients'])
+        else:
+            messages.extend(response.get('messages', []))
+            if bulk_id:
+                bulk_ids.append(bulk_id)
+
+        chunks.append({
+            'index': outcome['index'],
+            'size': len(outcome['recipients']),
+            'bulkId': bulk_id,
+            'duration': round(outcome['duration'], 3),
+            'error': outcome['error']
+        })
+
+    if all(chunk['error'] for chunk in chunks):
+        raise requests.RequestException(chunks[0]['error'])
+
+    return {
+        'bulkId': bulk_ids[0] if bulk_ids else None,
+        'bulkIds': bulk_ids,
+        'messages': messages,
+        'failedRecipients': failed_recipients,
+        'chunks': chunks,
+        'duration': round(duration, 3)
+    }
 
 class SMSClient:
-    """Infobip SMS Client for sending SMS messages"""
+    """
+    Infobip SMS Client for sending SMS messages
+    
+    One client may be shared by all threads of a process: its session is
+    configured once in __init__ and never changed, and the connection pool
+    hands each connection to one thread at a time. Size the pool
+    (pool_size) to the threads sending at once so they reuse kept-alive
+    connections; pool_stats() shows whether they do.
+    """
     
-    def __init__(self, api_key: str, base_url: str, sender_id: str):
+    def __init__(self, api_key: str, base_url: str, sender_id: str,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 notify_url: Optional[str] = None,
+                 default_country: Optional[str] = None,
+                 metrics: Optional[ClientMetrics] = None,
+                 hooks: Optional[List[Callable[[Dict], None]]] = None,
+                 send_cache: Optional[SendCache] = None,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 pool_size: Optional[int] = None,
+                 pool_block: bool = False,
+                 idle_timeout: Optional[float] = DEFAULT_IDLE_TIMEOUT,
+                 tcp_keepalive: Optional[float] = None,
+                 fallback_urls: Optional[List[str]] = None,
+                 endpoints: Optional[EndpointSet] = None):
         """
         Initialize SMS Client
         
@@ -38,11 +192,56 @@ class SMSClient:
             api_key: Infobip API key
             base_url: API base URL
             sender_id: Sender ID for SMS messages
+            max_workers: Number of concurrent requests used by send_bulk
+            retry_policy: Retry policy for API calls (RetryPolicy() by
+                default; pass RetryPolicy(max_attempts=1) to disable)
+            notify_url: URL Infobip pushes delivery reports to (optional)
+            default_country: Calling code for national numbers, e.g. '254'
+            metrics: Where upstream calls are recorded (the shared
+                sms_metrics.CLIENT_METRICS by default)
+            hooks: Callables receiving timed request lifecycle spans
+                (see sms_trace; more can be added with add_hook)
+            send_cache: Stores responses by idempotency key and, if it has
+                a dedup window, recently sent (recipient, text) pairs;
+                needed for the idempotency_key argument of sends
+            connect_timeout: Seconds to wait for a connection to open (and,
+                with pool_block, for a free pooled connection)
+            read_timeout: Seconds to wait for a response
+            pool_size: Connections kept open to the API (default the
+                larger of max_workers and 10)
+            pool_block: Make threads wait for a free connection instead of
+                opening short-lived extra ones when the pool is in use
+            idle_timeout: Seconds after which an idle pooled connection is
+                replaced rather than reused; None disables
+            tcp_keepalive: Idle seconds before TCP keep-alive probes start
+                (default off)
+            fallback_urls: Alternate API base URLs (e.g. other regional
+                hosts) tried when base_url's circuit is open or a retry
+                follows a connection failure
+            endpoints: Base URLs with their circuit breakers (by default
+                base_url and fallback_urls with default breaker settings;
+                see sms_breaker)
         """
         self.api_key = api_key
-        self.base_url = base_url.rstrip('/')
+        self.endpoints = endpoints or EndpointSet([base_url] + list(fallback_urls or []))
+        self.base_url = self.endpoints.urls[0]
         self.sender_id = sender_id
+        self.max_workers = max(1, max_workers)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.notify_url = notify_url
+        self.default_country = default_country
+        self.metrics = metrics or CLIENT_METRICS
+        self.tracer = Tracer(hooks)
+        self.send_cache = send_cache
+        self.timeout = (connect_timeout, read_timeout)
         self.session = requests.Session()
+        # Size the connection pool so bulk worker threads reuse connections;
+        # the adapter also times connection phases while a trace is open
+        self.adapter = PooledAdapter(pool_maxsize=pool_size or max(self.max_workers, 10),
+                                     pool_block=pool_block, idle_timeout=idle_timeout,
+                                     tcp_keepalive=tcp_keepalive, pool_timeout=connect_timeout)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
         self.session.headers.update({
             'Authorization': f'App {self.api_key}',
             'Content-Type': 'application/json',
@@ -51,7 +250,9 @@ class SMSClient:
     
     def send_sms(self, to: Union[str, List[str]], text: str, 
                  sender: Optional[str] = None, 
-                 delivery_report: bool = True) -> Dict:
+                 delivery_report: bool = True,
+                 callback_data: Optional[str] = None,
+                 idempotency_key: Optional[str] = None) -> Dict:
         """
         Send SMS message(s)
         
@@ -60,66 +261,458 @@ class SMSClient:
             text: SMS message text
             sender: Custom sender ID (optional)
             delivery_report: Whether to request delivery report
+            callback_data: Data echoed back in pushed delivery reports
+            idempotency_key: Repeating a send with the same key returns the
+                first send's response (with 'replayed': True) instead of
+                sending again; needs a send_cache
             
         Returns:
-            Dict containing API response
+            Dict containing API response, plus 'suppressed' recipients
+            that were sent the same text within the send cache's dedup
+            window
             
         Raises:
             ValueError: If parameters are invalid
-            requests.RequestException: If API request fails
+            IdempotencyConflict: If the key was used for a different send
+                or its first send is still running
+            SMSAPIError: If API request fails after any retries
         """
+        if idempotency_key is not None:
+            fingerprint = request_fingerprint('send_sms', to, text, sender, callback_data)
+            return self._require_send_cache().run(
+                idempotency_key, fingerprint,
+                lambda: self.send_sms(to, text, sender, delivery_report, callback_data))
+        
         # Validate inputs
         if not text or not text.strip():
             raise ValueError("SMS text cannot be empty")
         
-        if len(text) > MAX_SMS_LENGTH:
-            print(f"Warning: SMS text is {len(text)} characters. May be split into multiple parts.")
+        warn_if_multipart(text)
         
-        # Normalize phone numbers
-        if isinstance(to, str):
-            to = [to]
+        # Canonicalize, validate and deduplicate phone numbers
+        to, _ = self._normalize_recipients(to)
         
         if len(to) > MAX_RECIPIENTS:
             raise ValueError(f"Cannot send to more than {MAX_RECIPIENTS} recipients at once")
         
-        # Validate phone numbers
-        for phone in to:
-            if not self._validate_phone_number(phone):
-                raise ValueError(f"Invalid phone number format: {phone}")
-        
-        # Prepare destinations
-        destinations = [{"to": phone} for phone in to]
-        
-        # Prepare payload
-        payload = {
-            "messages": [{
-                "from": sender or self.sender_id,
-                "destinations": destinations,
-                "text": text.strip(),
-                "notifyUrl": "",  # Add your callback URL if needed
-                "notifyContentType": "application/json",
-                "callbackData": "",
-                "validityPeriod": 720  # 12 hours in minutes
-            }]
+        to, suppressed = self._claim_recent(to, text)
+        if not to:
+            return {'bulkId': None, 'messages': [], 'suppressed': suppressed}
+        
+        try:
+            with self.tracer.span('send', recipients=len(to)):
+                response = self._post_messages(self._build_payload(to, text, sender, callback_data))
+        except requests.RequestException:
+            self._release_recent(to, text)
+            raise
+        if suppressed:
+            response['suppressed'] = suppressed
+        return response
+    
+    def send_bulk(self, to: Union[str, List[str]], text: str,
+                  sender: Optional[str] = None,
+                  chunk_size: int = MAX_RECIPIENTS,
+                  max_workers: Optional[int] = None,
+                  callback_data: Optional[str] = None,
+                  on_chunk: Optional[Callable[[Dict], None]] = None,
+                  idempotency_key: Optional[str] = None) -> Dict:
+        """
+        Send SMS to any number of recipients
+        
+        Recipients are split into batches of at most chunk_size and sent
+        concurrently over the client's shared session.
+        
+        Args:
+            to: Phone number(s) to send SMS to (with country code)
+            text: SMS message text
+            sender: Custom sender ID (optional)
+            chunk_size: Recipients per upstream request (max MAX_RECIPIENTS)
+            max_workers: Concurrent requests (defaults to client setting)
+            callback_data: Data echoed back in pushed delivery reports
+            on_chunk: Called with each batch outcome ('index', 'recipients',
+                'response', 'error', 'duration') in order as it completes
+                (not called when a result is replayed)
+            idempotency_key: Repeating a send with the same key returns the
+                first send's result (with 'replayed': True) instead of
+                sending again; needs a send_cache
+            
+        Returns:
+            Dict with merged 'messages', 'bulkIds', per-chunk 'chunks'
+            timings, 'failedRecipients', 'duplicates' removed,
+            'suppressed' recipients sent the same text within the send
+            cache's dedup window and total 'duration'. 'bulkId' holds the
+            first bulk ID for single-batch callers.
+            
+        Raises:
+            ValueError: If parameters are invalid
+            IdempotencyConflict: If the key was used for a different send
+                or its first send is still running
+            requests.RequestException: If every batch fails
+        """
+        if idempotency_key is not None:
+            fingerprint = request_fingerprint('send_bulk', to, text, sender, callback_data)
+            return self._require_send_cache().run(
+                idempotency_key, fingerprint,
+                lambda: self.send_bulk(to, text, sender, chunk_size, max_workers,
+                                       callback_data, on_chunk))
+        
+        if not text or not text.strip():
+            raise ValueError("SMS text cannot be empty")
+        
+        if not 1 <= chunk_size <= MAX_RECIPIENTS:
+            raise ValueError(f"Chunk size must be between 1 and {MAX_RECIPIENTS}")
+        
+        warn_if_multipart(text)
+        
+        # Validate everything up front so nothing is sent for a bad list
+        to, duplicates = self._normalize_recipients(to)
+        
+        if not to:
+            raise ValueError("No phone numbers provided")
+        
+        to, suppressed = self._claim_recent(to, text)
+        if not to:
+            return {'bulkId': None, 'bulkIds': [], 'messages': [], 'failedRecipients': [],
+                    'chunks': [], 'duration': 0.0, 'duplicates': duplicates,
+                    'suppressed': suppressed}
+        
+        chunks = [to[i:i + chunk_size] for i in range(0, len(to), chunk_size)]
+        workers = min(max_workers or self.max_workers, len(chunks))
+        
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = []
+            for outcome in executor.map(
+                lambda item: self._send_chunk(item[0], item[1], text, sender, callback_data),
+                enumerate(chunks)
+            ):
+                outcomes.append(outcome)
+                if on_chunk is not None:
+                    on_chunk(outcome)
+        duration = time.time() - start_time
+        
+        try:
+            result = merge_chunks(outcomes, duration)
+        except requests.RequestException:
+            self._release_recent(to, text)
+            raise
+        # Recipients of failed batches were not sent, so they may be retried
+        self._release_recent(result['failedRecipients'], text)
+        result['duplicates'] = duplicates
+        result['suppressed'] = suppressed
+        return result
+    
+    def send_personalized(self, rows: Iterable[Sequence[str]],
+                          max_messages: int = MAX_MESSAGES_PER_REQUEST,
+                          max_bytes: int = MAX_REQUEST_BYTES,
+                          max_workers: Optional[int] = None) -> Dict:
+        """
+        Send individual texts packed into as few requests as possible
+        
+        Rows sharing the same text, sender and callback data become one
+        message object with several destinations. Message objects are then
+        packed into requests bounded by max_messages and max_bytes, and
+        responses are mapped back to rows through per-destination message IDs.
+        
+        Args:
+            rows: (recipient, text), (recipient, text, sender) or
+                (recipient, text, sender, callback_data) tuples
+            max_messages: Maximum message objects per request
+            max_bytes: Maximum JSON payload size per request
+            max_workers: Concurrent requests (defaults to client setting)
+            
+        Returns:
+            Dict with 'results' (one entry per input row, in input order),
+            per-request 'requests' timings and total 'duration'. Rows that
+            fail validation or whose request fails carry an 'error'. A
+            failed row has 'retryable' set if Infobip cannot have acted on
+            it (sending it again is safe), or 'ambiguous' if it may have
+            been accepted (a 5xx, read timeout or dropped connection).
+        """
+        batch_key = uuid.uuid4().hex[:12]
+        results = []
+        groups = {}
+        
+        for index, row in enumerate(rows):
+            recipient, text = row[0], row[1]
+            sender = row[2] if len(row) > 2 else None
+            callback_data = row[3] if len(row) > 3 else None
+            result = {
+                'index': index,
+                'to': recipient,
+                'messageId': f"{batch_key}-{index}",
+                'bulkId': None,
+                'status': None,
+                'smsCount': None,
+                'error': None,
+                'retryable': False,
+                'ambiguous': False
+            }
+            results.append(result)
+            
+            canonical, reason = normalize_number(recipient, self.default_country)
+            if not text or not text.strip():
+                result['error'] = "SMS text cannot be empty"
+            elif canonical is None:
+                result['error'] = f"Invalid phone number format: {recipient} ({reason})"
+            else:
+                result['to'] = canonical
+                groups.setdefault((text.strip(), sender or self.sender_id, callback_data or ''),
+                                  []).append(result)
+        
+        # One message object per distinct text, split at MAX_RECIPIENTS
+        objects = []
+        for (text, sender, callback_data), members in groups.items():
+            for i in range(0, len(members), MAX_RECIPIENTS):
+                part = members[i:i + MAX_RECIPIENTS]
+                destinations = [{"to": r['to'], "messageId": r['messageId']} for r in part]
+                objects.append((self._build_message(destinations, text, sender, callback_data),
+                                part))
+        
+        # Greedily pack message objects into size-bounded requests
+        envelope_bytes = len(json.dumps({"messages": []}))
+        batches = []
+        current, current_bytes = [], envelope_bytes
+        for message, members in objects:
+            size = len(json.dumps(message)) + 2
+            if current and (len(current) >= max_messages or current_bytes + size > max_bytes):
+                batches.append(current)
+                current, current_bytes = [], envelope_bytes
+            current.append((message, members))
+            current_bytes += size
+        if current:
+            batches.append(current)
+        
+        start_time = time.time()
+        requests_info = []
+        if batches:
+            workers = min(max_workers or self.max_workers, len(batches))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                requests_info = list(executor.map(
+                    lambda item: self._send_packed(item[0], item[1]),
+                    enumerate(batches)
+                ))
+        
+        return {
+            'results': results,
+            'requests': requests_info,
+            'duration': round(time.time() - start_time, 3)
         }
+    
+    def send_personalized_stream(self, rows: Iterable[Sequence[str]],
+                                 window: Optional[int] = None,
+                                 on_batch: Optional[Callable[[Dict], None]] = None,
+                                 **send_args) -> Dict:
+        """
+        Send individual texts from an iterator, a window of rows at a time
         
-        # Note: deliveryTimeWindow removed to avoid API validation errors
-        # Can be added back if needed for specific use cases
+        Each window is sent with send_personalized before the next is read,
+        so memory stays bounded however many rows there are (for example
+        a template rendered from a large CSV file as it is read).
         
-        # Send request
-        url = f"{self.base_url}/sms/2/text/advanced"
+        Args:
+            rows: Rows as for send_personalized
+            window: Rows per window (default enough to fill max_workers
+                requests of MAX_MESSAGES_PER_REQUEST message objects)
+            on_batch: Called with each window's send_personalized result
+                once it is sent, e.g. ResponseWriter.write_personalized
+            **send_args: max_messages, max_bytes or max_workers for
+                send_personalized
+            
+        Returns:
+            Dict with 'rows', 'sent' (accepted upstream), 'failed', 'bulkIds',
+            'requests' (number made) and 'duration'
+        """
+        if not window:
+            window = (send_args.get('max_messages', MAX_MESSAGES_PER_REQUEST)
+                      * (send_args.get('max_workers') or self.max_workers))
+        start_time = time.time()
+        totals = {'rows': 0, 'sent': 0, 'failed': 0, 'bulkIds': [], 'requests': 0}
+        rows = iter(rows)
+        
+        while True:
+            batch = list(islice(rows, window))
+            if not batch:
+                break
+            outcome = self.send_personalized(batch, **send_args)
+            sent = sum(1 for r in outcome['results']
+                       if not r['error'] and (r['status'] or {}).get('groupName') == 'PENDING')
+            totals['rows'] += len(batch)
+            totals['sent'] += sent
+            totals['failed'] += len(batch) - sent
+            totals['requests'] += len(outcome['requests'])
+            for info in outcome['requests']:
+                if info['bulkId'] and info['bulkId'] not in totals['bulkIds']:
+                    totals['bulkIds'].append(info['bulkId'])
+            if on_batch is not None:
+                on_batch(outcome)
+        
+        totals['duration'] = round(time.time() - start_time, 3)
+        return totals
+    
+    def _send_packed(self, index: int, batch: List) -> Dict:
+        """Send one packed request and write statuses back to its rows"""
+        start_time = time.time()
+        payload = {"messages": [message for message, _ in batch]}
+        members = {r['messageId']: r for _, part in batch for r in part}
+        info = {
+            'index': index,
+            'messages': len(batch),
+            'recipients': len(members),
+            'bulkId': None,
+            'error': None
+        }
         
         try:
+            response = self._post_messages(payload)
+            info['bulkId'] = response.get('bulkId')
+            for msg in response.get('messages', []):
+                row = members.pop(msg.get('messageId'), None)
+                if row is not None:
+                    row['bulkId'] = info['bulkId']
+                    row['status'] = msg.get('status')
+                    row['smsCount'] = msg.get('smsCount')
+            for row in members.values():
+                row['error'] = "No status returned for message"
+                row['ambiguous'] = True
+        except requests.RequestException as e:
+            info['error'] = str(e)
+            unsent = getattr(e, 'unsent', False)
+            status_code = getattr(e, 'status_code', None)
+            # A 4xx other than 429 is a refusal: nothing was sent
+            refused = status_code is not None and 400 <= status_code < 500
+            for row in members.values():
+                row['error'] = str(e)
+                row['retryable'] = unsent
+                row['ambiguous'] = not unsent and not refused
+        
+        info['duration'] = round(time.time() - start_time, 3)
+        return info
+    
+    def _build_message(self, destinations: List[Dict], text: str,
+                       sender: Optional[str] = None,
+                       callback_data: Optional[str] = None) -> Dict:
+        """Build a single message object with this client's defaults"""
+        return build_message(destinations, text, sender or self.sender_id, self.notify_url,
+                             callback_data)
+    
+    def _build_payload(self, to: List[str], text: str,
+                       sender: Optional[str] = None,
+                       callback_data: Optional[str] = None) -> Dict:
+        """Build the /sms/2/text/advanced payload for one message"""
+        with self.tracer.span('build', recipients=len(to)):
+            return build_payload(to, text, sender or self.sender_id, self.notify_url,
+                                 callback_data)
+    
+    def _post_messages(self, payload: Dict) -> Dict:
+        """POST a prepared payload to the advanced SMS endpoint"""
+        def attempt(base_url):
             response = self.session.post(
-                url, 
+                f"{base_url}/sms/2/text/advanced", 
                 json=payload, 
-                timeout=DEFAULT_TIMEOUT
+                timeout=self.timeout
             )
             response.raise_for_status()
-            return response.json()
-            
+            return self._parse(response)
+        
+        # Sends are not idempotent: an ambiguous read timeout is not retried
+        result = self._call(attempt, "Failed to send SMS", idempotent=False, endpoint='send')
+        self.metrics.observe_send(payload, result)
+        return result
+    
+    def _call(self, attempt, error_prefix: str, idempotent: bool = True,
+              endpoint: str = 'other') -> Dict:
+        """
+        Run a request attempt under the retry policy, timing each try
+        
+        attempt(base_url) makes one request. Each try goes to the first
+        endpoint whose circuit allows it, skipping endpoints this call
+        already failed on while others are available.
+        """
+        metrics = self.metrics
+        attempts = 0
+        failed_urls = set()
+        
+        def timed():
+            nonlocal attempts
+            attempts += 1
+            base_url, breaker = self.endpoints.select(failed_urls)
+            with self.tracer.span('attempt', endpoint=endpoint, attempt=attempts) as span:
+                start = time.perf_counter()
+                healthy = False
+                try:
+                    result = attempt(base_url)
+                    healthy = True
+                except requests.RequestException as e:
+                    healthy = not is_endpoint_failure(e)
+                    if not healthy:
+                        failed_urls.add(base_url)
+                    span['outcome'] = request_outcome(e)
+                    metrics.observe_call(endpoint, span['outcome'], time.perf_counter() - start)
+                    raise
+                finally:
+                    breaker.record(healthy, time.perf_counter() - start)
+                span['outcome'] = '2xx'
+                metrics.observe_call(endpoint, '2xx', time.perf_counter() - start)
+                return result
+        
+        try:
+            return self.retry_policy.call(timed, idempotent=idempotent)
         except requests.exceptions.RequestException as e:
-            raise requests.RequestException(f"Failed to send SMS: {str(e)}")
+            response = getattr(e, 'response', None)
+            raise SMSAPIError(
+                f"{error_prefix}: {str(e)}",
+                status_code=response.status_code if response is not None else None,
+                attempts=getattr(e, 'attempts', 1),
+                response=response,
+                unsent=isinstance(e, CircuitOpenError) or not_acted_on(e)
+            )
+    
+    def _parse(self, response: requests.Response) -> Dict:
+        """Decode a JSON response body"""
+        with self.tracer.span('parse'):
+            return response.json()
+    
+    def _require_send_cache(self) -> SendCache:
+        if self.send_cache is None:
+            raise ValueError("Idempotency keys need a client created with a send_cache")
+        return self.send_cache
+    
+    def _claim_recent(self, to: List[str], text: str):
+        """Drop recipients sent this text within the dedup window"""
+        if self.send_cache is None:
+            return to, []
+        return self.send_cache.claim_recent(to, text.strip())
+    
+    def _release_recent(self, to: List[str], text: str):
+        if self.send_cache is not None:
+            self.send_cache.release_recent(to, text.strip())
+    
+    def add_hook(self, hook: Callable[[Dict], None]):
+        """
+        Register a request lifecycle hook
+        
+        Args:
+            hook: Called with each finished span (build, attempt, prepare,
+                acquire, connect, tls, ttfb, read, parse); see sms_trace
+        """
+        self.tracer.add_hook(hook)
+    
+    def _send_chunk(self, index: int, to: List[str], text: str,
+                    sender: Optional[str], callback_data: Optional[str] = None) -> Dict:
+        """Send one batch, capturing its timing and any error"""
+        start_time = time.time()
+        outcome = {'index': index, 'recipients': to, 'response': None, 'error': None}
+        
+        try:
+            with self.tracer.span('send', recipients=len(to), chunk=index):
+                payload = self._build_payload(to, text, sender, callback_data)
+                outcome['response'] = self._post_messages(payload)
+        except requests.RequestException as e:
+            outcome['error'] = str(e)
+        
+        outcome['duration'] = time.time() - start_time
+        return outcome
     
     def get_delivery_reports(self, bulk_id: Optional[str] = None, 
                            message_id: Optional[str] = None, 
@@ -135,7 +728,6 @@ class SMSClient:
         Returns:
             Dict containing delivery reports
         """
-        url = f"{self.base_url}/sms/1/reports"
         params = {"limit": limit}
         
         if bulk_id:
@@ -143,13 +735,15 @@ class SMSClient:
         if message_id:
             params["messageId"] = message_id
         
-        try:
-            response = self.session.get(url, params=params, timeout=DEFAULT_TIMEOUT)
+        def attempt(base_url):
+            response = self.session.get(f"{base_url}/sms/1/reports", params=params,
+                                        timeout=self.timeout)
             response.raise_for_status()
-            return response.json()
-            
-        except requests.exceptions.RequestException as e:
-            raise requests.RequestException(f"Failed to get delivery reports: {str(e)}")
+            return self._parse(response)
+        
+        # Reports are handed out once, so a lost response is not re-read
+        return self._call(attempt, "Failed to get delivery reports", idempotent=False,
+                          endpoint='reports')
     
     def check_account_balance(self) -> Dict:
         """
@@ -161,24 +755,25 @@ class SMSClient:
         Note: This feature requires specific API permissions that may not be 
         available with all API keys. SMS sending functionality works independently.
         """
-        url = f"{self.base_url}/account/1/balance"
+        def attempt(base_url):
+            response = self.session.get(f"{base_url}/account/1/balance", timeout=self.timeout)
+            response.raise_for_status()
+            return self._parse(response)
         
         try:
-            response = self.session.get(url, timeout=DEFAULT_TIMEOUT)
-            response.raise_for_status()
-            return response.json()
-            
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 403:
-                raise requests.RequestException(
+            return self._call(attempt, "Failed to check balance", endpoint='balance')
+        except SMSAPIError as e:
+            if e.status_code == 403:
+                raise SMSAPIError(
                     "Balance checking requires additional API permissions. "
                     "Contact Infobip support to enable account access features. "
-                    "SMS sending functionality is not affected."
+                    "SMS sending functionality is not affected.",
+                    status_code=403,
+                    attempts=e.attempts,
+                    response=e.response,
+                    unsent=e.unsent
                 )
-            else:
-                raise requests.RequestException(f"Failed to check balance: {str(e)}")
-        except requests.exceptions.RequestException as e:
-            raise requests.RequestException(f"Failed to check balance: {str(e)}")
+            raise
     
     def _validate_phone_number(self, phone: str) -> bool:
         """
@@ -188,17 +783,180 @@ class SMSClient:
             phone: Phone number to validate
             
         Returns:
-            bool: True if valid format
+            bool: True if the number can be canonicalized to E.164
+        """
+        return normalize_number(phone, self.default_country)[0] is not None
+    
+    def _normalize_recipients(self, to: Union[str, List[str]]) -> Tuple[List[str], int]:
+        """normalize_recipients() with this client's default country"""
+        return normalize_recipients(to, self.default_country)
+    
+    def pool_stats(self) -> Dict:
         """
-        # Remove common separators
-        cleaned = phone.replace('+', '').replace('-', '').replace(' ', '').replace('(', '').replace(')', '')
+        Connection pool counters
         
-        # Check if it's all digits and reasonable length
-        return cleaned.isdigit() and 7 <= len(cleaned) <= 15
+        Returns:
+            Dict with 'hits' (kept-alive connection reused), 'misses' (new
+            connection opened), 'reaped' (idle connection replaced),
+            'discarded' (returned to a full pool), 'exhausted' (no free
+            connection in time) and 'hit_ratio'
+        """
+        return self.adapter.snapshot()
     
     def close(self):
-        """Close the session"""
+        """Close the session and this thread's send cache connection"""
         self.session.close()
+        if self.send_cache is not None:
+            self.send_cache.close()
+
+OUTPUT_FORMATS = ('text', 'ndjson', 'csv', 'summary')
+
+
+class ResponseWriter:
+    """
+    Stream send results to a file as they arrive
+
+    Each message is written as soon as its batch completes, so output
+    starts immediately and memory does not grow with the number of
+    messages. Formats: 'text' (human-readable), 'ndjson' (one JSON object
+    per message), 'csv' (header plus one row per message) and 'summary'
+    (status counts only, written by close()).
+    """
+
+    CSV_FIELDS = ['to', 'status', 'description', 'messageId', 'smsCount', 'bulkId', 'error']
+
+    def __init__(self, out: Optional[TextIO] = None, output: str = 'text',
+                 show_details: bool = False):
+        """
+        Args:
+            out: File to write to (default sys.stdout)
+            output: One of OUTPUT_FORMATS
+            show_details: Add message ID and SMS count to text output
+        """
+        if output not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output}")
+        self.out = out or sys.stdout
+        self.output = output
+        self.show_details = show_details
+        self.count = 0
+        self.successful = 0
+        self.failed = 0
+        self.statuses = {}
+        self.bulk_ids = []
+        self._csv = csv.writer(self.out) if output == 'csv' else None
+
+    def start(self, total: Optional[int] = None):
+        """Write the header (text and csv formats)"""
+        if self.output == 'text':
+            self.out.write(f"\n📱 SMS Batch Summary:\n{'=' * 50}\n")
+            if total is not None:
+                self.out.write(f"Total messages: {total}\n")
+        elif self._csv is not None:
+            self._csv.writerow(self.CSV_FIELDS)
+
+    def _record(self, to: str, group: str, description: str, message_id=None,
+                sms_count=None, bulk_id=None, error=None):
+        self.count += 1
+        if group == 'PENDING':
+            self.successful += 1
+        else:
+            self.failed += 1
+        self.statuses[group] = self.statuses.get(group, 0) + 1
+
+        if self.output == 'text':
+            emoji = "✅" if group == 'PENDING' else "❌"
+            self.out.write(f"\n{emoji} Message {self.count}:\n"
+                           f"  Phone: {to}\n"
+                           f"  Status: {group}\n"
+                           f"  Description: {description}\n")
+            if self.show_details:
+                self.out.write(f"  Message ID: {message_id or 'N/A'}\n"
+                               f"  SMS Count: {sms_count if sms_count is not None else 'N/A'}\n")
+        elif self.output == 'ndjson':
+            self.out.write(json.dumps({
+                'to': to, 'status': group, 'description': description,
+                'messageId': message_id, 'smsCount': sms_count,
+                'bulkId': bulk_id, 'error': error
+            }, separators=(',', ':')))
+            self.out.write('\n')
+        elif self._csv is not None:
+            self._csv.writerow([to, group, description, message_id, sms_count, bulk_id, error])
+
+    def write_messages(self, messages: Iterable[Dict], bulk_id: Optional[str] = None):
+        """Write messages from an Infobip send response"""
+        if bulk_id and bulk_id not in self.bulk_ids:
+            self.bulk_ids.append(bulk_id)
+        for msg in messages:
+            status = msg.get('status', {})
+            self._record(msg.get('to', 'Unknown'), status.get('groupName', 'Unknown'),
+                         status.get('description', 'No description'), msg.get('messageId'),
+                         msg.get('smsCount'), bulk_id)
+
+    def write_failed(self, recipients: Iterable[str], error: str):
+        """Write recipients whose request failed"""
+        for to in recipients:
+            self._record(to, 'FAILED', error, error=error)
+
+    def write_chunk(self, outcome: Dict):
+        """Write one send_bulk batch outcome; pass as its on_chunk callback"""
+        if outcome['error']:
+            self.write_failed(outcome['recipients'], outcome['error'])
+        else:
+            response = outcome['response'] or {}
+            self.write_messages(response.get('messages', []), response.get('bulkId'))
+
+    def write_personalized(self, outcome: Dict):
+        """Write the rows of a send_personalized result; usable as on_batch"""
+        for row in outcome['results']:
+            if row['bulkId'] and row['bulkId'] not in self.bulk_ids:
+                self.bulk_ids.append(row['bulkId'])
+            if row['error']:
+                self._record(row['to'], 'FAILED', row['error'], error=row['error'])
+            else:
+                status = row['status'] or {}
+                self._record(row['to'], status.get('groupName', 'Unknown'),
+                             status.get('description', 'No description'), row['messageId'],
+                             row['smsCount'], row['bulkId'])
+    
+    def write_response(self, response: Dict):
+        """Write a complete send_sms or send_bulk response"""
+        bulk_ids = response.get('bulkIds') or [response.get('bulkId')]
+        # Messages of a merged response are not grouped by bulk, so only a
+        # single-bulk response can attribute each message to its bulk ID
+        self.write_messages(response.get('messages', []),
+                            bulk_ids[0] if len(bulk_ids) == 1 else None)
+        for bulk_id in bulk_ids:
+            if bulk_id and bulk_id not in self.bulk_ids:
+                self.bulk_ids.append(bulk_id)
+        if response.get('failedRecipients'):
+            errors = [c['error'] for c in response.get('chunks', []) if c.get('error')]
+            self.write_failed(response['failedRecipients'],
+                              errors[0] if errors else 'Request failed')
+
+    def close(self) -> Dict:
+        """
+        Write the footer (text and summary formats) and flush
+
+        Returns:
+            Dict with 'count', 'successful', 'failed' and per-status 'statuses'
+        """
+        if self.output in ('text', 'summary'):
+            if self.output == 'summary':
+                self.out.write(f"📱 Messages: {self.count}\n")
+                for group, count in sorted(self.statuses.items()):
+                    self.out.write(f"  {group}: {count}\n")
+            else:
+                self.out.write(f"\n{'=' * 50}\n")
+            self.out.write(f"✅ Successful: {self.successful}\n")
+            self.out.write(f"❌ Failed: {self.failed}\n")
+            if len(self.bulk_ids) > 1:
+                self.out.write(f"📦 Bulk IDs: {', '.join(self.bulk_ids)}\n")
+            elif self.bulk_ids:
+                self.out.write(f"📦 Bulk ID: {self.bulk_ids[0]}\n")
+        self.out.flush()
+        return {'count': self.count, 'successful': self.successful,
+                'failed': self.failed, 'statuses': dict(self.statuses)}
+
 
 def format_response(response: Dict, show_details: bool = False) -> str:
     """
@@ -211,49 +969,15 @@ def format_response(response: Dict, show_details: bool = False) -> str:
     Returns:
         Formatted string
     """
-    if 'messages' in response:
-        messages = response['messages']
-        total = len(messages)
-        
-        result = f"\n📱 SMS Batch Summary:\n"
-        result += f"{'='*50}\n"
-        result += f"Total messages: {total}\n"
-        
-        success_count = 0
-        error_count = 0
-        
-        for i, msg in enumerate(messages, 1):
-            status = msg.get('status', {})
-            group_name = status.get('groupName', 'Unknown')
-            description = status.get('description', 'No description')
-            
-            if group_name == 'PENDING':
-                success_count += 1
-                status_emoji = "✅"
-            else:
-                error_count += 1
-                status_emoji = "❌"
-            
-            result += f"\n{status_emoji} Message {i}:\n"
-            result += f"  Phone: {msg.get('to', 'Unknown')}\n"
-            result += f"  Status: {group_name}\n"
-            result += f"  Description: {description}\n"
-            
-            if show_details:
-                result += f"  Message ID: {msg.get('messageId', 'N/A')}\n"
-                result += f"  SMS Count: {msg.get('smsCount', 'N/A')}\n"
-        
-        result += f"\n{'='*50}\n"
-        result += f"✅ Successful: {success_count}\n"
-        result += f"❌ Failed: {error_count}\n"
-        
-        if 'bulkId' in response:
-            result += f"📦 Bulk ID: {response['bulkId']}\n"
+    if 'messages' not in response:
+        return f"Response: {json.dumps(response, indent=2)}"
     
-    else:
-        result = f"Response: {json.dumps(response, indent=2)}"
-    
-    return result
+    buffer = io.StringIO()
+    writer = ResponseWriter(buffer, 'text', show_details)
+    writer.start(len(response['messages']))
+    writer.write_response(response)
+    writer.close()
+    return buffer.getvalue()
 
 def interactive_mode():
     """Interactive mode for SMS sending"""
@@ -316,7 +1040,7 @@ def interactive_mode():
                 
                 try:
                     start_time = time.time()
-                    response = client.send_sms(phones, message)
+                    response = client.send_bulk(phones, message)
                     end_time = time.time()
                     
                     print(format_response(response, show_details=True))
@@ -381,25 +1105,98 @@ def main():
     parser.add_argument('-s', '--sender', 
                        help='Custom sender ID (optional)')
     parser.add_argument('-f', '--file', 
-                       help='File containing phone numbers (one per line)')
+                       help='File containing phone numbers (one per line, CSV or .gz)')
+    parser.add_argument('--column', default='0',
+                       help='Phone column of a CSV file: index or header name (default 0)')
+    parser.add_argument('--template', action='store_true',
+                       help='Treat the message as a template: {column} placeholders are filled '
+                            'from each row of the --file CSV (by header name or index)')
     parser.add_argument('-i', '--interactive', action='store_true',
                        help='Run in interactive mode')
     parser.add_argument('--balance', action='store_true',
                        help='Check account balance')
     parser.add_argument('--reports', action='store_true',
-                       help='Get delivery reports')
+                       help='Show delivery reports from the local report store')
     parser.add_argument('--bulk-id', 
                        help='Bulk ID for delivery reports')
+    parser.add_argument('--phone',
+                       help='Recipient to show delivery reports for')
+    parser.add_argument('--status',
+                       help='Status group (DELIVERED, PENDING, ...) or status name of reports')
+    parser.add_argument('--since',
+                       help='Only reports sent at or after this time (ISO 8601, e.g. 2024-05-01)')
+    parser.add_argument('--until',
+                       help='Only reports sent before this time (ISO 8601)')
+    parser.add_argument('--sync', action='store_true',
+                       help='Pull pending delivery reports from Infobip into the store first')
+    parser.add_argument('--reports-db', default=DEFAULT_REPORTS_PATH,
+                       help=f'Delivery report store (default {DEFAULT_REPORTS_PATH})')
     parser.add_argument('-v', '--verbose', action='store_true',
                        help='Show detailed output')
+    parser.add_argument('-c', '--country',
+                       help='Calling code for numbers in national format, e.g. 254')
+    parser.add_argument('--queue', metavar='DB',
+                       help='Write messages to this outbox database instead of sending '
+                            '(drain it with sms_queue.py)')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Show segment count for the message and recipients without sending')
+    parser.add_argument('--at', metavar='TIME',
+                       help='Schedule the send for this time (ISO 8601; without an offset it is '
+                            'read in --timezone) instead of sending now')
+    parser.add_argument('--timezone', default='UTC',
+                       help='Time zone for --at, --window and --repeat (default UTC)')
+    parser.add_argument('--window', metavar='HH:MM-HH:MM',
+                       help='Hold scheduled messages to this daily local time window')
+    parser.add_argument('--repeat', choices=list(RECURRENCES),
+                       help='Repeat a scheduled send hourly, daily or weekly')
+    parser.add_argument('--repeat-until', metavar='TIME',
+                       help='Last time a repeating schedule may run (ISO 8601)')
+    parser.add_argument('--schedule-db', default=DEFAULT_SCHEDULE_PATH, metavar='DB',
+                       help=f'Schedule database read by sms_schedule.py '
+                            f'(default {DEFAULT_SCHEDULE_PATH})')
+    parser.add_argument('--price', type=float,
+                       help='Price per SMS segment, used by --dry-run to estimate cost')
+    parser.add_argument('--fallback-url', action='append', default=[], metavar='URL',
+                       help='Alternate API base URL used while the configured one is failing '
+                            '(repeatable)')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_MAX_WORKERS,
+                       help=f'Concurrent requests for bulk sends (default {DEFAULT_MAX_WORKERS})')
+    parser.add_argument('-o', '--output', choices=OUTPUT_FORMATS, default='text',
+                       help='Send result format: text, ndjson or csv (one line per message, '
+                            'streamed as batches complete) or summary (status counts)')
+    parser.add_argument('--trace', action='store_true',
+                       help='Print a per-phase timing breakdown of API requests '
+                            '(connect, TLS, time to first byte, read, parse) to stderr')
+    parser.add_argument('--trace-file', metavar='PATH',
+                       help='Append request lifecycle spans to this file as JSON lines')
+    parser.add_argument('--idempotency-key', metavar='KEY',
+                       help='Send at most once per key: re-running with the same key prints '
+                            'the first run\'s result instead of sending again')
+    parser.add_argument('--dedup-window', type=float, default=0, metavar='SECONDS',
+                       help='Skip recipients sent the same text within this many seconds')
+    parser.add_argument('--send-cache', default=DEFAULT_SEND_CACHE_PATH, metavar='DB',
+                       help=f'Idempotency and dedup database (default {DEFAULT_SEND_CACHE_PATH})')
     
     args = parser.parse_args()
     
+    # ndjson/csv output is meant for pipes, so progress messages go to stderr
+    def log(*values):
+        print(*values, file=sys.stderr if args.output in ('ndjson', 'csv') else sys.stdout)
+    
     if args.interactive:
         interactive_mode()
         return
     
-    client = SMSClient(API_KEY, API_BASE_URL, SENDER_ID)
+    client = SMSClient(API_KEY, API_BASE_URL, SENDER_ID, max_workers=args.workers,
+                       default_country=args.country, fallback_urls=args.fallback_url)
+    
+    breakdown = exporter = None
+    if args.trace:
+        breakdown = PhaseBreakdown()
+        client.add_hook(breakdown)
+    if args.trace_file:
+        exporter = FileSpanExporter(args.trace_file)
+        client.add_hook(exporter)
     
     try:
         if args.balance:
@@ -407,27 +1204,117 @@ def main():
             balance = client.check_account_balance()
             print(f"💰 Account Balance: {balance.get('amount', 'N/A')} {balance.get('currency', '')}")
         
-        elif args.reports:
-            # Get delivery reports
-            kwargs = {"limit": 50}
-            if args.bulk_id:
-                kwargs["bulk_id"] = args.bulk_id
+        elif args.reports or args.sync:
+            # Delivery reports are answered from the local store
+            store = DeliveryReportStore(args.reports_db)
+            if args.sync:
+                totals = sync_reports(client, store)
+                print(f"🔄 Synced {totals['fetched']} new reports "
+                      f"in {totals['pages']} requests")
+                if not args.reports:
+                    return
             
-            reports = client.get_delivery_reports(**kwargs)
-            if 'results' in reports and reports['results']:
+            phone = args.phone
+            if phone:
+                phone = normalize_number(phone, args.country)[0] or phone
+            reports = store.query(bulk_id=args.bulk_id, recipient=phone, status=args.status,
+                                  since=parse_timestamp(args.since),
+                                  until=parse_timestamp(args.until), limit=50)
+            if reports:
                 print("📊 Recent Delivery Reports:")
-                for report in reports['results'][:10]:  # Show last 10
+                for report in reports[:10]:  # Show last 10
                     status = report.get('status', {}).get('name', 'Unknown')
                     phone = report.get('to', 'Unknown')
                     sent_at = report.get('sentAt', 'N/A')
                     print(f"  {phone}: {status} at {sent_at}")
+                if args.bulk_id:
+                    counts = store.status_counts(args.bulk_id)
+                    print("  " + ", ".join(f"{group}: {n}" for group, n in sorted(counts.items())))
             else:
-                print("📭 No delivery reports found.")
+                print("📭 No delivery reports found. Use --sync to fetch new reports from Infobip.")
+        
+        elif args.template:
+            # One text per CSV row, rendered while the file is read
+            if not args.message or not args.file:
+                log("❌ Error: --template needs -m/--message and a CSV file (-f/--file)")
+                sys.exit(1)
+            if args.to or args.queue or args.at or args.idempotency_key or args.dedup_window:
+                log("❌ Error: --template cannot be combined with --to, --queue, --at, "
+                    "--idempotency-key or --dedup-window")
+                sys.exit(1)
+            
+            template = MessageTemplate(args.message)
+            try:
+                f = open(args.file, 'rb')
+            except FileNotFoundError:
+                log(f"❌ Error: File '{args.file}' not found")
+                sys.exit(1)
+            
+            with f:
+                rendered = read_rendered(f, template, args.column)
+                
+                if args.dry_run:
+                    # ndjson/csv output lists every row with its segment count
+                    on_row = None
+                    if args.output == 'ndjson':
+                        def on_row(row):
+                            sys.stdout.write(json.dumps(row, ensure_ascii=False) + '\n')
+                    elif args.output == 'csv':
+                        rows_csv = csv.writer(sys.stdout)
+                        rows_csv.writerow(['to', 'segments', 'encoding', 'text'])
+                        
+                        def on_row(row):
+                            rows_csv.writerow([row['to'], row['segments'], row['encoding'],
+                                               row['text']])
+                    
+                    estimate = estimate_personalized(rendered, args.price, on_row=on_row)
+                    log("🧮 Dry run (nothing sent):")
+                    log(f"  Recipients: {estimate['recipients']}")
+                    log("  Segments per message: " + ", ".join(
+                        f"{n}: {count}" for n, count in estimate['segments'].items()))
+                    log("  Encodings: " + ", ".join(
+                        f"{name}: {count}" for name, count in estimate['encodings'].items()))
+                    log(f"  Total segments: {estimate['total_segments']}")
+                    if 'estimated_cost' in estimate:
+                        log(f"  Estimated cost: {estimate['estimated_cost']}")
+                    if on_row is None:
+                        for row in estimate['preview']:
+                            log(f"  {row['to']} ({row['segments']} segments): {row['text']}")
+                    return
+                
+                writer = None
+                if args.verbose or args.output != 'text':
+                    writer = ResponseWriter(sys.stdout, args.output, show_details=args.verbose)
+                    writer.start()
+                
+                totals = client.send_personalized_stream(
+                    ((phone, text, args.sender) for phone, text in rendered),
+                    on_batch=writer.write_personalized if writer else None)
+            
+            if writer:
+                writer.close()
+            else:
+                log(f"📱 SMS sent to {totals['sent']}/{totals['rows']} recipients "
+                    f"in {totals['requests']} requests")
+                bulk_ids = totals['bulkIds']
+                if bulk_ids:
+                    more = f" and {len(bulk_ids) - 5} more" if len(bulk_ids) > 5 else ""
+                    log(f"📦 Bulk IDs: {', '.join(bulk_ids[:5])}{more}")
+            log(f"⏱️ Completed in {totals['duration']:.3f} seconds")
         
         else:
             # Send SMS
             if not args.message:
-                print("❌ Error: Message is required. Use -m/--message or -i/--interactive")
+                log("❌ Error: Message is required. Use -m/--message or -i/--interactive")
+                sys.exit(1)
+            scheduled_send = args.at or args.window or args.repeat
+            if (scheduled_send or args.queue) and args.dedup_window:
+                log("❌ Error: --dedup-window cannot be combined with --queue, --at, "
+                    "--window or --repeat")
+                sys.exit(1)
+            if scheduled_send and args.idempotency_key:
+                log("❌ Error: --idempotency-key cannot be combined with --at, --window "
+                    "or --repeat")
                 sys.exit(1)
             
             # Get phone numbers
@@ -435,42 +1322,143 @@ def main():
             if args.to:
                 phones.extend([p.strip() for p in args.to.split(',')])
             
-            if args.file:
-                try:
-                    with open(args.file, 'r') as f:
-                        file_phones = [line.strip() for line in f if line.strip()]
-                        phones.extend(file_phones)
-                except FileNotFoundError:
-                    print(f"❌ Error: File '{args.file}' not found")
-                    sys.exit(1)
+            # Canonicalize to E.164, dropping duplicates and invalid numbers;
+            # files are streamed rather than loaded whole
+            try:
+                if args.file:
+                    with open(args.file, 'rb') as f:
+                        normalized = normalize_stream(
+                            chain(phones, read_phone_numbers(f, args.column)), args.country
+                        )
+                else:
+                    normalized = normalize_stream(phones, args.country)
+            except FileNotFoundError:
+                log(f"❌ Error: File '{args.file}' not found")
+                sys.exit(1)
+            
+            if not normalized['numbers'] and not normalized['rejected']:
+                log("❌ Error: No phone numbers provided. Use -t/--to or -f/--file")
+                sys.exit(1)
+            
+            rejects = normalized['rejects']
+            if rejects:
+                log(f"⚠️ Skipping {normalized['rejected']} invalid numbers:")
+                for phone, reason in rejects[:5]:
+                    log(f"  {phone!r}: {reason}")
+                if normalized['rejected'] > 5:
+                    log(f"  ... and {normalized['rejected'] - 5} more")
+            if normalized['duplicates']:
+                log(f"ℹ️ Removed {normalized['duplicates']} duplicate numbers")
+            phones = normalized['numbers']
             
             if not phones:
-                print("❌ Error: No phone numbers provided. Use -t/--to or -f/--file")
+                log("❌ Error: No valid phone numbers to send to")
                 sys.exit(1)
             
-            # Send SMS
+            if args.dry_run:
+                estimate = estimate_campaign(args.message.strip(), len(phones), args.price)
+                log("🧮 Dry run (nothing sent):")
+                log(f"  Encoding: {estimate['encoding']} ({estimate['characters']} characters)")
+                log(f"  Segments per message: {estimate['segments_per_message']}")
+                log(f"  Recipients: {estimate['recipients']}")
+                log(f"  Total segments: {estimate['total_segments']}")
+                if 'estimated_cost' in estimate:
+                    log(f"  Estimated cost: {estimate['estimated_cost']}")
+                return
+            
+            if scheduled_send:
+                send_at = parse_send_time(args.at, args.timezone) if args.at else time.time()
+                until = (parse_send_time(args.repeat_until, args.timezone)
+                         if args.repeat_until else None)
+                store = ScheduleStore(args.schedule_db)
+                scheduled = store.add(phones, args.message, send_at, sender=args.sender,
+                                      zone=args.timezone, window=args.window,
+                                      recurrence=args.repeat, until=until)
+                store.close()
+                first = datetime.fromtimestamp(scheduled['next_due'], get_zone(args.timezone))
+                log(f"⏰ Scheduled {scheduled['count']} messages in {args.schedule_db}, "
+                    f"first due {first.isoformat(timespec='minutes')}")
+                log(f"🆔 Schedule ID: {scheduled['schedule_id']}")
+                log("ℹ️ They are sent by the scheduler: python sms_schedule.py "
+                    f"--db {args.schedule_db}")
+                return
+            
+            # Only sends use the cache, so other commands leave no database behind
+            client.send_cache = SendCache(args.send_cache, dedup_window=args.dedup_window)
+            
+            if args.queue:
+                text = args.message.strip()
+                
+                def enqueue():
+                    outbox = SMSOutbox(args.queue)
+                    try:
+                        return outbox.enqueue(phones, text, sender=args.sender)
+                    finally:
+                        outbox.close()
+                
+                if args.idempotency_key:
+                    fingerprint = request_fingerprint('queue', phones, text, args.sender)
+                    queued = client.send_cache.run(args.idempotency_key, fingerprint, enqueue)
+                else:
+                    queued = enqueue()
+                if queued.get('replayed'):
+                    log(f"♻️ Already queued with idempotency key {args.idempotency_key!r}; "
+                        "nothing was added")
+                else:
+                    log(f"📥 Queued {queued['count']} messages in {args.queue}")
+                log(f"📦 Batch ID: {queued['batch_id']}")
+                return
+            
+            # Send SMS, writing per-message results as each batch completes
+            writer = None
+            if args.verbose or args.output != 'text':
+                writer = ResponseWriter(sys.stdout, args.output, show_details=args.verbose)
+                writer.start(len(phones))
+            
             start_time = time.time()
-            response = client.send_sms(phones, args.message, sender=args.sender)
+            response = client.send_bulk(phones, args.message, sender=args.sender,
+                                        on_chunk=writer.write_chunk if writer else None,
+                                        idempotency_key=args.idempotency_key)
             end_time = time.time()
             
-            if args.verbose:
-                print(format_response(response, show_details=True))
+            if response.get('replayed'):
+                log(f"♻️ Already sent with idempotency key {args.idempotency_key!r}; "
+                    "showing the original result")
+                if writer:
+                    writer.write_response(response)
+            if response.get('suppressed'):
+                log(f"ℹ️ Skipped {len(response['suppressed'])} recipients sent this message "
+                    f"in the last {args.dedup_window:g} seconds")
+            
+            if writer:
+                writer.close()
             else:
                 messages = response.get('messages', [])
                 success_count = sum(1 for msg in messages if msg.get('status', {}).get('groupName') == 'PENDING')
-                total_count = len(messages)
-                print(f"📱 SMS sent to {success_count}/{total_count} recipients")
-                if response.get('bulkId'):
-                    print(f"📦 Bulk ID: {response['bulkId']}")
+                total_count = len(messages) + len(response.get('failedRecipients', []))
+                log(f"📱 SMS sent to {success_count}/{total_count} recipients")
+                if len(response.get('bulkIds', [])) > 1:
+                    log(f"📦 Bulk IDs: {', '.join(response['bulkIds'])}")
+                elif response.get('bulkId'):
+                    log(f"📦 Bulk ID: {response['bulkId']}")
+            
+            failed_chunks = [c for c in response.get('chunks', []) if c['error']]
+            if failed_chunks:
+                log(f"❌ {len(failed_chunks)} of {len(response['chunks'])} batches failed "
+                    f"({len(response['failedRecipients'])} recipients): {failed_chunks[0]['error']}")
             
-            print(f"⏱️ Completed in {end_time - start_time:.3f} seconds")
+            log(f"⏱️ Completed in {end_time - start_time:.3f} seconds")
     
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        log(f"❌ Error: {str(e)}")
         sys.exit(1)
     
     finally:
         client.close()
+        if breakdown is not None:
+            print(breakdown.format(), file=sys.stderr)
+        if exporter is not None:
+            exporter.close()
 
 if __name__ == '__main__':
     main()
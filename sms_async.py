@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Asynchronous SMS client for the Infobip API
+
+Mirrors the SMSClient surface with coroutines built on aiohttp, so async
+services can keep many sends in flight on a single event loop without
+pushing each call into a thread executor.
+"""
+
+import asyncio
+import time
+from typing import List, Dict, Optional, Union
+
+import aiohttp
+import requests
+
+from sms_application import (MAX_RECIPIENTS, DEFAULT_TIMEOUT, build_payload, merge_chunks,
+                             normalize_recipients, warn_if_multipart)
+
+# Constants
+DEFAULT_POOL_SIZE = 100
+DEFAULT_MAX_IN_FLIGHT = 1000
+DEFAULT_KEEPALIVE_TIMEOUT = 30
+
+
+class AsyncSMSClient:
+    """Infobip SMS Client using asyncio and pooled keep-alive connections"""
+
+    def __init__(self, api_key: str, base_url: str, sender_id: str,
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+                 notify_url: Optional[str] = None,
+                 default_country: Optional[str] = None):
+        """
+        Initialize async SMS Client
+
+        Args:
+            api_key: Infobip API key
+            base_url: API base URL
+            sender_id: Sender ID for SMS messages
+            pool_size: Maximum number of pooled connections
+            max_in_flight: Maximum number of concurrent requests
+            keepalive_timeout: Seconds an idle connection is kept open
+            notify_url: URL Infobip pushes delivery reports to (optional)
+            default_country: Calling code for national numbers, e.g. '254'
+        """
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.sender_id = sender_id
+        self.pool_size = pool_size
+        self.max_in_flight = max_in_flight
+        self.keepalive_timeout = keepalive_timeout
+        self.notify_url = notify_url
+        self.default_country = default_country
+        self.headers = {
+            'Authorization': f'App {self.api_key}',
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        }
+        self.in_flight = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Create the pooled session lazily inside the running event loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._session
+
+    async def _request(self, method: str, path: str, **kwargs) -> Dict:
+        """Perform a request, holding an in-flight slot for its duration"""
+        session = self._get_session()
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                async with session.request(method, f"{self.base_url}{path}", **kwargs) as response:
+                    response.raise_for_status()
+                    return await response.json()
+            finally:
+                self.in_flight -= 1
+
+    async def send_sms(self, to: Union[str, List[str]], text: str,
+                       sender: Optional[str] = None,
+                       delivery_report: bool = True) -> Dict:
+        """
+        Send SMS message(s)
+
+        Args:
+            to: Phone number(s) to send SMS to (with country code)
+            text: SMS message text
+            sender: Custom sender ID (optional)
+            delivery_report: Whether to request delivery report
+
+        Returns:
+            Dict containing API response
+
+        Raises:
+            ValueError: If parameters are invalid
+            requests.RequestException: If API request fails
+        """
+        if not text or not text.strip():
+            raise ValueError("SMS text cannot be empty")
+
+        warn_if_multipart(text)
+
+        to, _ = normalize_recipients(to, self.default_country)
+
+        if len(to) > MAX_RECIPIENTS:
+            raise ValueError(f"Cannot send to more than {MAX_RECIPIENTS} recipients at once")
+
+        return await self._post_messages(self._build_payload(to, text, sender))
+
+    def _build_payload(self, to: List[str], text: str, sender: Optional[str] = None) -> Dict:
+        """Build the /sms/2/text/advanced payload with this client's defaults"""
+        return build_payload(to, text, sender or self.sender_id, self.notify_url)
+
+    async def send_bulk(self, to: Union[str, List[str]], text: str,
+                        sender: Optional[str] = None,
+                        chunk_size: int = MAX_RECIPIENTS) -> Dict:
+        """
+        Send SMS to any number of recipients
+
+        Batches are sent concurrently, bounded by max_in_flight. The result
+        has the same shape as SMSClient.send_bulk.
+
+        Args:
+            to: Phone number(s) to send SMS to (with country code)
+            text: SMS message text
+            sender: Custom sender ID (optional)
+            chunk_size: Recipients per upstream request (max MAX_RECIPIENTS)
+
+        Returns:
+            Dict with merged messages, bulk IDs and per-chunk timings
+
+        Raises:
+            ValueError: If parameters are invalid
+            requests.RequestException: If every batch fails
+        """
+        if not text or not text.strip():
+            raise ValueError("SMS text cannot be empty")
+
+        if not 1 <= chunk_size <= MAX_RECIPIENTS:
+            raise ValueError(f"Chunk size must be between 1 and {MAX_RECIPIENTS}")
+
+        to, duplicates = normalize_recipients(to, self.default_country)
+
+        if not to:
+            raise ValueError("No phone numbers provided")
+
+        chunks = [to[i:i + chunk_size] for i in range(0, len(to), chunk_size)]
+
+        start_time = time.time()
+        outcomes = await asyncio.gather(*(
+            self._send_chunk(index, chunk, text, sender)
+            for index, chunk in enumerate(chunks)
+        ))
+        duration = time.time() - start_time
+
+        result = merge_chunks(list(outcomes), duration)
+        result['duplicates'] = duplicates
+        return result
+
+    async def _post_messages(self, payload: Dict) -> Dict:
+        """POST a prepared payload to the advanced SMS endpoint"""
+        try:
+            return await self._request('POST', '/sms/2/text/advanced', json=payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise requests.RequestException(f"Failed to send SMS: {str(e)}")
+
+    async def _send_chunk(self, index: int, to: List[str], text: str,
+                          sender: Optional[str]) -> Dict:
+        """Send one batch, capturing its timing and any error"""
+        start_time = time.time()
+        outcome = {'index': index, 'recipients': to, 'response': None, 'error': None}
+
+        try:
+            outcome['response'] = await self._post_messages(self._build_payload(to, text, sender))
+        except requests.RequestException as e:
+            outcome['error'] = str(e)
+
+        outcome['duration'] = time.time() - start_time
+        return outcome
+
+    async def get_delivery_reports(self, bulk_id: Optional[str] = None,
+                                   message_id: Optional[str] = None,
+                                   limit: int = 50) -> Dict:
+        """
+        Get delivery reports for sent messages
+
+        Args:
+            bulk_id: Bulk ID from send response
+            message_id: Specific message ID
+            limit: Maximum number of reports to retrieve
+
+        Returns:
+            Dict containing delivery reports
+        """
+        params = {"limit": limit}
+
+        if bulk_id:
+            params["bulkId"] = bulk_id
+        if message_id:
+            params["messageId"] = message_id
+
+        try:
+            return await self._request('GET', '/sms/1/reports', params=params)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise requests.RequestException(f"Failed to get delivery reports: {str(e)}")
+
+    async def check_account_balance(self) -> Dict:
+        """
+        Check account balance
+
+        Returns:
+            Dict containing account balance information
+        """
+        try:
+            return await self._request('GET', '/account/1/balance')
+        except aiohttp.ClientResponseError as e:
+            if e.status == 403:
+                raise requests.RequestException(
+                    "Balance checking requires additional API permissions. "
+                    "Contact Infobip support to enable account access features. "
+                    "SMS sending functionality is not affected."
+                )
+            raise requests.RequestException(f"Failed to check balance: {str(e)}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise requests.RequestException(f"Failed to check balance: {str(e)}")
+
+    async def close(self):
+        """Close the session and its pooled connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
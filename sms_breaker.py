@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Circuit breakers and endpoint failover
+
+SMSClient sends through an EndpointSet: the configured base URL followed
+by alternates (for example other regional Infobip hosts), each guarded by
+a CircuitBreaker. A breaker watches the last `window` calls to its
+endpoint; once at least `min_calls` have been made and the share of
+failures (connection errors, timeouts, 5xx responses, and calls slower
+than `slow_call` seconds) reaches `failure_rate`, it opens. An open
+endpoint is skipped without a request being made. After `reset_timeout`
+seconds it lets `probes` trial calls through (half-open): if they
+succeed the breaker closes, and if one fails it opens again.
+
+Calls go to the first endpoint, in configured order, whose breaker lets
+them through, so traffic returns to the primary host once it recovers.
+A retry moves on to an endpoint the call has not failed on yet. When
+every breaker is open, calls fail at once with CircuitOpenError, which
+the retry policy does not retry.
+
+Breakers live in memory, so each worker process judges the endpoints
+from its own calls.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import requests
+
+# Constants
+DEFAULT_FAILURE_RATE = 0.5
+DEFAULT_MIN_CALLS = 10
+DEFAULT_WINDOW = 20
+DEFAULT_SLOW_CALL = 10.0
+DEFAULT_RESET_TIMEOUT = 30.0
+DEFAULT_PROBES = 1
+
+# Breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling when every endpoint's circuit is open"""
+
+    def __init__(self, message: str, retry_in: Optional[float] = None):
+        super().__init__(message)
+        self.retry_in = retry_in
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """
+    Whether an error counts against the endpoint's health
+
+    Connection errors, timeouts and 5xx responses do; client errors
+    (4xx, including throttling) say nothing about the endpoint.
+    """
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code >= 500
+
+
+class CircuitBreaker:
+    """Tracks one endpoint's recent calls and decides whether to call it"""
+
+    def __init__(self, failure_rate: float = DEFAULT_FAILURE_RATE,
+                 min_calls: int = DEFAULT_MIN_CALLS, window: int = DEFAULT_WINDOW,
+                 slow_call: Optional[float] = DEFAULT_SLOW_CALL,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT, probes: int = DEFAULT_PROBES,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            failure_rate: Share of failed calls in the window that opens
+                the circuit
+            min_calls: Calls in the window before the rate is judged
+            window: Number of recent calls considered
+            slow_call: Seconds after which a successful call counts as a
+                failure; None disables
+            reset_timeout: Seconds the circuit stays open before probing
+            probes: Trial calls allowed (and needed to close) while half-open
+            clock: Monotonic time source
+        """
+        self.failure_rate = failure_rate
+        self.min_calls = max(1, min_calls)
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.probes = max(1, probes)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=max(window, self.min_calls))
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.stats = {'calls': 0, 'failures': 0, 'slow_calls': 0, 'rejected': 0, 'opened': 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        Whether a call may be made now
+
+        A True answer while half-open reserves a probe slot, so every
+        allowed call must be followed by record().
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes_in_flight < self.probes:
+                self._probes_in_flight += 1
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def record(self, success: bool, duration: float = 0.0):
+        """
+        Record the outcome of an allowed call
+
+        Args:
+            success: False for an endpoint failure (see is_endpoint_failure)
+            duration: Seconds the call took; slow calls count as failures
+        """
+        slow = success and self.slow_call is not None and duration > self.slow_call
+        failed = not success or slow
+        with self._lock:
+            self.stats['calls'] += 1
+            if slow:
+                self.stats['slow_calls'] += 1
+            if failed:
+                self.stats['failures'] += 1
+
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if failed:
+                    self._open()
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.probes:
+                        self._state = CLOSED
+                        self._outcomes.clear()
+                return
+            if self._state == OPEN:
+                # A call allowed before the circuit opened
+                return
+
+            self._outcomes.append(failed)
+            if (len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate):
+                self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = self.clock()
+        self._outcomes.clear()
+        self.stats['opened'] += 1
+
+    def retry_in(self) -> float:
+        """Seconds until an open circuit lets a probe through (0 otherwise)"""
+        with self._lock:
+            if self._current_state() != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - self.clock())
+
+    def snapshot(self) -> Dict:
+        """State, recent failure rate and counters of the breaker"""
+        with self._lock:
+            state = self._current_state()
+            outcomes = list(self._outcomes)
+            stats = dict(self.stats)
+            retry_in = (max(0.0, self._opened_at + self.reset_timeout - self.clock())
+                        if state == OPEN else 0.0)
+        stats.update({
+            'state': state,
+            'recent_calls': len(outcomes),
+            'failure_rate': round(sum(outcomes) / len(outcomes), 4) if outcomes else 0.0,
+            'retry_in': round(retry_in, 3)
+        })
+        return stats
+
+
+class EndpointSet:
+    """Base URLs in order of preference, each with its own circuit breaker"""
+
+    def __init__(self, urls: List[str], **breaker_args):
+        """
+        Args:
+            urls: API base URLs; the first is preferred whenever its
+                circuit allows
+            **breaker_args: CircuitBreaker settings used for every endpoint
+
+        Raises:
+            ValueError: If no URL is given
+        """
+        self.urls = []
+        for url in urls:
+            url = url.strip().rstrip('/')
+            if url and url not in self.urls:
+                self.urls.append(url)
+        if not self.urls:
+            raise ValueError("At least one API base URL is required")
+        self.breakers = {url: CircuitBreaker(**breaker_args) for url in self.urls}
+
+    def select(self, avoid: Optional[Set[str]] = None) -> Tuple[str, CircuitBreaker]:
+        """
+        Pick the endpoint for the next call
+
+        Args:
+            avoid: URLs this call has already failed on; used only if no
+                other endpoint is available
+
+        Returns:
+            (base URL, its breaker); record() the call's outcome on it
+
+        Raises:
+            CircuitOpenError: If every endpoint's circuit is open
+        """
+        avoid = avoid or set()
+        for candidates in ([url for url in self.urls if url not in avoid],
+                           [url for url in self.urls if url in avoid]):
+            for url in candidates:
+                breaker = self.breakers[url]
+                if breaker.allow():
+                    return url, breaker
+        retry_in = min(breaker.retry_in() for breaker in self.breakers.values())
+        raise CircuitOpenError(
+            f"All API endpoints are unavailable (circuit open, next probe in {retry_in:.0f}s)",
+            retry_in=retry_in)
+
+    @property
+    def healthy(self) -> bool:
+        """Whether every endpoint's circuit is closed"""
+        return all(breaker.state == CLOSED for breaker in self.breakers.values())
+
+    @property
+    def available(self) -> bool:
+        """Whether any endpoint's circuit is not open"""
+        return any(breaker.state != OPEN for breaker in self.breakers.values())
+
+    def snapshot(self) -> List[Dict]:
+        """Breaker state of every endpoint, in order of preference"""
+        return [dict(self.breakers[url].snapshot(), url=url) for url in self.urls]
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Shared TTL cache
+
+A small key/value cache kept in a SQLite file (WAL mode), so every web
+worker process on the host sees the same entries. Entries are fresh for
+ttl seconds, then served stale for up to stale_ttl more while one process
+refreshes them in the background. Errors that will not go away on retry
+(such as a 403 for a key without balance permission) can be cached too.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+# Constants
+DEFAULT_CACHE_PATH = 'cache.db'
+DEFAULT_TTL = 60
+DEFAULT_STALE_TTL = 300
+DEFAULT_ERROR_TTL = 600
+REFRESH_LEASE = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT,
+    error TEXT,
+    status_code INTEGER,
+    fetched_at REAL NOT NULL,
+    refreshing_until REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+class SharedTTLCache:
+    """TTL cache with stale-while-revalidate, shared through a SQLite file"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: float = DEFAULT_TTL,
+                 stale_ttl: float = DEFAULT_STALE_TTL, error_ttl: float = DEFAULT_ERROR_TTL):
+        """
+        Open (and create if needed) the cache database
+
+        Args:
+            path: SQLite database file shared by all processes
+            ttl: Seconds an entry is served as fresh
+            stale_ttl: Further seconds a value is served while being refreshed
+            error_ttl: Seconds a cached error is served
+        """
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self._local = threading.local()
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0,
+                      'refresh_errors': 0}
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _entry(self, row: sqlite3.Row, now: float, stale: bool) -> Dict:
+        return {
+            'value': json.loads(row['value']) if row['value'] is not None else None,
+            'error': row['error'],
+            'status_code': row['status_code'],
+            'age': round(now - row['fetched_at'], 3),
+            'stale': stale,
+            'cached': True
+        }
+
+    def _store(self, key: str, value: Any = None, error: Optional[str] = None,
+               status_code: Optional[int] = None, fetched_at: Optional[float] = None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cache (key, value, error, status_code, fetched_at, "
+            "refreshing_until) VALUES (?, ?, ?, ?, ?, 0)",
+            (key, json.dumps(value) if error is None else None, error, status_code,
+             fetched_at if fetched_at is not None else time.time())
+        )
+
+    def _claim_refresh(self, key: str, now: float) -> bool:
+        """Take the refresh lease for key; only one process wins it"""
+        cursor = self._connect().execute(
+            "UPDATE cache SET refreshing_until = ? WHERE key = ? AND refreshing_until < ?",
+            (now + REFRESH_LEASE, key, now)
+        )
+        return cursor.rowcount == 1
+
+    def _fetch(self, key: str, fetch: Callable[[], Any],
+               cache_error: Callable[[Exception], Optional[int]]) -> Dict:
+        """Call fetch and store its result, or its error if cache_error allows"""
+        try:
+            value = fetch()
+        except Exception as e:
+            status_code = cache_error(e)
+            if status_code is None:
+                raise
+            now = time.time()
+            self._store(key, error=str(e), status_code=status_code, fetched_at=now)
+            return {'value': None, 'error': str(e), 'status_code': status_code,
+                    'age': 0.0, 'stale': False, 'cached': False}
+        self._store(key, value)
+        return {'value': value, 'error': None, 'status_code': None,
+                'age': 0.0, 'stale': False, 'cached': False}
+
+    def _refresh(self, key: str, fetch: Callable[[], Any],
+                 cache_error: Callable[[Exception], Optional[int]]):
+        try:
+            self._fetch(key, fetch, cache_error)
+            self.stats['refreshes'] += 1
+        except Exception as e:
+            # Keep serving the stale value; the lease expires and a later
+            # request tries again
+            self.stats['refresh_errors'] += 1
+            print(f"Error refreshing cache entry {key}: {e}")
+
+    def get(self, key: str, fetch: Callable[[], Any],
+            cache_error: Callable[[Exception], Optional[int]] = lambda e: None) -> Dict:
+        """
+        Return a cached value, fetching or refreshing it as needed
+
+        Args:
+            key: Cache key
+            fetch: Returns the JSON-serializable value for key
+            cache_error: Maps an exception raised by fetch to a status code
+                if it should be cached, or None to let it propagate
+
+        Returns:
+            Dict with 'value', 'error' and 'status_code' (for a cached
+            error), 'age' (seconds since fetched), 'stale' and 'cached'
+        """
+        now = time.time()
+        row = self._connect().execute(
+            "SELECT * FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is not None:
+            age = now - row['fetched_at']
+            ttl = self.error_ttl if row['error'] is not None else self.ttl
+            if age < ttl:
+                self.stats['hits'] += 1
+                return self._entry(row, now, stale=False)
+
+            if row['error'] is None and age < ttl + self.stale_ttl:
+                self.stats['stale_hits'] += 1
+                if self._claim_refresh(key, now):
+                    threading.Thread(target=self._refresh, args=(key, fetch, cache_error),
+                                     name='cache-refresh', daemon=True).start()
+                return self._entry(row, now, stale=True)
+
+        self.stats['misses'] += 1
+        return self._fetch(key, fetch, cache_error)
+
+    def invalidate(self, key: str):
+        """Drop an entry"""
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
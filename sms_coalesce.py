@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Request coalescing
+
+Concurrent small sends (one-time codes, alerts) each cost an upstream
+request when sent one by one. A SendCoalescer holds calls for up to
+`window` seconds after the first one arrives, or until `max_batch`
+recipients are waiting, and sends them together through
+SMSClient.send_personalized: calls with the same text share one message
+object, different texts become separate message objects of the same
+request. Each caller blocks until the statuses of its own recipients are
+back.
+
+Only calls made in the same process are merged, so a web worker needs
+several threads (gunicorn --threads) for this to help.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Union
+
+import requests
+
+from sms_idempotency import request_fingerprint
+
+# Constants
+DEFAULT_WINDOW = 0.05
+DEFAULT_MAX_BATCH = 1000
+# Batches sent at the same time; while all are busy, new calls keep
+# collecting into the next batch
+DEFAULT_MAX_IN_FLIGHT = 4
+
+
+class _Call:
+    """One caller's recipients waiting for a flush"""
+
+    __slots__ = ('to', 'text', 'sender', 'callback_data', 'arrived', 'future')
+
+    def __init__(self, to: List[str], text: str, sender: Optional[str],
+                 callback_data: Optional[str]):
+        self.to = to
+        self.text = text
+        self.sender = sender
+        self.callback_data = callback_data
+        self.arrived = time.monotonic()
+        self.future = Future()
+
+
+class SendCoalescer:
+    """Merges concurrent sends into shared upstream requests"""
+
+    def __init__(self, client, window: float = DEFAULT_WINDOW,
+                 max_batch: int = DEFAULT_MAX_BATCH,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        """
+        Args:
+            client: SMSClient used for the merged sends
+            window: Seconds a call may wait for others to join its batch
+            max_batch: Recipients that flush a batch before the window ends
+            max_in_flight: Batches sent at the same time
+        """
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending: List[_Call] = []
+        self._pending_recipients = 0
+        self._closed = False
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._thread = None
+        self.stats = {'calls': 0, 'recipients': 0, 'batches': 0, 'requests': 0}
+
+    def send(self, to: Union[str, List[str]], text: str, sender: Optional[str] = None,
+             callback_data: Optional[str] = None,
+             idempotency_key: Optional[str] = None) -> Dict:
+        """
+        Send SMS as part of the next batch and wait for the result
+
+        Args:
+            to: Phone number(s) to send to
+            text: SMS message content
+            sender: Sender ID (optional, uses default if not provided)
+            callback_data: Custom data returned in delivery reports
+            idempotency_key: As for SMSClient.send_sms; needs a client with
+                a send_cache
+
+        Returns:
+            Dict shaped like SMSClient.send_bulk's result ('bulkId',
+            'bulkIds', 'messages', 'failedRecipients', 'duplicates',
+            'suppressed'), covering only this call's recipients, plus
+            'coalesced': the number of calls in the batch
+
+        Raises:
+            ValueError: If the text is empty or a phone number is invalid
+            requests.RequestException: If no recipient could be sent to
+            IdempotencyConflict: If the key was used for a different send
+                or is being sent right now
+        """
+        if idempotency_key is not None:
+            fingerprint = request_fingerprint('send_bulk', to, text, sender, callback_data)
+            return self.client._require_send_cache().run(
+                idempotency_key, fingerprint,
+                lambda: self.send(to, text, sender, callback_data))
+
+        if not text or not text.strip():
+            raise ValueError("SMS text cannot be empty")
+        to, duplicates = self.client._normalize_recipients(to)
+        if not to:
+            raise ValueError("No phone numbers provided")
+        to, suppressed = self.client._claim_recent(to, text)
+        if not to:
+            return {'bulkId': None, 'bulkIds': [], 'messages': [], 'failedRecipients': [],
+                    'duplicates': duplicates, 'suppressed': suppressed, 'coalesced': 0}
+
+        try:
+            result = self.submit(to, text, sender, callback_data).result()
+        except BaseException:
+            self.client._release_recent(to, text)
+            raise
+        self.client._release_recent(result['failedRecipients'], text)
+        result['duplicates'] = duplicates
+        result['suppressed'] = suppressed
+        return result
+
+    def submit(self, to: List[str], text: str, sender: Optional[str] = None,
+               callback_data: Optional[str] = None) -> Future:
+        """
+        Queue already normalized recipients for the next batch
+
+        Returns:
+            Future resolving to this call's part of the batch result
+        """
+        call = _Call(to, text, sender, callback_data)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("SendCoalescer is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sms-coalescer',
+                                                daemon=True)
+                self._thread.start()
+            self._pending.append(call)
+            self._pending_recipients += len(to)
+            self.stats['calls'] += 1
+            self._cond.notify()
+        return call.future
+
+    def _run(self):
+        """Cut batches from the pending calls and hand them to sender threads"""
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                while not self._closed and self._pending_recipients < self.max_batch:
+                    remaining = self._pending[0].arrived + self.window - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+
+            # Waiting for a free slot lets the next batch grow meanwhile
+            self._slots.acquire()
+            threading.Thread(target=self._flush, args=(batch,), name='sms-coalesce-flush',
+                             daemon=True).start()
+
+    def _take_batch(self) -> List[_Call]:
+        """Remove whole calls, up to max_batch recipients (at least one call)"""
+        batch, size = [], 0
+        while self._pending and (not batch or size + len(self._pending[0].to) <= self.max_batch):
+            call = self._pending.pop(0)
+            batch.append(call)
+            size += len(call.to)
+        self._pending_recipients -= size
+        return batch
+
+    def _flush(self, batch: List[_Call]):
+        """Send one batch and give every call its own results"""
+        try:
+            rows, spans = [], []
+            for call in batch:
+                start = len(rows)
+                rows.extend((phone, call.text, call.sender, call.callback_data)
+                            for phone in call.to)
+                spans.append((call, start, len(rows)))
+
+            try:
+                outcome = self.client.send_personalized(rows)
+            except Exception as e:
+                for call in batch:
+                    call.future.set_exception(e)
+                return
+
+            self.stats['batches'] += 1
+            self.stats['recipients'] += len(rows)
+            self.stats['requests'] += len(outcome['requests'])
+            for call, start, end in spans:
+                self._resolve(call, outcome['results'][start:end], len(batch))
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _resolve(call: _Call, results: List[Dict], coalesced: int):
+        failed = [r['to'] for r in results if r['error']]
+        if len(failed) == len(results):
+            call.future.set_exception(requests.RequestException(results[0]['error']))
+            return
+        bulk_ids = []
+        for r in results:
+            if r['bulkId'] and r['bulkId'] not in bulk_ids:
+                bulk_ids.append(r['bulkId'])
+        call.future.set_result({
+            'bulkId': bulk_ids[0] if bulk_ids else None,
+            'bulkIds': bulk_ids,
+            'messages': [{'to': r['to'], 'messageId': r['messageId'], 'status': r['status'],
+                          'smsCount': r['smsCount']} for r in results if not r['error']],
+            'failedRecipients': failed,
+            'coalesced': coalesced
+        })
+
+    def close(self):
+        """Flush the calls still waiting and stop the batching thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
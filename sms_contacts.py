@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Streaming contact file readers
+
+Generators that turn a stream of bytes (a file, or an upload as it
+arrives) into phone numbers without holding the whole file in memory.
+Plain text, CSV and gzip-compressed input are supported; the phone
+column of a CSV can be picked by index or header name.
+
+ContactListStore keeps uploaded lists on the server, so the browser only
+needs a list ID: numbers are stored as packed 64-bit integers and read
+back through mmap.
+"""
+
+import codecs
+import csv
+import json
+import mmap
+import os
+import re
+import time
+import uuid
+import zlib
+from array import array
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Union
+
+# Constants
+CHUNK_SIZE = 64 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+DEFAULT_CONTACTS_PATH = 'contacts'
+DEFAULT_PREVIEW_SIZE = 5
+DEFAULT_LIST_RETENTION = 24 * 3600
+# Shortest time between two expiry sweeps of the store directory
+PURGE_INTERVAL = 60
+LIST_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadTooLarge(ValueError):
+    """Raised when a stream exceeds its configured size limit"""
+
+
+def iter_file_chunks(fileobj: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield a binary file in fixed-size chunks"""
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def iter_decompressed(chunks: Iterable[bytes], max_bytes: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Transparently gunzip a byte stream
+
+    Gzip input is detected from its magic bytes. max_bytes limits the
+    decompressed size, which also guards against compression bombs.
+
+    Raises:
+        UploadTooLarge: If more than max_bytes would be produced
+    """
+    decompressor = None
+    total = 0
+    first = True
+
+    for chunk in chunks:
+        if first and chunk:
+            first = False
+            if chunk[:2] == GZIP_MAGIC:
+                decompressor = zlib.decompressobj(wbits=31)
+        if decompressor is not None:
+            # Inflate at most one byte past the limit, so a small chunk
+            # cannot expand in memory before the check
+            limit = max_bytes - total + 1 if max_bytes is not None else 0
+            chunk = decompressor.decompress(chunk, limit)
+        total += len(chunk)
+        if max_bytes is not None and total > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+        if chunk:
+            yield chunk
+
+    if decompressor is not None:
+        tail = decompressor.flush()
+        total += len(tail)
+        if max_bytes is not None and total > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+        if tail:
+            yield tail
+
+
+def iter_lines(chunks: Iterable[bytes], encoding: str = 'utf-8') -> Iterator[str]:
+    """Decode a byte stream incrementally and yield its lines"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+
+    for chunk in chunks:
+        text = pending + decoder.decode(chunk)
+        # A trailing '\r' may be the first half of '\r\n'; hold it back
+        cut = len(text) - 1 if text.endswith('\r') else len(text)
+        lines = text[:cut].splitlines()
+        pending = text[cut:]
+        # The last piece may be an incomplete line
+        if lines and text[:cut] and text[cut - 1] not in '\r\n':
+            pending = lines.pop() + pending
+        yield from lines
+
+    pending += decoder.decode(b'', final=True)
+    yield from pending.splitlines()
+
+
+def iter_rows(lines: Iterable[str]) -> Iterator[List[str]]:
+    """Yield CSV rows, skipping blank lines and '#' comments"""
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        if '"' in line:
+            # Only quoted rows need the csv module
+            yield next(csv.reader([line], skipinitialspace=True))
+        else:
+            yield line.split(',')
+
+
+def is_column_name(column: Union[int, str]) -> bool:
+    """Whether column is a header name rather than an index"""
+    return isinstance(column, str) and not column.isdigit()
+
+
+def column_index(column: Union[int, str], header: Optional[List[str]] = None) -> int:
+    """
+    Resolve a column index or header name (case-insensitive) to an index
+
+    Raises:
+        ValueError: If a named column is not in the header
+    """
+    if not is_column_name(column):
+        return int(column)
+    names = [name.strip().lower() for name in header or []]
+    if column.strip().lower() not in names:
+        raise ValueError(f"Column '{column}' not found in header")
+    return names.index(column.strip().lower())
+
+
+def iter_phone_column(rows: Iterable[List[str]], column: Union[int, str] = 0) -> Iterator[str]:
+    """
+    Yield the phone number field of each row
+
+    Args:
+        rows: CSV rows
+        column: Zero-based column index, or a header name; with a name the
+            first row is treated as the header
+
+    Raises:
+        ValueError: If a named column is not in the header
+    """
+    rows = iter(rows)
+    header = next(rows, None) if is_column_name(column) else None
+    column = column_index(column, header)
+
+    for row in rows:
+        if len(row) > column:
+            phone = row[column].strip()
+            if phone:
+                yield phone
+
+
+def read_phone_numbers(fileobj: BinaryIO, column: Union[int, str] = 0,
+                       max_bytes: Optional[int] = None) -> Iterator[str]:
+    """
+    Stream phone numbers from a text, CSV or gzip file
+
+    Args:
+        fileobj: File opened in binary mode
+        column: Phone column index or header name
+        max_bytes: Limit on the (decompressed) size read
+
+    Returns:
+        Generator of raw phone number strings
+    """
+    chunks = iter_decompressed(iter_file_chunks(fileobj), max_bytes)
+    return iter_phone_column(iter_rows(iter_lines(chunks)), column)
+
+
+class ContactListStore:
+    """
+    On-disk store of uploaded contact lists
+
+    Each list is a file of native uint64 values, one per E.164 number with
+    the '+' dropped (E.164 never starts with 0, so the round trip is exact),
+    next to a small JSON file of metadata. 500k contacts take 4MB on disk
+    and are read back through mmap rather than held in memory. Lists older
+    than the retention period are removed as new ones are created.
+    """
+
+    def __init__(self, path: str = DEFAULT_CONTACTS_PATH,
+                 retention: Optional[float] = DEFAULT_LIST_RETENTION):
+        """
+        Open (and create if needed) the store directory
+
+        Args:
+            path: Directory holding the lists
+            retention: Seconds a list is kept; None or 0 keeps lists until
+                they are deleted
+        """
+        self.path = path
+        self.retention = retention
+        self._next_purge = 0.0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, list_id: str, suffix: str) -> str:
+        if not LIST_ID_PATTERN.match(list_id or ''):
+            raise ValueError(f"Invalid contact list ID: {list_id}")
+        return os.path.join(self.path, list_id + suffix)
+
+    def create(self, numbers: Iterable[str], **meta) -> Dict:
+        """
+        Store a list of E.164 numbers
+
+        Args:
+            numbers: Canonical E.164 numbers (see sms_numbers)
+            **meta: Extra metadata to keep with the list, e.g. duplicates
+
+        Returns:
+            The list's metadata, including 'list_id' and 'count'
+        """
+        if self.retention and time.monotonic() >= self._next_purge:
+            self._next_purge = time.monotonic() + PURGE_INTERVAL
+            self.purge(self.retention)
+
+        packed = array('Q', [int(number[1:]) for number in numbers])
+        list_id = uuid.uuid4().hex
+        data_file = self._file(list_id, '.bin')
+
+        # Write to temporary names and rename, so readers never see half a list
+        with open(data_file + '.tmp', 'wb') as f:
+            packed.tofile(f)
+        os.replace(data_file + '.tmp', data_file)
+
+        info = dict(meta, list_id=list_id, count=len(packed), created_at=time.time())
+        meta_file = self._file(list_id, '.json')
+        with open(meta_file + '.tmp', 'w') as f:
+            json.dump(info, f)
+        os.replace(meta_file + '.tmp', meta_file)
+        return info
+
+    def info(self, list_id: str) -> Optional[Dict]:
+        """Metadata of a list, or None if it does not exist"""
+        try:
+            with open(self._file(list_id, '.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def iter_numbers(self, list_id: str, start: int = 0,
+                     stop: Optional[int] = None) -> Iterator[str]:
+        """
+        Yield a list's numbers as E.164 strings
+
+        Args:
+            list_id: Contact list ID
+            start: Index of the first number
+            stop: Index after the last number (default: end of list)
+
+        Raises:
+            KeyError: If the list does not exist
+        """
+        try:
+            f = open(self._file(list_id, '.bin'), 'rb')
+        except FileNotFoundError:
+            raise KeyError(list_id) from None
+
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                    memoryview(mapped) as raw, raw.cast('Q') as values, \
+                    values[start:stop] as window:
+                for value in window:
+                    yield '+%d' % value
+
+    def numbers(self, list_id: str) -> List[str]:
+        """All numbers of a list (raises KeyError if it does not exist)"""
+        return list(self.iter_numbers(list_id))
+
+    def preview(self, list_id: str, size: int = DEFAULT_PREVIEW_SIZE) -> List[str]:
+        """The first few numbers of a list"""
+        return list(self.iter_numbers(list_id, 0, size))
+
+    def delete(self, list_id: str) -> bool:
+        """
+        Remove a list
+
+        Returns:
+            False if the list did not exist
+        """
+        found = False
+        for suffix in ('.bin', '.json'):
+            try:
+                os.remove(self._file(list_id, suffix))
+                found = True
+            except FileNotFoundError:
+                pass
+        return found
+
+    def purge(self, older_than: float) -> int:
+        """
+        Remove lists created more than older_than seconds ago
+
+        Returns:
+            Number of lists removed
+        """
+        cutoff = time.time() - older_than
+        removed = 0
+        for name in os.listdir(self.path):
+            list_id, ext = os.path.splitext(name)
+            if ext == '.json' and LIST_ID_PATTERN.match(list_id):
+                info = self.info(list_id) or {}
+                if info.get('created_at', 0) < cutoff and self.delete(list_id):
+                    removed += 1
+        return removed
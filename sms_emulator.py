@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Local Infobip API emulator
+
+Serves /sms/2/text/advanced, /sms/1/reports and /account/1/balance so the
+web app, the CLI and the outbox worker can be exercised (and load tested)
+without sending real messages. Response latency is drawn from a
+configurable distribution, a share of requests can be failed with 500s or
+throttled with 429s, and every accepted message gets a delivery report
+after a random delay. Reports are pushed to the message's notifyUrl when
+it has one and otherwise wait to be pulled from /sms/1/reports.
+
+Built on aiohttp so a single process can hold thousands of slow responses
+open and stays out of the way of the server under test.
+
+Point config.py at it (API_BASE_URL = "http://127.0.0.1:8089") and run:
+    python sms_emulator.py --latency lognormal:40,0.5 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from sms_segments import segment_text
+
+# Constants
+DEFAULT_PORT = 8089
+DEFAULT_LATENCY = 'lognormal:40,0.5'
+DEFAULT_REPORT_DELAY = 'uniform:1000,5000'
+DEFAULT_OUTCOMES = 'DELIVERED=0.93,UNDELIVERABLE=0.04,EXPIRED=0.02,REJECTED=0.01'
+DEFAULT_BALANCE = 1000.0
+DEFAULT_PRICE = 0.0075
+DEFAULT_CURRENCY = 'EUR'
+MAX_REPORTS_LIMIT = 1000
+PUSH_BATCH_SIZE = 100
+PUSH_INTERVAL = 0.1
+
+PENDING_STATUS = {'groupId': 1, 'groupName': 'PENDING', 'id': 26, 'name': 'PENDING_ACCEPTED',
+                  'description': 'Message sent to next instance'}
+INVALID_DESTINATION_STATUS = {'groupId': 5, 'groupName': 'REJECTED', 'id': 51,
+                              'name': 'MISSING_TO', 'description': 'Missing destination.'}
+
+# Final status and error of a delivery report, by status group
+OUTCOMES = {
+    'DELIVERED': (
+        {'groupId': 3, 'groupName': 'DELIVERED', 'id': 5, 'name': 'DELIVERED_TO_HANDSET',
+         'description': 'Message delivered to handset'},
+        {'groupId': 0, 'groupName': 'OK', 'id': 0, 'name': 'NO_ERROR',
+         'description': 'No Error', 'permanent': False}),
+    'UNDELIVERABLE': (
+        {'groupId': 2, 'groupName': 'UNDELIVERABLE', 'id': 9, 'name': 'UNDELIVERABLE_NOT_DELIVERED',
+         'description': 'Message sent not delivered'},
+        {'groupId': 1, 'groupName': 'HANDSET_ERRORS', 'id': 27, 'name': 'EC_ABSENT_SUBSCRIBER',
+         'description': 'Absent Subscriber', 'permanent': False}),
+    'EXPIRED': (
+        {'groupId': 4, 'groupName': 'EXPIRED', 'id': 15, 'name': 'EXPIRED_EXPIRED',
+         'description': 'Message expired'},
+        {'groupId': 1, 'groupName': 'HANDSET_ERRORS', 'id': 1, 'name': 'EC_UNKNOWN_SUBSCRIBER',
+         'description': 'Unknown Subscriber', 'permanent': True}),
+    'REJECTED': (
+        {'groupId': 5, 'groupName': 'REJECTED', 'id': 6, 'name': 'REJECTED_NETWORK',
+         'description': 'Network is forbidden'},
+        {'groupId': 3, 'groupName': 'OPERATOR_ERRORS', 'id': 4001, 'name': 'EC_NETWORK_REJECTED',
+         'description': 'Rejected by operator', 'permanent': True}),
+}
+
+
+def parse_distribution(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parse a latency distribution given in milliseconds
+
+    Args:
+        spec: 'fixed:MS' (or just 'MS'), 'uniform:LOW,HIGH', 'normal:MEAN,SD',
+            'lognormal:MEDIAN,SIGMA' or 'exponential:MEAN'
+
+    Returns:
+        Function drawing a delay in seconds from a random.Random
+
+    Raises:
+        ValueError: If the spec is not understood
+    """
+    kind, _, args = spec.partition(':')
+    if not args:
+        kind, args = 'fixed', kind
+    try:
+        values = [float(value) for value in args.split(',')]
+    except ValueError:
+        raise ValueError(f"Invalid distribution parameters: {spec}")
+    expected = {'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2, 'exponential': 1}
+    if kind not in expected:
+        raise ValueError(f"Unknown distribution '{kind}' (choose from {', '.join(expected)})")
+    if len(values) != expected[kind] or any(value < 0 for value in values):
+        raise ValueError(f"Invalid distribution parameters: {spec}")
+
+    first = values[0] / 1000
+    if kind == 'fixed':
+        return lambda rng: first
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(first, values[1] / 1000)
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(first, values[1] / 1000))
+    if kind == 'lognormal':
+        # The second parameter is the shape (sigma), which has no unit
+        mu, sigma = math.log(first or 1e-6), values[1]
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    return lambda rng: rng.expovariate(1 / first) if first else 0.0
+
+
+def parse_outcomes(spec: str) -> Dict[str, float]:
+    """
+    Parse delivery report outcome weights such as 'DELIVERED=0.9,EXPIRED=0.1'
+
+    Raises:
+        ValueError: If a status group is unknown or a weight is invalid
+    """
+    weights = {}
+    for item in spec.split(','):
+        name, _, weight = item.strip().partition('=')
+        name = name.upper()
+        if name not in OUTCOMES:
+            raise ValueError(f"Unknown report status '{name}' (choose from {', '.join(OUTCOMES)})")
+        try:
+            weights[name] = float(weight)
+        except ValueError:
+            raise ValueError(f"Invalid weight for {name}: {weight!r}")
+        if weights[name] < 0:
+            raise ValueError(f"Invalid weight for {name}: {weight!r}")
+    if not sum(weights.values()):
+        raise ValueError("At least one report status needs a positive weight")
+    return weights
+
+
+def _timestamp(epoch: float) -> str:
+    """Infobip's timestamp format, e.g. 2024-05-01T10:00:00.000+0000"""
+    moment = datetime.fromtimestamp(epoch, timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}+0000"
+
+
+def _error(status: int, message_id: str, text: str, headers: Optional[Dict] = None):
+    """An Infobip-style error response"""
+    return web.json_response({'requestError': {'serviceException': {
+        'messageId': message_id, 'text': text}}}, status=status, headers=headers)
+
+
+class InfobipEmulator:
+    """In-memory stand-in for the Infobip SMS API"""
+
+    def __init__(self, latency: str = DEFAULT_LATENCY,
+                 error_rate: float = 0.0,
+                 throttle_rate: float = 0.0,
+                 rate_limit: float = 0.0,
+                 retry_after: int = 1,
+                 report_delay: str = DEFAULT_REPORT_DELAY,
+                 outcomes: str = DEFAULT_OUTCOMES,
+                 balance: float = DEFAULT_BALANCE,
+                 price: float = DEFAULT_PRICE,
+                 currency: str = DEFAULT_CURRENCY,
+                 api_key: Optional[str] = None,
+                 push_reports: bool = True,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            latency: Response latency distribution (see parse_distribution)
+            error_rate: Share of requests answered with a 500
+            throttle_rate: Share of requests answered with a 429
+            rate_limit: Requests per second accepted before answering 429
+                (0 for no limit)
+            retry_after: Retry-After seconds sent with 429 responses
+            report_delay: Distribution of the delay before a message's
+                delivery report is ready
+            outcomes: Weights of the final report statuses (see parse_outcomes)
+            balance: Starting account balance
+            price: Price per SMS segment, deducted from the balance
+            currency: Balance and price currency
+            api_key: Key required in the 'Authorization: App <key>' header
+                (any key is accepted when None)
+            push_reports: Push reports to notifyUrl when a message has one
+            seed: Random seed, for repeatable runs
+        """
+        if not 0 <= error_rate + throttle_rate <= 1:
+            raise ValueError("error_rate and throttle_rate must add up to between 0 and 1")
+        self.latency = parse_distribution(latency)
+        self.report_delay = parse_distribution(report_delay)
+        weights = parse_outcomes(outcomes)
+        self.outcome_names = list(weights)
+        self.outcome_weights = list(weights.values())
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.balance = balance
+        self.price = price
+        self.currency = currency
+        self.api_key = api_key
+        self.push_reports = push_reports
+        self.rng = random.Random(seed)
+
+        # (ready_at, sequence, notify_url, report) for reports not yet due
+        self._scheduled = []
+        self._sequence = itertools.count()
+        # messageId -> report, ready to be pulled in the order they became due
+        self._ready = {}
+        self._tokens = rate_limit
+        self._refilled = time.monotonic()
+
+        self.stats = {
+            'requests': 0,
+            'messages': 0,
+            'rejected_destinations': 0,
+            'injected_errors': 0,
+            'throttled': 0,
+            'unauthorized': 0,
+            'reports_pulled': 0,
+            'reports_pushed': 0,
+            'push_errors': 0
+        }
+
+    def make_app(self) -> web.Application:
+        """Build the aiohttp application serving the emulated API"""
+        app = web.Application(middlewares=[self._faults])
+        app.router.add_post('/sms/2/text/advanced', self.send_messages)
+        app.router.add_get('/sms/1/reports', self.get_reports)
+        app.router.add_get('/account/1/balance', self.get_balance)
+        app.router.add_get('/emulator/stats', self.get_stats)
+        app.cleanup_ctx.append(self._pusher)
+        return app
+
+    @web.middleware
+    async def _faults(self, request: web.Request, handler):
+        """Apply authentication, rate limiting, latency and injected failures"""
+        if request.path.startswith('/emulator/'):
+            return await handler(request)
+        self.stats['requests'] += 1
+
+        if self.api_key is not None and request.headers.get('Authorization') != f'App {self.api_key}':
+            self.stats['unauthorized'] += 1
+            return _error(401, 'UNAUTHORIZED', 'Invalid login details')
+
+        if not self._take_token():
+            self.stats['throttled'] += 1
+            return _error(429, 'TOO_MANY_REQUESTS', 'Too many requests',
+                          headers={'Retry-After': str(self.retry_after)})
+
+        await asyncio.sleep(self.latency(self.rng))
+
+        roll = self.rng.random()
+        if roll < self.error_rate:
+            self.stats['injected_errors'] += 1
+            return _error(500, 'GENERAL_ERROR', 'Something went wrong. Please contact support.')
+        if roll < self.error_rate + self.throttle_rate:
+            self.stats['throttled'] += 1
+            return _error(429, 'TOO_MANY_REQUESTS', 'Too many requests',
+                          headers={'Retry-After': str(self.retry_after)})
+        return await handler(request)
+
+    def _take_token(self) -> bool:
+        """Token bucket allowing rate_limit requests per second (bursts of one second)"""
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    async def send_messages(self, request: web.Request) -> web.Response:
+        """POST /sms/2/text/advanced"""
+        try:
+            payload = await request.json()
+        except ValueError:
+            return _error(400, 'BAD_REQUEST', 'Request body is not valid JSON')
+        messages = payload.get('messages') if isinstance(payload, dict) else None
+        if not messages or not isinstance(messages, list):
+            return _error(400, 'BAD_REQUEST', 'Request must contain at least one message')
+
+        bulk_id = payload.get('bulkId') or uuid.uuid4().hex
+        now = time.time()
+        results = []
+        for message in messages:
+            sms_count = segment_text(message.get('text') or '')['segments']
+            for destination in message.get('destinations') or []:
+                to = str(destination.get('to', '')).lstrip('+')
+                message_id = destination.get('messageId') or uuid.uuid4().hex
+                if not (to.isdigit() and 7 <= len(to) <= 15):
+                    self.stats['rejected_destinations'] += 1
+                    results.append({'to': to, 'messageId': message_id,
+                                    'status': INVALID_DESTINATION_STATUS})
+                    continue
+
+                self.stats['messages'] += 1
+                self.balance -= sms_count * self.price
+                results.append({'to': to, 'messageId': message_id, 'smsCount': sms_count,
+                                'status': PENDING_STATUS})
+                self._schedule_report(now, bulk_id, message_id, to, sms_count, message)
+
+        return web.json_response({'bulkId': bulk_id, 'messages': results})
+
+    def _schedule_report(self, sent_at: float, bulk_id: str, message_id: str, to: str,
+                         sms_count: int, message: Dict):
+        """Queue the delivery report of an accepted message"""
+        done_at = sent_at + self.report_delay(self.rng)
+        status, error = OUTCOMES[self.rng.choices(self.outcome_names, self.outcome_weights)[0]]
+        report = {
+            'bulkId': bulk_id,
+            'messageId': message_id,
+            'to': to,
+            'sentAt': _timestamp(sent_at),
+            'doneAt': _timestamp(done_at),
+            'smsCount': sms_count,
+            'price': {'pricePerMessage': round(sms_count * self.price, 6),
+                      'currency': self.currency},
+            'status': status,
+            'error': error,
+            'callbackData': message.get('callbackData') or ''
+        }
+        notify_url = (message.get('notifyUrl') or None) if self.push_reports else None
+        heapq.heappush(self._scheduled, (done_at, next(self._sequence), notify_url, report))
+
+    def _due(self, now: float) -> Dict[str, List[Dict]]:
+        """
+        Move reports that are due out of the schedule
+
+        Pull reports go to the ready set; the rest are returned grouped by
+        the notifyUrl they should be pushed to.
+        """
+        pushes = {}
+        while self._scheduled and self._scheduled[0][0] <= now:
+            _, _, notify_url, report = heapq.heappop(self._scheduled)
+            if notify_url:
+                pushes.setdefault(notify_url, []).append(report)
+            else:
+                self._ready[report['messageId']] = report
+        return pushes
+
+    async def get_reports(self, request: web.Request) -> web.Response:
+        """GET /sms/1/reports; each report is handed out once"""
+        try:
+            limit = min(int(request.query.get('limit', 50)), MAX_REPORTS_LIMIT)
+        except ValueError:
+            return _error(400, 'BAD_REQUEST', 'limit must be a number')
+        bulk_id = request.query.get('bulkId')
+        message_id = request.query.get('messageId')
+
+        self._pushes_to_ready(self._due(time.time()))
+        taken = []
+        for report in self._ready.values():
+            if len(taken) >= limit:
+                break
+            if bulk_id and report['bulkId'] != bulk_id:
+                continue
+            if message_id and report['messageId'] != message_id:
+                continue
+            taken.append(report)
+        for report in taken:
+            del self._ready[report['messageId']]
+        self.stats['reports_pulled'] += len(taken)
+        return web.json_response({'results': taken})
+
+    async def get_balance(self, request: web.Request) -> web.Response:
+        """GET /account/1/balance"""
+        return web.json_response({'balance': round(self.balance, 4), 'currency': self.currency})
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        """GET /emulator/stats: counters for load test reports"""
+        return web.json_response(dict(self.stats, reports_scheduled=len(self._scheduled),
+                                      reports_ready=len(self._ready),
+                                      balance=round(self.balance, 4)))
+
+    def _pushes_to_ready(self, pushes: Dict[str, List[Dict]]):
+        """Fall back to pull delivery for reports that cannot be pushed now"""
+        for reports in pushes.values():
+            for report in reports:
+                self._ready[report['messageId']] = report
+
+    async def _pusher(self, app: web.Application):
+        """Background task pushing due reports to their notifyUrl"""
+        async def run(session: aiohttp.ClientSession):
+            while True:
+                await asyncio.sleep(PUSH_INTERVAL)
+                for url, reports in self._due(time.time()).items():
+                    for i in range(0, len(reports), PUSH_BATCH_SIZE):
+                        batch = reports[i:i + PUSH_BATCH_SIZE]
+                        try:
+                            async with session.post(url, json={'results': batch}) as response:
+                                response.raise_for_status()
+                            self.stats['reports_pushed'] += len(batch)
+                        except (aiohttp.ClientError, asyncio.TimeoutError):
+                            # Infobip would retry; here they can still be pulled
+                            self.stats['push_errors'] += 1
+                            self._pushes_to_ready({url: batch})
+
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        task = asyncio.ensure_future(run(session))
+        yield
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Infobip API emulator for testing')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'Port to listen on (default {DEFAULT_PORT})')
+    parser.add_argument('--latency', default=DEFAULT_LATENCY,
+                        help='Response latency in ms: fixed:MS, uniform:LOW,HIGH, normal:MEAN,SD, '
+                             f'lognormal:MEDIAN,SIGMA or exponential:MEAN (default {DEFAULT_LATENCY})')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of requests failed with a 500 (default 0)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='Share of requests throttled with a 429 (default 0)')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='Requests per second before answering 429 (default unlimited)')
+    parser.add_argument('--retry-after', type=int, default=1,
+                        help='Retry-After seconds on 429 responses (default 1)')
+    parser.add_argument('--report-delay', default=DEFAULT_REPORT_DELAY,
+                        help=f'Delay before delivery reports are ready, in ms (default {DEFAULT_REPORT_DELAY})')
+    parser.add_argument('--outcomes', default=DEFAULT_OUTCOMES,
+                        help=f'Delivery report status weights (default {DEFAULT_OUTCOMES})')
+    parser.add_argument('--balance', type=float, default=DEFAULT_BALANCE,
+                        help=f'Starting account balance (default {DEFAULT_BALANCE:g})')
+    parser.add_argument('--api-key', help='Require this API key (default: accept any)')
+    parser.add_argument('--no-push', action='store_true',
+                        help='Never push reports to notifyUrl; keep them all for /sms/1/reports')
+    parser.add_argument('--seed', type=int, help='Random seed for repeatable runs')
+    args = parser.parse_args()
+
+    try:
+        emulator = InfobipEmulator(latency=args.latency, error_rate=args.error_rate,
+                                   throttle_rate=args.throttle_rate, rate_limit=args.rate_limit,
+                                   retry_after=args.retry_after, report_delay=args.report_delay,
+                                   outcomes=args.outcomes, balance=args.balance,
+                                   api_key=args.api_key, push_reports=not args.no_push,
+                                   seed=args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(f"🧪 Infobip emulator on http://{args.host}:{args.port} "
+          f"(latency {args.latency}, {args.error_rate:.1%} errors, "
+          f"{args.throttle_rate:.1%} throttled)")
+    web.run_app(emulator.make_app(), host=args.host, port=args.port,
+                print=None, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
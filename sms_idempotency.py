@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Duplicate send protection
+
+Two guards against paying twice for the same message, kept in one SQLite
+file (WAL mode) so they hold across web workers and repeated CLI runs:
+
+- Idempotency keys: the first request made with a key runs and its
+  response is stored; later requests with the same key get the stored
+  response without an upstream call. The table is bounded by a TTL and a
+  maximum number of keys, oldest evicted first.
+- Recent-send dedup (optional): (recipient, text) pairs sent within the
+  last dedup_window seconds are dropped from new sends.
+
+The database is opened on first use, so creating a SendCache has no side
+effects.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Constants
+DEFAULT_SEND_CACHE_PATH = 'sends.db'
+DEFAULT_KEY_TTL = 24 * 3600
+DEFAULT_MAX_KEYS = 10000
+# A key whose first request has not finished after this long (a crashed
+# process) can be claimed again
+DEFAULT_PENDING_TTL = 300
+# Bound parameters per SQL statement
+QUERY_BATCH = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    response TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency (created_at);
+CREATE TABLE IF NOT EXISTS recent_sends (
+    digest BLOB PRIMARY KEY,
+    sent_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_recent_sends_sent ON recent_sends (sent_at);
+"""
+
+
+class IdempotencyConflict(ValueError):
+    """An idempotency key reused for a different request, or still in use"""
+
+    def __init__(self, message: str, in_progress: bool = False):
+        super().__init__(message)
+        self.in_progress = in_progress
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """Hash of the JSON-serializable parts of a request"""
+    encoded = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def _digest(recipient: str, text: str) -> bytes:
+    return hashlib.sha256(f'{recipient}\0{text}'.encode('utf-8')).digest()[:16]
+
+
+class SendCache:
+    """Idempotency keys and recent sends, shared through a SQLite file"""
+
+    def __init__(self, path: str = DEFAULT_SEND_CACHE_PATH, key_ttl: float = DEFAULT_KEY_TTL,
+                 max_keys: int = DEFAULT_MAX_KEYS, dedup_window: float = 0,
+                 pending_ttl: float = DEFAULT_PENDING_TTL):
+        """
+        Args:
+            path: SQLite database file shared by all processes
+            key_ttl: Seconds a stored response is replayed for its key
+            max_keys: Keys kept before the oldest are evicted
+            dedup_window: Seconds a (recipient, text) pair is suppressed
+                after being sent; 0 disables dedup
+            pending_ttl: Seconds before an unfinished key can be reclaimed
+        """
+        self.path = path
+        self.key_ttl = key_ttl
+        self.max_keys = max_keys
+        self.dedup_window = dedup_window
+        self.pending_ttl = pending_ttl
+        self._local = threading.local()
+        self.stats = {'stored': 0, 'replays': 0, 'conflicts': 0, 'evicted': 0, 'suppressed': 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it (and the schema) on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def run(self, key: str, fingerprint: str, func: Callable[[], Optional[Dict]]) -> Optional[Dict]:
+        """
+        Run func once per idempotency key
+
+        Args:
+            key: Idempotency key chosen by the caller
+            fingerprint: request_fingerprint() of the request, so a key
+                reused for a different request is refused
+            func: Performs the request, returning a JSON-serializable dict
+
+        Returns:
+            func's result, or the stored result of the key's first request
+            with 'replayed' set to True. If func raises or returns None,
+            nothing is stored and the key can be used again.
+
+        Raises:
+            IdempotencyConflict: If the key belongs to a different request
+                or its first request is still running
+        """
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT * FROM idempotency WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                age = now - row['created_at']
+                if age > self.key_ttl or (row['response'] is None and age > self.pending_ttl):
+                    conn.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+                    row = None
+            if row is None:
+                conn.execute("INSERT INTO idempotency (key, fingerprint, created_at) VALUES (?, ?, ?)",
+                             (key, fingerprint, now))
+
+        if row is not None:
+            if row['fingerprint'] != fingerprint:
+                self.stats['conflicts'] += 1
+                raise IdempotencyConflict(
+                    "Idempotency key was already used for a different request")
+            if row['response'] is None:
+                self.stats['conflicts'] += 1
+                raise IdempotencyConflict(
+                    "A request with this idempotency key is still in progress", in_progress=True)
+            self.stats['replays'] += 1
+            return dict(json.loads(row['response']), replayed=True)
+
+        try:
+            result = func()
+        except BaseException:
+            self._release(key)
+            raise
+        if result is None:
+            self._release(key)
+            return None
+
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("UPDATE idempotency SET response = ? WHERE key = ?",
+                         (json.dumps(result), key))
+            self._evict(conn, time.time())
+        self.stats['stored'] += 1
+        return result
+
+    def _release(self, key: str):
+        """Forget an unfinished key so the request can be retried"""
+        self._connect().execute(
+            "DELETE FROM idempotency WHERE key = ? AND response IS NULL", (key,))
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Drop expired keys, then the oldest past max_keys"""
+        evicted = conn.execute("DELETE FROM idempotency WHERE created_at < ?",
+                               (now - self.key_ttl,)).rowcount
+        excess = conn.execute("SELECT COUNT(*) FROM idempotency").fetchone()[0] - self.max_keys
+        if excess > 0:
+            evicted += conn.execute(
+                "DELETE FROM idempotency WHERE key IN "
+                "(SELECT key FROM idempotency ORDER BY created_at LIMIT ?)", (excess,)
+            ).rowcount
+        self.stats['evicted'] += evicted
+
+    def claim_recent(self, recipients: Iterable[str], text: str) -> Tuple[List[str], List[str]]:
+        """
+        Split recipients into those to send text to and those recently sent it
+
+        Recipients returned for sending are recorded as sent now; pass the
+        ones whose send then fails to release_recent().
+
+        Returns:
+            (recipients to send to, suppressed recipients), in input order
+        """
+        recipients = list(recipients)
+        if not self.dedup_window or not recipients:
+            return recipients, []
+
+        now = time.time()
+        digests = [_digest(recipient, text) for recipient in recipients]
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("DELETE FROM recent_sends WHERE sent_at < ?", (now - self.dedup_window,))
+            recent = set()
+            for i in range(0, len(digests), QUERY_BATCH):
+                batch = digests[i:i + QUERY_BATCH]
+                recent.update(row[0] for row in conn.execute(
+                    f"SELECT digest FROM recent_sends WHERE digest IN ({','.join('?' * len(batch))})",
+                    batch))
+            fresh, suppressed, claimed = [], [], set()
+            for recipient, digest in zip(recipients, digests):
+                if digest in recent or digest in claimed:
+                    suppressed.append(recipient)
+                else:
+                    fresh.append(recipient)
+                    claimed.add(digest)
+            conn.executemany("INSERT OR REPLACE INTO recent_sends (digest, sent_at) VALUES (?, ?)",
+                             ((digest, now) for digest in claimed))
+        self.stats['suppressed'] += len(suppressed)
+        return fresh, suppressed
+
+    def release_recent(self, recipients: Iterable[str], text: str):
+        """Forget recipients claimed by claim_recent() whose send failed"""
+        if not self.dedup_window:
+            return
+        digests = [(_digest(recipient, text),) for recipient in recipients]
+        if digests:
+            conn = self._connect()
+            with conn:
+                conn.executemany("DELETE FROM recent_sends WHERE digest = ?", digests)
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Background send jobs
+
+The web app hands bulk sends to a SendJobRunner instead of sending inside
+the request: the request returns a job ID at once and the send runs on a
+small thread pool in the same worker. Progress (sent, failed, skipped and
+remaining recipients) is written to a SQLite job table after every batch,
+so a progress stream served by any gunicorn worker can follow a job
+started by another.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import requests
+
+from sms_idempotency import request_fingerprint
+
+# Constants
+DEFAULT_JOBS_PATH = 'jobs.db'
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_MAX_PENDING = 100
+DEFAULT_RETENTION = 24 * 3600
+DEFAULT_POLL_INTERVAL = 0.25
+# A running job records progress after every batch; one silent for this
+# long belonged to a worker process that died
+DEFAULT_ORPHAN_AFTER = 600
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'queued',
+    total INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    duplicates INTEGER NOT NULL DEFAULT 0,
+    bulk_ids TEXT NOT NULL DEFAULT '[]',
+    error TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at);
+"""
+
+
+class JobStore:
+    """SQLite table of send jobs and their progress"""
+
+    def __init__(self, path: str = DEFAULT_JOBS_PATH, retention: float = DEFAULT_RETENTION,
+                 orphan_after: float = DEFAULT_ORPHAN_AFTER):
+        """
+        Open (and create if needed) the job database
+
+        Running jobs left behind by a dead worker process are marked failed.
+
+        Args:
+            path: SQLite database file
+            retention: Seconds a finished job is kept
+            orphan_after: Seconds without progress after which a running
+                job is taken to be orphaned
+        """
+        self.path = path
+        self.retention = retention
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+        self.fail_orphaned(orphan_after)
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Add skipped to databases created before it existed"""
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if 'skipped' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN skipped INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def create(self, total: int, duplicates: int = 0) -> str:
+        """Record a new queued job, dropping finished jobs past retention"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - self.retention,))
+            conn.execute(
+                "INSERT INTO jobs (id, total, duplicates, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, total, duplicates, now, now)
+            )
+        return job_id
+
+    def fail_orphaned(self, older_than: float = DEFAULT_ORPHAN_AFTER) -> int:
+        """
+        Mark running jobs without progress for older_than seconds failed
+
+        Other worker processes share the table, so only jobs that have
+        gone quiet are touched, not every running job.
+
+        Returns:
+            Number of jobs marked failed
+        """
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, failed = total - sent - skipped, finished_at = ?, "
+                "version = version + 1, updated_at = ? WHERE status = ? AND updated_at < ?",
+                (FAILED, 'Interrupted: the worker running this job stopped', now, now,
+                 RUNNING, now - older_than)
+            ).rowcount
+
+    def start(self, job_id: str):
+        """Mark a job as running"""
+        self._update(job_id, "status = ?", (RUNNING,))
+
+    def progress(self, job_id: str, sent: int, failed: int, bulk_id: Optional[str] = None,
+                 skipped: int = 0):
+        """
+        Add the outcome of one batch to a job's counts
+
+        skipped counts recipients deliberately not sent to (suppressed by
+        the send dedup window), which are neither sent nor failed.
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT bulk_ids FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            bulk_ids = json.loads(row['bulk_ids'])
+            if bulk_id:
+                bulk_ids.append(bulk_id)
+            conn.execute(
+                "UPDATE jobs SET sent = sent + ?, failed = failed + ?, skipped = skipped + ?, "
+                "bulk_ids = ?, version = version + 1, updated_at = ? WHERE id = ?",
+                (sent, failed, skipped, json.dumps(bulk_ids), time.time(), job_id)
+            )
+
+    def finish(self, job_id: str, error: Optional[str] = None):
+        """
+        Mark a job done, or failed with error
+
+        Recipients not accounted for by progress() count as failed.
+        """
+        now = time.time()
+        self._update(job_id, "status = ?, error = ?, failed = total - sent - skipped, finished_at = ?",
+                     (FAILED if error else DONE, error, now))
+
+    def _update(self, job_id: str, assignments: str, values: tuple):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"UPDATE jobs SET {assignments}, version = version + 1, updated_at = ? WHERE id = ?",
+                values + (time.time(), job_id)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Current state of a job
+
+        Returns:
+            Dict with 'job_id', 'status', 'total', 'sent', 'failed',
+            'skipped', 'remaining', 'duplicates', 'bulk_ids', 'error', 'version'
+            (bumped on every change) and timestamps, or None if unknown
+        """
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row['id'],
+            'status': row['status'],
+            'total': row['total'],
+            'sent': row['sent'],
+            'failed': row['failed'],
+            'skipped': row['skipped'],
+            'remaining': max(0, row['total'] - row['sent'] - row['failed'] - row['skipped']),
+            'duplicates': row['duplicates'],
+            'bulk_ids': json.loads(row['bulk_ids']),
+            'error': row['error'],
+            'version': row['version'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'finished_at': row['finished_at']
+        }
+
+    def watch(self, job_id: str, since_version: int = -1, timeout: float = 20.0,
+              poll_interval: float = DEFAULT_POLL_INTERVAL) -> Iterator[Dict]:
+        """
+        Yield a job's state each time it changes
+
+        The first state is yielded straight away unless its version is
+        since_version or older (a reconnecting client already has it).
+        Stops after the job finishes or after timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                return
+            if job['version'] > since_version or job['status'] in FINISHED:
+                since_version = job['version']
+                yield job
+            if job['status'] in FINISHED or time.monotonic() >= deadline:
+                return
+            time.sleep(poll_interval)
+
+
+class SendJobRunner:
+    """Runs send_bulk jobs on a thread pool, recording progress per batch"""
+
+    def __init__(self, client, store: JobStore, workers: int = DEFAULT_JOB_WORKERS,
+                 max_pending: int = DEFAULT_MAX_PENDING):
+        """
+        Args:
+            client: SMSClient used for the sends
+            store: Where job progress is recorded
+            workers: Jobs run at the same time
+            max_pending: Jobs queued or running before submit() refuses more
+        """
+        self.client = client
+        self.store = store
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sms-job')
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def submit(self, phone_numbers: List[str], text: str, sender: Optional[str] = None,
+               callback_data: Optional[str] = None,
+               idempotency_key: Optional[str] = None) -> Optional[Dict]:
+        """
+        Validate recipients and queue the send
+
+        Args:
+            idempotency_key: Submitting again with the same key returns the
+                first job (with 'replayed': True) instead of starting
+                another; needs a client with a send_cache
+
+        Returns:
+            The new job's state, or None if max_pending jobs are already
+            queued or running
+
+        Raises:
+            ValueError: If the text is empty or a phone number is invalid
+            IdempotencyConflict: If the key was used for a different send
+                or is being submitted right now
+        """
+        if idempotency_key is not None:
+            fingerprint = request_fingerprint('job', phone_numbers, text, sender, callback_data)
+            job = self.client._require_send_cache().run(
+                idempotency_key, fingerprint,
+                lambda: self.submit(phone_numbers, text, sender, callback_data))
+            if job is not None and job.get('replayed'):
+                job = dict(self.store.get(job['job_id']) or job, replayed=True)
+            return job
+
+        if not text or not text.strip():
+            raise ValueError("SMS text cannot be empty")
+        to, duplicates = self.client._normalize_recipients(phone_numbers)
+        if not to:
+            raise ValueError("No phone numbers provided")
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+
+        job_id = None
+        try:
+            job_id = self.store.create(len(to), duplicates)
+            self._executor.submit(self._run, job_id, to, text, sender, callback_data)
+        except Exception as e:
+            # _run never started, so the slot is released here
+            with self._lock:
+                self._pending -= 1
+            if job_id is not None:
+                try:
+                    self.store.finish(job_id, error=f"Could not start job: {e}")
+                except sqlite3.Error:
+                    pass
+            raise
+        return self.store.get(job_id)
+
+    def _run(self, job_id: str, to: List[str], text: str, sender: Optional[str],
+             callback_data: Optional[str]):
+        try:
+            self.store.start(job_id)
+
+            def on_chunk(outcome: Dict):
+                if outcome['error']:
+                    self.store.progress(job_id, 0, len(outcome['recipients']))
+                    return
+                response = outcome['response'] or {}
+                messages = response.get('messages', [])
+                sent = sum(1 for msg in messages
+                           if msg.get('status', {}).get('groupName') == 'PENDING')
+                self.store.progress(job_id, sent, len(outcome['recipients']) - sent,
+                                    response.get('bulkId'))
+
+            try:
+                result = self.client.send_bulk(to, text, sender=sender,
+                                               callback_data=callback_data, on_chunk=on_chunk)
+                # Suppressed recipients were skipped on purpose, not failed
+                if result.get('suppressed'):
+                    self.store.progress(job_id, 0, 0, skipped=len(result['suppressed']))
+                self.store.finish(job_id)
+            except (requests.RequestException, ValueError) as e:
+                self.store.finish(job_id, error=str(e))
+        except Exception as e:
+            print(f"Error running send job {job_id}: {e}")
+            try:
+                self.store.finish(job_id, error=str(e))
+            except sqlite3.Error:
+                pass
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    @property
+    def pending(self) -> int:
+        """Jobs queued or running"""
+        with self._lock:
+            return self._pending
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting jobs, optionally waiting for queued ones"""
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Phone number normalization
+
+Canonicalizes phone numbers to E.164 (+<country code><number>), validates
+them and removes duplicates. normalize_numbers works on a whole batch at
+once: the numbers are joined into one buffer so separator stripping,
+prefix rewriting and validation run inside str/re C code rather than a
+per-number Python loop.
+"""
+
+import re
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Constants
+MIN_DIGITS = 7
+MAX_DIGITS = 15
+
+DEFAULT_STREAM_BATCH = 100000
+DEFAULT_MAX_REJECTS = 100
+
+# Separators people put in numbers: spaces, dashes, dots, brackets, slashes
+_SEPARATORS = str.maketrans('', '', ' -().\t\r/')
+# [0-9] rather than \d, which also matches non-ASCII digits such as '０' or '٣'
+_E164_LINES = re.compile(r'^\+[1-9][0-9]{%d,%d}$' % (MIN_DIGITS - 1, MAX_DIGITS - 1), re.M)
+
+
+def _country_digits(default_country: Optional[str]) -> str:
+    """Digits of a calling code given as '254' or '+254'"""
+    digits = (default_country or '').lstrip('+')
+    if digits and not (digits.isdigit() and digits.isascii()):
+        raise ValueError(f"Invalid default country code: {default_country}")
+    return digits
+
+
+def normalize_number(phone: str, default_country: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Canonicalize one phone number to E.164
+
+    Numbers starting with '+' or '00' are international; numbers starting
+    with the trunk prefix '0' are national and need default_country; bare
+    digits are taken as international without the '+'.
+
+    Args:
+        phone: Phone number as entered
+        default_country: Calling code for national numbers, e.g. '254'
+
+    Returns:
+        (E.164 number, None) if valid, otherwise (None, reason)
+    """
+    country = _country_digits(default_country)
+    cleaned = phone.translate(_SEPARATORS)
+
+    if not cleaned:
+        return None, 'empty'
+    if cleaned.startswith('+'):
+        digits = cleaned[1:]
+    elif cleaned.startswith('00'):
+        digits = cleaned[2:]
+    elif cleaned.startswith('0'):
+        if not country:
+            return None, 'missing country code'
+        digits = country + cleaned[1:]
+    else:
+        digits = cleaned
+
+    if not (digits.isdigit() and digits.isascii()):
+        return None, 'invalid characters'
+    if digits.startswith('0'):
+        return None, 'invalid country code'
+    if len(digits) < MIN_DIGITS:
+        return None, 'too short'
+    if len(digits) > MAX_DIGITS:
+        return None, 'too long'
+    return '+' + digits, None
+
+
+def normalize_numbers(numbers: Iterable[str], default_country: Optional[str] = None) -> Dict:
+    """
+    Canonicalize, validate and deduplicate a batch of phone numbers
+
+    Args:
+        numbers: Phone numbers as entered
+        default_country: Calling code for national numbers, e.g. '254'
+
+    Returns:
+        Dict with 'numbers' (unique E.164 numbers in first-seen order),
+        'rejects' ((input, reason) pairs) and 'duplicates' (count removed)
+    """
+    if not isinstance(numbers, list):
+        numbers = list(numbers)
+    country = _country_digits(default_country)
+
+    # One line per number, each starting right after a '\n'
+    buf = '\n' + '\n'.join(numbers).translate(_SEPARATORS)
+    rejects = []
+
+    if buf.count('\n') != len(numbers):
+        # An input contained a newline; fall back to one number at a time
+        valid = []
+        for phone in numbers:
+            canonical, reason = normalize_number(phone, country)
+            if canonical:
+                valid.append(canonical)
+            else:
+                rejects.append((phone, reason))
+    else:
+        buf = buf.replace('\n00', '\n+')
+        if country:
+            buf = buf.replace('\n0', '\n+' + country)
+        buf = buf.replace('\n+', '\n').replace('\n', '\n+')
+        valid = _E164_LINES.findall(buf)
+
+        if len(valid) != len(numbers):
+            # Rare path: find the offending lines and explain them
+            for phone, line in zip(numbers, buf[1:].split('\n')):
+                if not _E164_LINES.match(line):
+                    rejects.append((phone, normalize_number(phone, country)[1] or 'invalid format'))
+
+    unique = list(dict.fromkeys(valid))
+    return {
+        'numbers': unique,
+        'rejects': rejects,
+        'duplicates': len(valid) - len(unique)
+    }
+
+
+def normalize_stream(numbers: Iterable[str], default_country: Optional[str] = None,
+                     batch_size: int = DEFAULT_STREAM_BATCH,
+                     max_rejects: int = DEFAULT_MAX_REJECTS) -> Dict:
+    """
+    Canonicalize and deduplicate an unbounded stream of phone numbers
+
+    The stream is consumed in batches through normalize_numbers, so memory
+    grows with the unique numbers kept rather than with the input size.
+
+    Args:
+        numbers: Iterable of phone numbers as entered (e.g. a file reader)
+        default_country: Calling code for national numbers, e.g. '254'
+        batch_size: Numbers normalized per batch
+        max_rejects: Rejected inputs kept as a sample
+
+    Returns:
+        Dict with 'numbers' (unique E.164 numbers in first-seen order),
+        'rejects' (sample of (input, reason) pairs), 'rejected' (total
+        rejected count) and 'duplicates' (count removed)
+    """
+    numbers = iter(numbers)
+    seen = {}
+    rejects = []
+    rejected = duplicates = 0
+
+    while True:
+        batch = list(islice(numbers, batch_size))
+        if not batch:
+            break
+        result = normalize_numbers(batch, default_country)
+        before = len(seen)
+        seen.update(dict.fromkeys(result['numbers']))
+        duplicates += result['duplicates'] + len(result['numbers']) - (len(seen) - before)
+        rejected += len(result['rejects'])
+        if len(rejects) < max_rejects:
+            rejects.extend(result['rejects'][:max_rejects - len(rejects)])
+
+    return {
+        'numbers': list(seen),
+        'rejects': rejects,
+        'rejected': rejected,
+        'duplicates': duplicates
+    }
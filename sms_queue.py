@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Durable outbound SMS queue
+
+Messages are written to an on-disk SQLite outbox (WAL mode) by the web app
+or CLI and drained by a separate worker process. Every row records its own
+status, so a crashed or timed-out run resumes where it stopped instead of
+losing or blindly resending the batch.
+
+Run the worker with:
+    python sms_queue.py --db outbox.db
+"""
+
+import argparse
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Constants
+DEFAULT_OUTBOX_PATH = 'outbox.db'
+DEFAULT_CLAIM_SIZE = 1000
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_STALE_AFTER = 300
+MAX_SEND_ATTEMPTS = 3
+# A failed row waits RETRY_DELAY seconds times its attempt count
+RETRY_DELAY = 30
+# Longest time between checks for rows left in 'sending' by a dead worker
+REQUEUE_INTERVAL = 60
+
+# Row states
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+# The send failed in a way Infobip may still have acted on (a 5xx, read
+# timeout or dropped connection); resending could deliver it twice, so the
+# row is left for delivery reports or an operator to settle
+UNKNOWN = 'unknown'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    batch_id TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    text TEXT NOT NULL,
+    sender TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claim_id TEXT,
+    message_id TEXT,
+    bulk_id TEXT,
+    error TEXT,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at, id);
+CREATE INDEX IF NOT EXISTS idx_outbox_batch ON outbox (batch_id, status);
+CREATE INDEX IF NOT EXISTS idx_outbox_claim ON outbox (claim_id);
+"""
+
+
+class SMSOutbox:
+    """SQLite-backed outbox shared by producers and the send worker"""
+
+    def __init__(self, path: str = DEFAULT_OUTBOX_PATH, retry_delay: float = RETRY_DELAY):
+        """
+        Open (and create if needed) the outbox database
+
+        Args:
+            path: SQLite database file
+            retry_delay: Seconds per attempt a failed row waits before it
+                can be claimed again
+        """
+        self.path = path
+        self.retry_delay = retry_delay
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+            conn.executescript(INDEXES)
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Add next_attempt_at to outboxes created before it existed"""
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(outbox)")}
+        if 'next_attempt_at' not in columns:
+            conn.execute("ALTER TABLE outbox ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0")
+            conn.execute("DROP INDEX IF EXISTS idx_outbox_status")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, recipients: Iterable[str], text: str,
+                sender: Optional[str] = None) -> Dict:
+        """
+        Queue one text for a list of recipients
+
+        Args:
+            recipients: Phone numbers (already validated)
+            text: SMS message text
+            sender: Custom sender ID (optional)
+
+        Returns:
+            Dict with the new 'batch_id' and queued 'count'
+        """
+        return self.enqueue_rows((phone, text, sender) for phone in recipients)
+
+    def enqueue_rows(self, rows: Iterable[Tuple[str, str, Optional[str]]]) -> Dict:
+        """
+        Queue personalized (recipient, text, sender) rows as one batch
+
+        Insert cost is an append plus index updates, so it does not grow
+        with the size of the queue.
+        """
+        batch_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN')
+            cursor = conn.executemany(
+                "INSERT INTO outbox (batch_id, recipient, text, sender, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((batch_id, phone, text, sender, now, now) for phone, text, sender in rows)
+            )
+        return {'batch_id': batch_id, 'count': cursor.rowcount}
+
+    def claim(self, limit: int = DEFAULT_CLAIM_SIZE) -> List[sqlite3.Row]:
+        """
+        Atomically move up to `limit` queued rows to 'sending'
+
+        Rows waiting out a retry delay are skipped until it has passed.
+
+        Returns:
+            The claimed rows, oldest first
+        """
+        claim_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                "UPDATE outbox SET status = ?, claim_id = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE id IN (SELECT id FROM outbox WHERE status = ? AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at, id LIMIT ?)",
+                (SENDING, claim_id, now, QUEUED, now, limit)
+            )
+        return conn.execute(
+            "SELECT * FROM outbox WHERE claim_id = ? ORDER BY id", (claim_id,)
+        ).fetchall()
+
+    def record_results(self, results: Iterable[Dict]):
+        """
+        Store the outcome of claimed rows
+
+        Each result needs 'id' and either 'error' or 'message_id'/'bulk_id'.
+        A failed result with 'retryable' set (Infobip cannot have acted on
+        it) goes back to the queue, retry_delay seconds per attempt later,
+        until MAX_SEND_ATTEMPTS is reached. One with 'ambiguous' set is
+        marked unknown; any other failure is final.
+        """
+        now = time.time()
+        sent, retried, finished = [], [], []
+        for result in results:
+            if not result.get('error'):
+                sent.append((result.get('message_id'), result.get('bulk_id'), now, result['id']))
+            elif result.get('retryable'):
+                retried.append((result['error'], now, now, self.retry_delay, result['id']))
+            else:
+                finished.append((UNKNOWN if result.get('ambiguous') else FAILED, result['error'],
+                                 result.get('message_id'), result.get('bulk_id'), now,
+                                 result['id']))
+
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany(
+                "UPDATE outbox SET status = 'sent', message_id = ?, bulk_id = ?, error = NULL, "
+                "updated_at = ? WHERE id = ?", sent
+            )
+            conn.executemany(
+                f"UPDATE outbox SET error = ?, updated_at = ?, "
+                f"next_attempt_at = ? + ? * attempts, status = CASE "
+                f"WHEN attempts >= {MAX_SEND_ATTEMPTS} THEN 'failed' ELSE 'queued' END "
+                f"WHERE id = ?", retried
+            )
+            conn.executemany(
+                "UPDATE outbox SET status = ?, error = ?, message_id = ?, bulk_id = ?, "
+                "updated_at = ? WHERE id = ?", finished
+            )
+
+    def requeue_stale(self, older_than: float = DEFAULT_STALE_AFTER) -> int:
+        """
+        Return rows stuck in 'sending' (e.g. after a worker crash) to the queue
+
+        Delivery is at-least-once: a row whose request reached Infobip just
+        before the crash can be sent again.
+
+        Returns:
+            Number of rows requeued
+        """
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE outbox SET status = ?, claim_id = NULL WHERE status = ? AND updated_at < ?",
+                (QUEUED, SENDING, time.time() - older_than)
+            )
+        return cursor.rowcount
+
+    def batch_status(self, batch_id: str) -> Dict[str, int]:
+        """Count rows per status for one batch"""
+        rows = self._connect().execute(
+            "SELECT status, COUNT(*) FROM outbox WHERE batch_id = ? GROUP BY status",
+            (batch_id,)
+        ).fetchall()
+        return {status: count for status, count in rows}
+
+    def stats(self) -> Dict[str, int]:
+        """Count rows per status across the whole outbox"""
+        rows = self._connect().execute(
+            "SELECT status, COUNT(*) FROM outbox GROUP BY status"
+        ).fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def process_claimed(outbox: SMSOutbox, client, rows: List[sqlite3.Row]) -> Dict[str, int]:
+    """
+    Send claimed rows through the client and record each outcome
+
+    Rows are sent with SMSClient.send_personalized, so identical texts share
+    message objects and many rows travel in each upstream request. A row
+    only counts as sent if Infobip accepted it (status group PENDING); any
+    other status, such as REJECTED, fails the row without a retry.
+
+    Like SMSClient's own retries, a failed row is only sent again if
+    Infobip cannot have acted on it (connection never opened, 429, 503).
+    Validation errors and other 4xx responses fail the row at once, and an
+    ambiguous failure (5xx, read timeout, dropped connection) marks it
+    unknown rather than risk a second delivery.
+
+    Returns:
+        Dict with 'sent', 'failed' and 'unknown' counts for this batch
+        ('failed' includes the unknown rows and rows to be retried)
+    """
+    response = client.send_personalized(
+        (row['recipient'], row['text'], row['sender']) for row in rows
+    )
+    results = []
+    for row, result in zip(rows, response['results']):
+        error = result['error']
+        status = result['status'] or {}
+        if not error and status.get('groupName') != 'PENDING':
+            error = (f"{status.get('groupName') or 'UNKNOWN'}: "
+                     f"{status.get('description') or status.get('name') or 'not accepted'}")
+        results.append({
+            'id': row['id'],
+            'error': error,
+            'retryable': bool(result['error'] and result.get('retryable')),
+            'ambiguous': bool(result['error'] and result.get('ambiguous')),
+            'message_id': result['messageId'],
+            'bulk_id': result['bulkId']
+        })
+    outbox.record_results(results)
+
+    failed = sum(1 for r in results if r['error'])
+    unknown = sum(1 for r in results if r['ambiguous'])
+    return {'sent': len(results) - failed, 'failed': failed, 'unknown': unknown}
+
+
+def run_worker(outbox: SMSOutbox, client, claim_size: int = DEFAULT_CLAIM_SIZE,
+               poll_interval: float = DEFAULT_POLL_INTERVAL,
+               stale_after: float = DEFAULT_STALE_AFTER,
+               once: bool = False, stop_event: Optional[threading.Event] = None) -> Dict[str, int]:
+    """
+    Drain the outbox until stopped
+
+    Args:
+        outbox: Outbox to drain
+        client: SMSClient used to send
+        claim_size: Rows claimed per iteration
+        poll_interval: Seconds to wait when the queue is empty
+        stale_after: Seconds after which 'sending' rows are requeued;
+            checked at start and every REQUEUE_INTERVAL seconds after
+        once: Stop as soon as no queued row is ready to claim (rows
+            waiting out a retry delay stay queued)
+        stop_event: Event that ends the loop when set
+
+    Returns:
+        Totals of sent, failed and unknown rows
+    """
+    stop_event = stop_event or threading.Event()
+    totals = {'sent': 0, 'failed': 0, 'unknown': 0}
+
+    next_requeue = 0.0
+
+    while not stop_event.is_set():
+        # A worker restarted within stale_after of a crash finds its old
+        # claims still too fresh at start, so the check is repeated
+        if time.monotonic() >= next_requeue:
+            requeued = outbox.requeue_stale(stale_after)
+            if requeued:
+                print(f"♻️ Requeued {requeued} messages left in 'sending' by a previous run")
+            next_requeue = time.monotonic() + min(stale_after, REQUEUE_INTERVAL)
+
+        rows = outbox.claim(claim_size)
+        if not rows:
+            if once:
+                break
+            stop_event.wait(poll_interval)
+            continue
+
+        start_time = time.time()
+        counts = process_claimed(outbox, client, rows)
+        totals['sent'] += counts['sent']
+        totals['failed'] += counts['failed']
+        totals['unknown'] += counts['unknown']
+        print(f"📤 Sent {counts['sent']}/{len(rows)} messages in {time.time() - start_time:.3f} seconds")
+
+    return totals
+
+
+def main():
+    """Run the outbox send worker"""
+    parser = argparse.ArgumentParser(description='SMS outbox send worker')
+    parser.add_argument('--db', default=DEFAULT_OUTBOX_PATH,
+                        help=f'Outbox database path (default {DEFAULT_OUTBOX_PATH})')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_CLAIM_SIZE,
+                        help=f'Messages claimed per iteration (default {DEFAULT_CLAIM_SIZE})')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help='Seconds to wait when the queue is empty')
+    parser.add_argument('--once', action='store_true',
+                        help='Exit when the queue is empty')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print queue counts and exit')
+    args = parser.parse_args()
+
+    outbox = SMSOutbox(args.db)
+    if args.stats:
+        for status, count in sorted(outbox.stats().items()):
+            print(f"  {status}: {count}")
+        return
+
+    from sms_application import SMSClient, API_KEY, API_BASE_URL, SENDER_ID
+
+    client = SMSClient(API_KEY, API_BASE_URL, SENDER_ID)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+    print(f"🚀 Outbox worker draining {args.db}")
+    try:
+        totals = run_worker(outbox, client, claim_size=args.batch_size,
+                            poll_interval=args.poll_interval, once=args.once,
+                            stop_event=stop_event)
+        print(f"✅ Sent: {totals['sent']}  ❌ Failed: {totals['failed']}  "
+              f"❓ Unknown: {totals['unknown']}")
+    finally:
+        client.close()
+        outbox.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+Delivery report storage and ingestion
+
+Infobip pushes delivery reports to the notifyUrl given at send time. The
+web app acknowledges each callback immediately and hands the reports to a
+ReportIngestor, which writes them to a local SQLite store in batches from
+a background thread.
+
+Infobip also hands out each report only once when polled, so
+sync_reports pages through /sms/1/reports into the same store. Queries
+by bulk ID, recipient, status or time are then answered from its indexes
+without calling Infobip.
+"""
+
+import base64
+import json
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+# Constants
+DEFAULT_REPORTS_PATH = 'reports.db'
+DEFAULT_INGEST_BATCH = 500
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_MAX_PENDING = 100000
+# A batch that fails to write (e.g. the database is locked) is retried
+# this many times, the delay doubling from DEFAULT_WRITE_RETRY_DELAY
+WRITE_ATTEMPTS = 5
+DEFAULT_WRITE_RETRY_DELAY = 0.5
+DEFAULT_SYNC_PAGE = 1000  # Largest page /sms/1/reports returns
+DEFAULT_QUERY_LIMIT = 50
+MAX_QUERY_LIMIT = 1000
+
+STATUS_GROUPS = frozenset({'PENDING', 'UNDELIVERABLE', 'DELIVERED', 'EXPIRED', 'REJECTED'})
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    message_id TEXT PRIMARY KEY,
+    bulk_id TEXT,
+    recipient TEXT,
+    status_group TEXT,
+    status_name TEXT,
+    sent_at TEXT,
+    done_at TEXT,
+    sms_count INTEGER,
+    price REAL,
+    currency TEXT,
+    error_name TEXT,
+    callback_data TEXT,
+    raw TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    sent_ts REAL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Created after migrate() so older databases get sent_ts first
+INDEXES = """
+DROP INDEX IF EXISTS idx_reports_bulk;
+CREATE INDEX IF NOT EXISTS idx_reports_bulk_sent ON reports (bulk_id, sent_ts);
+CREATE INDEX IF NOT EXISTS idx_reports_recipient ON reports (recipient, sent_ts);
+CREATE INDEX IF NOT EXISTS idx_reports_status ON reports (status_group, sent_ts);
+CREATE INDEX IF NOT EXISTS idx_reports_sent ON reports (sent_ts);
+"""
+
+COLUMNS = ('message_id', 'bulk_id', 'recipient', 'status_group', 'status_name',
+           'sent_at', 'done_at', 'sms_count', 'price', 'currency', 'error_name',
+           'callback_data', 'raw', 'received_at', 'sent_ts')
+
+_OFFSET_WITHOUT_COLON = re.compile(r'([+-]\d{2})(\d{2})$')
+
+
+def parse_timestamp(value: Union[str, float, int, None]) -> Optional[float]:
+    """
+    Convert an Infobip or ISO 8601 time to a Unix timestamp
+
+    Accepts '2024-05-01', '2024-05-01T10:00:00', '...Z' and Infobip's
+    '2024-05-01T10:00:00.000+0000'; times without an offset are UTC.
+
+    Raises:
+        ValueError: If the value is not a recognizable time
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = value.strip()
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    text = _OFFSET_WITHOUT_COLON.sub(r'\1:\2', text)
+    # Python 3.8's fromisoformat wants exactly 3 or 6 fractional digits
+    text = re.sub(r'\.(\d+)', lambda m: '.' + (m.group(1) + '000000')[:6], text)
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {value}") from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def encode_cursor(sent_ts: float, rowid: int, ascending: bool = False) -> str:
+    """Opaque pagination cursor for the row after which the next page starts"""
+    raw = json.dumps([sent_ts, rowid, 'asc' if ascending else 'desc'], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, ascending: bool = False) -> Tuple[float, int]:
+    """
+    Unpack a cursor made by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed or was made for the other order
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sent_ts, rowid, order = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        sent_ts, rowid = float(sent_ts), int(rowid)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor}") from None
+    if order != ('asc' if ascending else 'desc'):
+        raise ValueError("Cursor does not match the requested sort order")
+    return sent_ts, rowid
+
+
+def report_problem(report) -> Optional[str]:
+    """
+    Why a delivery report cannot be stored, or None if it can
+
+    A report must be an object with a non-empty string messageId; status,
+    price and error, when present, must be objects.
+    """
+    if not isinstance(report, dict):
+        return "report is not an object"
+    message_id = report.get('messageId')
+    if not isinstance(message_id, str) or not message_id:
+        return "messageId must be a non-empty string"
+    for key in ('status', 'price', 'error'):
+        if report.get(key) is not None and not isinstance(report[key], dict):
+            return f"{key} must be an object"
+    return None
+
+
+def report_row(report: Dict, received_at: float) -> tuple:
+    """Flatten one Infobip delivery report into a store row"""
+    status = report.get('status') or {}
+    price = report.get('price') or {}
+    error = report.get('error') or {}
+    return (
+        report.get('messageId'),
+        report.get('bulkId'),
+        report.get('to'),
+        status.get('groupName'),
+        status.get('name'),
+        report.get('sentAt'),
+        report.get('doneAt'),
+        report.get('smsCount'),
+        price.get('pricePerMessage'),
+        price.get('currency'),
+        error.get('name'),
+        report.get('callbackData'),
+        json.dumps(report, separators=(',', ':')),
+        received_at,
+        _sent_ts(report.get('sentAt'), received_at)
+    )
+
+
+def _sent_ts(sent_at: Optional[str], received_at: float) -> float:
+    """Sort/filter time of a report: when it was sent, else when we got it"""
+    try:
+        return parse_timestamp(sent_at) or received_at
+    except ValueError:
+        return received_at
+
+
+class DeliveryReportStore:
+    """SQLite store of delivery reports keyed by message ID"""
+
+    def __init__(self, path: str = DEFAULT_REPORTS_PATH):
+        """
+        Open (and create if needed) the report database
+
+        Args:
+            path: SQLite database file
+        """
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+            conn.executescript(INDEXES)
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Add sent_ts to databases created before it existed"""
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(reports)")}
+        if 'sent_ts' in columns:
+            return
+        conn.execute("ALTER TABLE reports ADD COLUMN sent_ts REAL")
+        rows = conn.execute("SELECT message_id, sent_at, received_at FROM reports").fetchall()
+        conn.executemany(
+            "UPDATE reports SET sent_ts = ? WHERE message_id = ?",
+            [(_sent_ts(row['sent_at'], row['received_at']), row['message_id']) for row in rows]
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def upsert_many(self, reports: Iterable[Dict]) -> int:
+        """
+        Insert or update reports in one transaction
+
+        Reports that report_problem() objects to are skipped.
+
+        Returns:
+            Number of reports written
+        """
+        now = time.time()
+        rows = [report_row(r, now) for r in reports if report_problem(r) is None]
+        if not rows:
+            return 0
+
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany(
+                f"INSERT INTO reports ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))}) "
+                "ON CONFLICT(message_id) DO UPDATE SET "
+                "bulk_id = excluded.bulk_id, recipient = excluded.recipient, "
+                "status_group = excluded.status_group, status_name = excluded.status_name, "
+                "sent_at = excluded.sent_at, done_at = excluded.done_at, "
+                "sms_count = excluded.sms_count, price = excluded.price, "
+                "currency = excluded.currency, error_name = excluded.error_name, "
+                "callback_data = excluded.callback_data, raw = excluded.raw, "
+                "received_at = excluded.received_at, sent_ts = excluded.sent_ts",
+                rows
+            )
+        return len(rows)
+
+    def get(self, message_id: str) -> Optional[Dict]:
+        """Return the stored report for a message, as sent by Infobip"""
+        row = self._connect().execute(
+            "SELECT raw FROM reports WHERE message_id = ?", (message_id,)
+        ).fetchone()
+        return json.loads(row['raw']) if row else None
+
+    @staticmethod
+    def _filters(bulk_id: Optional[str] = None, message_id: Optional[str] = None,
+                 recipient: Optional[str] = None, status: Optional[str] = None,
+                 since: Optional[float] = None, until: Optional[float] = None) -> Tuple[List, List]:
+        """WHERE clauses and parameters for the query filters"""
+        clauses, params = [], []
+        for column, value in (('bulk_id', bulk_id), ('message_id', message_id),
+                              ('recipient', recipient)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if status:
+            status = status.upper()
+            clauses.append("status_group = ?" if status in STATUS_GROUPS else "status_name = ?")
+            params.append(status)
+        if since is not None:
+            clauses.append("sent_ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("sent_ts < ?")
+            params.append(until)
+        return clauses, params
+
+    def count(self, **filters) -> int:
+        """Number of stored reports, optionally matching query filters"""
+        clauses, params = self._filters(**filters)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM reports" + where, params
+        ).fetchone()[0]
+
+    def page(self, limit: int = DEFAULT_QUERY_LIMIT, cursor: Optional[str] = None,
+             ascending: bool = False, **filters) -> Tuple[List[Dict], Optional[str]]:
+        """
+        One page of stored reports, ordered by send time
+
+        Pages use keyset pagination: the cursor records the (sent_ts, rowid)
+        of the last row returned, so each page is an index range scan that
+        costs the same however deep into the results it is.
+
+        Args:
+            limit: Page size (capped at MAX_QUERY_LIMIT)
+            cursor: next_cursor of the previous page
+            ascending: Oldest first instead of newest first
+            **filters: See query()
+
+        Returns:
+            (reports as sent by Infobip, cursor of the next page or None)
+
+        Raises:
+            ValueError: If the cursor is invalid or was made for the other order
+        """
+        clauses, params = self._filters(**filters)
+        if cursor:
+            sent_ts, rowid = decode_cursor(cursor, ascending)
+            clauses.append("(sent_ts, rowid) > (?, ?)" if ascending else "(sent_ts, rowid) < (?, ?)")
+            params.extend([sent_ts, rowid])
+
+        limit = max(1, min(int(limit), MAX_QUERY_LIMIT))
+        order = "ASC" if ascending else "DESC"
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        rows = self._connect().execute(
+            f"SELECT rowid, sent_ts, raw FROM reports {where}"
+            f"ORDER BY sent_ts {order}, rowid {order} LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['sent_ts'], rows[-1]['rowid'], ascending)
+        return [json.loads(row['raw']) for row in rows], next_cursor
+
+    def query(self, bulk_id: Optional[str] = None, message_id: Optional[str] = None,
+              recipient: Optional[str] = None, status: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              limit: int = DEFAULT_QUERY_LIMIT) -> List[Dict]:
+        """
+        Find stored reports, newest first
+
+        Args:
+            bulk_id: Bulk ID from the send response
+            message_id: Specific message ID
+            recipient: E.164 phone number
+            status: Status group (DELIVERED, PENDING, ...) or status name
+            since: Earliest send time (Unix timestamp, inclusive)
+            until: Latest send time (Unix timestamp, exclusive)
+            limit: Maximum number of reports (capped at MAX_QUERY_LIMIT)
+
+        Returns:
+            Reports as sent by Infobip
+        """
+        return self.page(limit, bulk_id=bulk_id, message_id=message_id, recipient=recipient,
+                         status=status, since=since, until=until)[0]
+
+    def status_counts(self, bulk_id: Optional[str] = None) -> Dict[str, int]:
+        """Number of reports per status group, optionally for one bulk"""
+        sql = "SELECT status_group, COUNT(*) FROM reports"
+        params = ()
+        if bulk_id:
+            sql += " WHERE bulk_id = ?"
+            params = (bulk_id,)
+        rows = self._connect().execute(sql + " GROUP BY status_group", params).fetchall()
+        return {(row[0] or 'UNKNOWN'): row[1] for row in rows}
+
+    def get_state(self, key: str) -> Optional[str]:
+        """Read a sync bookkeeping value"""
+        row = self._connect().execute(
+            "SELECT value FROM sync_state WHERE key = ?", (key,)
+        ).fetchone()
+        return row['value'] if row else None
+
+    def set_state(self, key: str, value: str):
+        """Write a sync bookkeeping value"""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class ReportIngestor:
+    """
+    Background stage that batches delivery reports into the store
+
+    submit() only enqueues, so webhook handlers can acknowledge Infobip
+    straight away; a daemon thread drains the queue and writes batches of
+    up to batch_size reports, or whatever arrived within flush_interval.
+    A batch whose write raises sqlite3.Error is retried with backoff
+    (WRITE_ATTEMPTS in all) before its reports are counted as dropped; any
+    other error drops the batch at once but leaves the thread running.
+    """
+
+    def __init__(self, store: DeliveryReportStore,
+                 batch_size: int = DEFAULT_INGEST_BATCH,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 max_pending: int = DEFAULT_MAX_PENDING,
+                 retry_delay: float = DEFAULT_WRITE_RETRY_DELAY):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'received': 0, 'written': 0, 'rejected': 0, 'batches': 0,
+                      'write_retries': 0, 'dropped': 0}
+
+    def start(self):
+        """Start the writer thread if it is not running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='report-ingestor', daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, reports: List[Dict]) -> bool:
+        """
+        Queue reports for writing
+
+        Returns:
+            False if the queue is full and the reports were not accepted
+        """
+        self.start()
+        try:
+            for report in reports:
+                self._queue.put_nowait(report)
+        except queue.Full:
+            self.stats['rejected'] += 1
+            return False
+        self.stats['received'] += len(reports)
+        return True
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch: List[Dict]):
+        delay = self.retry_delay
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                self.stats['written'] += self.store.upsert_many(batch)
+                self.stats['batches'] += 1
+                return
+            except sqlite3.Error as e:
+                if attempt == WRITE_ATTEMPTS:
+                    self.stats['dropped'] += len(batch)
+                    print(f"Error writing delivery reports, dropped {len(batch)}: {e}")
+                    return
+                self.stats['write_retries'] += 1
+                print(f"Error writing delivery reports, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                # Bad data will not write on a retry either
+                self.stats['dropped'] += len(batch)
+                print(f"Error writing delivery reports, dropped {len(batch)}: {e}")
+                return
+
+    def flush(self):
+        """Block until every submitted report has been written"""
+        self._queue.join()
+
+    def stop(self):
+        """Write what is pending and stop the writer thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def sync_reports(client, store: DeliveryReportStore, page_size: int = DEFAULT_SYNC_PAGE,
+                 max_pages: Optional[int] = None) -> Dict[str, int]:
+    """
+    Pull every report Infobip has waiting into the local store
+
+    Infobip returns each report once, so pages are requested until one
+    comes back short; each page is written before the next is fetched.
+
+    Args:
+        client: SMSClient
+        store: Store to write to
+        page_size: Reports per request (Infobip allows up to 1000)
+        max_pages: Stop after this many pages (default: no limit)
+
+    Returns:
+        Dict with 'pages', 'fetched' and 'written' counts
+    """
+    totals = {'pages': 0, 'fetched': 0, 'written': 0}
+    while max_pages is None or totals['pages'] < max_pages:
+        results = client.get_delivery_reports(limit=page_size).get('results') or []
+        totals['pages'] += 1
+        totals['fetched'] += len(results)
+        totals['written'] += store.upsert_many(results)
+        if len(results) < page_size:
+            break
+
+    store.set_state('last_sync', str(time.time()))
+    return totals
+
+
+class ReportSyncer:
+    """Background thread that runs sync_reports every interval seconds"""
+
+    def __init__(self, client, store: DeliveryReportStore, interval: float,
+                 page_size: int = DEFAULT_SYNC_PAGE):
+        self.client = client
+        self.store = store
+        self.interval = interval
+        self.page_size = page_size
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'syncs': 0, 'fetched': 0, 'errors': 0}
+
+    def start(self):
+        """Start the sync thread if it is not running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='report-syncer', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                totals = sync_reports(self.client, self.store, self.page_size)
+                self.stats['syncs'] += 1
+                self.stats['fetched'] += totals['fetched']
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Error syncing delivery reports: {e}")
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        """Stop the sync thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Retry policy for Infobip API calls
+
+Classifies failures as retryable or fatal, backs off with full jitter,
+honors Retry-After and draws retries from a shared budget so a struggling
+upstream is not hammered by retry storms.
+"""
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+# Constants
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+# Statuses that say the request was not acted on, so even a send may repeat it
+UNPROCESSED_STATUS_CODES = frozenset({429, 503})
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 20.0
+DEFAULT_BUDGET_RATIO = 0.2
+DEFAULT_BUDGET_MAX_TOKENS = 10.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header value
+
+    Args:
+        value: Header value, either delay seconds or an HTTP date
+
+    Returns:
+        Seconds to wait, or None if absent or unparseable
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def nothing_sent(error: requests.RequestException) -> bool:
+    """
+    Whether a failed request never reached the server
+
+    True for connect timeouts (including waiting for a pooled
+    connection) and for errors opening the connection, such as a refused
+    connection or a failed DNS lookup. A connection dropped after the
+    request was written ("Connection aborted") is not: the server may
+    have acted on it.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    reason = error.args[0] if error.args else None
+    # urllib3's MaxRetryError carries the underlying error as .reason
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, NewConnectionError)
+
+
+def not_acted_on(error: requests.RequestException) -> bool:
+    """
+    Whether the upstream cannot have acted on a failed request
+
+    True when nothing was sent (see nothing_sent) or the response was 429
+    or 503, so repeating even a send cannot deliver a message twice.
+    """
+    if isinstance(error, requests.exceptions.HTTPError):
+        response = error.response
+        return response is not None and response.status_code in UNPROCESSED_STATUS_CODES
+    return nothing_sent(error)
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of overall traffic
+
+    Every call deposits `ratio` tokens and every retry withdraws one, so in
+    steady state retries cannot exceed `ratio` times the request rate.
+    The bucket starts full at `max_tokens`, which bounds retry bursts and
+    lets a quiet client still retry occasional failures.
+    """
+
+    def __init__(self, ratio: float = DEFAULT_BUDGET_RATIO,
+                 max_tokens: float = DEFAULT_BUDGET_MAX_TOKENS):
+        self.ratio = ratio
+        self.max_tokens = max(max_tokens, 1.0)
+        self.tokens = self.max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """Credit the budget for one new call"""
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Take one retry from the budget; False if it is exhausted"""
+        with self._lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class RetryPolicy:
+    """Retry engine with error classification, jittered backoff and a budget"""
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY,
+                 budget: Optional[RetryBudget] = None,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Initialize retry policy
+
+        Args:
+            max_attempts: Total attempts per call, including the first
+            base_delay: Backoff for the first retry in seconds
+            max_delay: Cap for a single backoff; a longer Retry-After
+                makes the error fatal instead of blocking the caller
+            budget: Shared retry budget (a fresh one by default)
+            sleep: Sleep function, replaceable in tests
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.stats = {
+            'calls': 0,
+            'retries': 0,
+            'succeeded_after_retry': 0,
+            'fatal_errors': 0,
+            'exhausted': 0,
+            'budget_denied': 0,
+            'backoff_seconds': 0.0
+        }
+
+    def is_retryable(self, error: requests.RequestException,
+                     idempotent: bool = True) -> bool:
+        """
+        Classify an error as retryable or fatal
+
+        For idempotent calls, connection failures, timeouts and
+        408/425/429/5xx responses are retryable. Other calls (sends) are
+        retried only when the upstream cannot have acted on the request
+        (see not_acted_on). A dropped connection, read timeout or other
+        5xx is ambiguous and repeating it could deliver the message twice.
+        """
+        if not idempotent:
+            return not_acted_on(error)
+        if isinstance(error, requests.exceptions.HTTPError):
+            response = error.response
+            return response is not None and response.status_code in RETRYABLE_STATUS_CODES
+        return isinstance(error, (requests.exceptions.ConnectionError,
+                                  requests.exceptions.Timeout))
+
+    def backoff(self, retry: int, retry_after: Optional[float] = None) -> float:
+        """
+        Delay before the given retry (1-based)
+
+        Uses full jitter over an exponential window; a Retry-After value
+        from the server is used as a floor.
+        """
+        window = min(self.max_delay, self.base_delay * (2 ** (retry - 1)))
+        delay = random.uniform(0, window)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, func: Callable[[], Dict], idempotent: bool = True) -> Dict:
+        """
+        Run func, retrying retryable failures
+
+        Args:
+            func: Zero-argument callable performing one attempt
+            idempotent: Whether repeating an ambiguous attempt is safe
+
+        Returns:
+            The result of the first successful attempt
+
+        Raises:
+            requests.RequestException: The last error once retries stop,
+                with an `attempts` attribute recording how many were made
+        """
+        self.budget.deposit()
+        self._record('calls')
+
+        attempt = 1
+        while True:
+            try:
+                result = func()
+                if attempt > 1:
+                    self._record('succeeded_after_retry')
+                return result
+            except requests.RequestException as e:
+                e.attempts = attempt
+                if not self.is_retryable(e, idempotent):
+                    self._record('fatal_errors')
+                    raise
+
+                retry_after = None
+                response = getattr(e, 'response', None)
+                if response is not None:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+
+                if attempt >= self.max_attempts or (
+                        retry_after is not None and retry_after > self.max_delay):
+                    self._record('exhausted')
+                    raise
+                if not self.budget.withdraw():
+                    self._record('budget_denied')
+                    raise
+
+                delay = self.backoff(attempt, retry_after)
+                self._record('retries')
+                self._record('backoff_seconds', delay)
+                self.sleep(delay)
+                attempt += 1
+
+    def _record(self, key: str, amount: float = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def snapshot(self) -> Dict:
+        """Copy of the retry counters and remaining budget"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['backoff_seconds'] = round(stats['backoff_seconds'], 3)
+        stats['budget_tokens'] = round(self.budget.tokens, 2)
+        return stats
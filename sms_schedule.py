@@ -0,0 +1,743 @@
+#!/usr/bin/env python3
+"""
+Scheduled and deferred sends
+
+Messages to send later are written to a SQLite store (WAL mode), one row
+per recipient, by the web app or CLI. A schedule can start at an
+absolute time, hold each recipient's message to a daily window in that
+recipient's time zone (e.g. 09:00-18:00 local), and repeat hourly, daily
+or weekly in local wall-clock time.
+
+A separate scheduler process releases due messages in batches. Rows stay
+on disk; the index on due time acts as the priority queue, so hundreds of
+thousands of pending messages cost the scheduler no memory. Between
+batches it sleeps until the next due time. Producers wake it early
+through a FIFO next to the database when they add an earlier message, so
+it never polls.
+
+Run the scheduler with:
+    python sms_schedule.py --db schedule.db
+"""
+
+import argparse
+import errno
+import os
+import select
+import signal
+import sqlite3
+import stat
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # Python 3.8
+    from backports.zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Constants
+DEFAULT_SCHEDULE_PATH = 'schedule.db'
+DEFAULT_CLAIM_SIZE = 1000
+DEFAULT_STALE_AFTER = 300
+# Longest sleep between checks, a guard against wall-clock changes
+DEFAULT_MAX_SLEEP = 3600
+MAX_SEND_ATTEMPTS = 3
+RETRY_DELAY = 60
+# Longest time between checks for messages left 'sending' by a dead scheduler
+REQUEUE_INTERVAL = 60
+INSERT_BATCH = 5000
+
+RECURRENCES = {
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+}
+
+# Row states
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+# Infobip may have acted on the failed send (5xx, read timeout), so it is
+# not repeated
+UNKNOWN = 'unknown'
+
+# Messages of a cancelled schedule that would become pending again are
+# cancelled instead (sends in flight when cancel() ran, recurring runs)
+_PENDING_UNLESS_CANCELLED = (
+    "CASE WHEN (SELECT cancelled_at FROM schedules s WHERE s.id = schedule_id) IS NULL "
+    "THEN 'pending' ELSE 'cancelled' END"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedules (
+    id TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    sender TEXT,
+    callback_data TEXT,
+    send_at REAL NOT NULL,
+    timezone TEXT NOT NULL,
+    window_start INTEGER,
+    window_end INTEGER,
+    recurrence TEXT,
+    until REAL,
+    created_at REAL NOT NULL,
+    cancelled_at REAL
+);
+CREATE TABLE IF NOT EXISTS scheduled_messages (
+    id INTEGER PRIMARY KEY,
+    schedule_id TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    timezone TEXT,
+    run_at REAL NOT NULL,
+    due_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    runs INTEGER NOT NULL DEFAULT 0,
+    claim_id TEXT,
+    claimed_at REAL,
+    message_id TEXT,
+    bulk_id TEXT,
+    error TEXT,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_scheduled_due ON scheduled_messages (status, due_at);
+CREATE INDEX IF NOT EXISTS idx_scheduled_schedule ON scheduled_messages (schedule_id, status);
+CREATE INDEX IF NOT EXISTS idx_scheduled_claim ON scheduled_messages (claim_id);
+"""
+
+
+def get_zone(name: str) -> ZoneInfo:
+    """
+    Look up an IANA time zone such as 'Africa/Nairobi'
+
+    Raises:
+        ValueError: If the zone is unknown
+    """
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone: {name}") from None
+
+
+def parse_window(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Parse a daily 'HH:MM-HH:MM' window into minutes after midnight
+
+    A window whose end is before its start spans midnight.
+
+    Raises:
+        ValueError: If the window is malformed or empty
+    """
+    if not value:
+        return None
+    try:
+        start, end = (part.strip() for part in value.split('-'))
+        minutes = []
+        for part in (start, end):
+            hours, mins = part.split(':')
+            if not (0 <= int(hours) <= 24 and 0 <= int(mins) < 60):
+                raise ValueError
+            minutes.append(min(int(hours) * 60 + int(mins), 24 * 60))
+    except ValueError:
+        raise ValueError(f"Invalid send window: {value} (expected HH:MM-HH:MM)") from None
+    if minutes[0] == minutes[1]:
+        raise ValueError(f"Empty send window: {value}")
+    return minutes[0], minutes[1]
+
+
+def parse_send_time(value: Union[str, float, int], zone: str = 'UTC') -> float:
+    """
+    Convert a send time to a Unix timestamp
+
+    Accepts Unix seconds or ISO 8601; ISO times without an offset are
+    read in zone.
+
+    Raises:
+        ValueError: If the value is not a recognizable time
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = value.strip()
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            raise ValueError(f"Invalid send time: {value}") from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=get_zone(zone))
+    return parsed.timestamp()
+
+
+def _in_window(minute: int, window: Tuple[int, int]) -> bool:
+    start, end = window
+    if start < end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+
+def align_to_window(ts: float, zone: ZoneInfo, window: Optional[Tuple[int, int]]) -> float:
+    """The first time at or after ts that falls inside the local daily window"""
+    if window is None:
+        return ts
+    local = datetime.fromtimestamp(ts, zone)
+    if _in_window(local.hour * 60 + local.minute, window):
+        return ts
+    start = window[0] % (24 * 60)
+    candidate = local.replace(hour=start // 60, minute=start % 60, second=0, microsecond=0)
+    if candidate <= local:
+        candidate += timedelta(days=1)
+    return candidate.timestamp()
+
+
+def next_occurrence(run_at: float, zone: ZoneInfo, recurrence: str,
+                    window: Optional[Tuple[int, int]] = None,
+                    now: Optional[float] = None) -> Tuple[float, float]:
+    """
+    The next run of a recurring message after the run scheduled for run_at
+
+    Daily and weekly steps are taken in local wall-clock time, so a daily
+    09:00 message stays at 09:00 across DST changes. Runs missed while the
+    scheduler was down are skipped rather than sent in a burst.
+
+    Returns:
+        (scheduled time of the run, time it is due once held to window)
+    """
+    step = RECURRENCES[recurrence]
+    now = time.time() if now is None else now
+    local = datetime.fromtimestamp(run_at, zone).replace(tzinfo=None)
+    scheduled = run_at
+    while True:
+        if step < timedelta(days=1):
+            scheduled += step.total_seconds()
+        else:
+            local += step
+            scheduled = local.replace(tzinfo=zone).timestamp()
+        due = align_to_window(scheduled, zone, window)
+        if due > now:
+            return scheduled, due
+
+
+class WakeChannel:
+    """
+    FIFO through which producers wake a sleeping scheduler
+
+    Where named pipes are unavailable, wait() simply sleeps.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    def listen(self):
+        """Create the FIFO (if needed) and open it for reading"""
+        if not hasattr(os, 'mkfifo'):
+            return
+        try:
+            os.mkfifo(self.path)
+        except FileExistsError:
+            if not stat.S_ISFIFO(os.stat(self.path).st_mode):
+                raise ValueError(f"{self.path} exists and is not a FIFO") from None
+        # Opened read-write so the pipe never reports end-of-file between writers
+        self._fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Block until poked or timeout seconds pass
+
+        Returns:
+            True if woken by a poke
+        """
+        if self._fd is None:
+            time.sleep(max(0.0, timeout))
+            return False
+        readable, _, _ = select.select([self._fd], [], [], max(0.0, timeout))
+        if not readable:
+            return False
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def poke(self):
+        """Wake the scheduler if one is listening; never blocks"""
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            # No FIFO or no scheduler listening
+            return
+        try:
+            os.write(fd, b'\0')
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+        finally:
+            os.close(fd)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class ScheduleStore:
+    """SQLite store of scheduled messages shared by producers and the scheduler"""
+
+    def __init__(self, path: str = DEFAULT_SCHEDULE_PATH):
+        """
+        Open (and create if needed) the schedule database
+
+        Args:
+            path: SQLite database file; the scheduler's wake-up FIFO is
+                created next to it as <path>.wake
+        """
+        self.path = path
+        self.wake = WakeChannel(path + '.wake')
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def add(self, recipients: Iterable[Union[str, Tuple[str, Optional[str]]]], text: str,
+            send_at: float, sender: Optional[str] = None, callback_data: Optional[str] = None,
+            zone: str = 'UTC', window: Optional[str] = None, recurrence: Optional[str] = None,
+            until: Optional[float] = None) -> Dict:
+        """
+        Schedule text for recipients
+
+        Args:
+            recipients: E.164 numbers, or (number, time zone) pairs for
+                recipients in a zone other than the schedule's
+            text: SMS message content
+            send_at: Unix time of the (first) send
+            sender: Sender ID (optional)
+            callback_data: Custom data returned in delivery reports
+            zone: IANA time zone for the window and recurrence
+            window: Daily 'HH:MM-HH:MM' local window messages are held to
+            recurrence: 'hourly', 'daily' or 'weekly' to repeat
+            until: Unix time after which a recurring schedule stops
+
+        Returns:
+            Dict with 'schedule_id', 'count' and 'next_due' (Unix time)
+
+        Raises:
+            ValueError: If the text is empty, a time zone, the window or
+                the recurrence is invalid, or there are no recipients
+        """
+        if not text or not text.strip():
+            raise ValueError("SMS text cannot be empty")
+        if recurrence is not None and recurrence not in RECURRENCES:
+            raise ValueError(f"Unknown recurrence: {recurrence} "
+                             f"(expected {', '.join(RECURRENCES)})")
+        default_zone = get_zone(zone)
+        parsed_window = parse_window(window)
+
+        # Recipients in one zone share a due time, so it is worked out once per zone
+        due_by_zone = {}
+
+        def rows(schedule_id: str) -> Iterator[Tuple]:
+            for item in recipients:
+                number, zone_name = (item, None) if isinstance(item, str) else item
+                if zone_name not in due_by_zone:
+                    due_by_zone[zone_name] = align_to_window(
+                        send_at, get_zone(zone_name) if zone_name else default_zone,
+                        parsed_window)
+                yield schedule_id, number, zone_name, send_at, due_by_zone[zone_name]
+
+        schedule_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        count = 0
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                "INSERT INTO schedules (id, text, sender, callback_data, send_at, timezone, "
+                "window_start, window_end, recurrence, until, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (schedule_id, text.strip(), sender, callback_data, send_at, zone,
+                 parsed_window[0] if parsed_window else None,
+                 parsed_window[1] if parsed_window else None, recurrence, until, now)
+            )
+            pending = rows(schedule_id)
+            while True:
+                batch = list(islice(pending, INSERT_BATCH))
+                if not batch:
+                    break
+                conn.executemany(
+                    "INSERT INTO scheduled_messages "
+                    "(schedule_id, recipient, timezone, run_at, due_at) VALUES (?, ?, ?, ?, ?)",
+                    batch)
+                count += len(batch)
+            if not count:
+                raise ValueError("No phone numbers provided")
+
+        self.wake.poke()
+        return {'schedule_id': schedule_id, 'count': count,
+                'next_due': min(due_by_zone.values())}
+
+    def next_due(self) -> Optional[float]:
+        """Due time of the earliest pending message, or None"""
+        row = self._connect().execute(
+            "SELECT MIN(due_at) FROM scheduled_messages WHERE status = ?", (PENDING,)).fetchone()
+        return row[0]
+
+    def claim_due(self, limit: int = DEFAULT_CLAIM_SIZE,
+                  now: Optional[float] = None) -> List[sqlite3.Row]:
+        """
+        Atomically mark up to limit due messages as sending
+
+        Returns:
+            The claimed rows joined with their schedule, earliest first
+        """
+        now = time.time() if now is None else now
+        claim_id = uuid.uuid4().hex
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                "UPDATE scheduled_messages SET status = ?, claim_id = ?, claimed_at = ? "
+                "WHERE id IN (SELECT m.id FROM scheduled_messages m "
+                "JOIN schedules s ON s.id = m.schedule_id "
+                "WHERE m.status = ? AND m.due_at <= ? AND s.cancelled_at IS NULL "
+                "ORDER BY m.due_at LIMIT ?)",
+                (SENDING, claim_id, now, PENDING, now, limit)
+            )
+            return conn.execute(
+                "SELECT m.*, s.text, s.sender, s.callback_data, "
+                "s.timezone AS schedule_timezone, s.window_start, s.window_end, "
+                "s.recurrence, s.until FROM scheduled_messages m "
+                "JOIN schedules s ON s.id = m.schedule_id "
+                "WHERE m.claim_id = ? ORDER BY m.due_at", (claim_id,)
+            ).fetchall()
+
+    def record(self, updates: Iterable[Dict]):
+        """
+        Write back the outcome of claimed messages
+
+        Each update has the row 'id' and the columns to set: 'status',
+        'due_at', and optionally 'run_at', 'attempts', 'runs',
+        'message_id', 'bulk_id', 'error' and 'sent_at'. A message set
+        back to pending whose schedule was cancelled meanwhile is cancelled.
+        """
+        columns = ('status', 'due_at', 'run_at', 'attempts', 'runs', 'message_id', 'bulk_id',
+                   'error', 'sent_at')
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for update in updates:
+                assignments, values = [], []
+                for column in columns:
+                    if column not in update:
+                        continue
+                    if column == 'status' and update[column] == PENDING:
+                        assignments.append(f"status = {_PENDING_UNLESS_CANCELLED}")
+                        continue
+                    assignments.append(f"{column} = ?")
+                    values.append(update[column])
+                conn.execute(
+                    f"UPDATE scheduled_messages SET {', '.join(assignments)}, claim_id = NULL "
+                    f"WHERE id = ?",
+                    values + [update['id']]
+                )
+
+    def requeue_stale(self, older_than: float = DEFAULT_STALE_AFTER) -> int:
+        """Return messages left 'sending' by a crashed scheduler to pending"""
+        conn = self._connect()
+        with conn:
+            return conn.execute(
+                f"UPDATE scheduled_messages SET status = {_PENDING_UNLESS_CANCELLED}, "
+                f"claim_id = NULL WHERE status = ? AND claimed_at < ?",
+                (SENDING, time.time() - older_than)
+            ).rowcount
+
+    def cancel(self, schedule_id: str) -> Optional[int]:
+        """
+        Cancel a schedule's pending messages
+
+        Messages being sent at the time finish, but are not rescheduled.
+
+        Returns:
+            Number of messages cancelled, or None if the schedule is unknown
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            found = conn.execute("UPDATE schedules SET cancelled_at = ? WHERE id = ?",
+                                 (time.time(), schedule_id)).rowcount
+            if not found:
+                return None
+            return conn.execute(
+                "UPDATE scheduled_messages SET status = ? WHERE schedule_id = ? AND status = ?",
+                (CANCELLED, schedule_id, PENDING)
+            ).rowcount
+
+    def get(self, schedule_id: str) -> Optional[Dict]:
+        """
+        A schedule with its message counts
+
+        Returns:
+            Dict with the schedule's settings, per-status 'counts',
+            'next_due' and 'runs' (sends made, recurring runs included),
+            or None if unknown
+        """
+        conn = self._connect()
+        schedule = conn.execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,)).fetchone()
+        if schedule is None:
+            return None
+        counts = {row['status']: row['n'] for row in conn.execute(
+            "SELECT status, COUNT(*) AS n FROM scheduled_messages WHERE schedule_id = ? "
+            "GROUP BY status", (schedule_id,))}
+        totals = conn.execute(
+            "SELECT MIN(CASE WHEN status = ? THEN due_at END), SUM(runs) "
+            "FROM scheduled_messages WHERE schedule_id = ?", (PENDING, schedule_id)).fetchone()
+        window = None
+        if schedule['window_start'] is not None:
+            window = '%02d:%02d-%02d:%02d' % (divmod(schedule['window_start'], 60)
+                                              + divmod(schedule['window_end'], 60))
+        return {
+            'schedule_id': schedule['id'],
+            'text': schedule['text'],
+            'sender': schedule['sender'],
+            'send_at': schedule['send_at'],
+            'timezone': schedule['timezone'],
+            'window': window,
+            'recurrence': schedule['recurrence'],
+            'until': schedule['until'],
+            'created_at': schedule['created_at'],
+            'cancelled_at': schedule['cancelled_at'],
+            'counts': counts,
+            'next_due': totals[0],
+            'runs': totals[1] or 0
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """Message counts by status"""
+        return {row['status']: row['n'] for row in self._connect().execute(
+            "SELECT status, COUNT(*) AS n FROM scheduled_messages GROUP BY status")}
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def process_due(store: ScheduleStore, client, rows: List[sqlite3.Row],
+                now: Optional[float] = None) -> Dict[str, int]:
+    """
+    Send claimed messages and record each outcome
+
+    Messages whose send window has already closed (the scheduler was down
+    or busy) are moved to the next window instead of being sent late.
+    Identical texts share message objects, as with SMSClient.send_personalized.
+    A message Infobip does not accept (status group other than PENDING,
+    such as REJECTED) fails without a retry. A failed send is only retried
+    when Infobip cannot have acted on it (see SMSClient.send_personalized);
+    an ambiguous failure marks the message unknown instead.
+
+    Returns:
+        Dict with 'sent', 'failed', 'unknown', 'retried' and 'deferred' counts
+    """
+    now = time.time() if now is None else now
+    counts = {'sent': 0, 'failed': 0, 'unknown': 0, 'retried': 0, 'deferred': 0}
+    updates, to_send, zones = [], [], {}
+
+    def zone_of(row) -> ZoneInfo:
+        name = row['timezone'] or row['schedule_timezone']
+        if name not in zones:
+            zones[name] = get_zone(name)
+        return zones[name]
+
+    def window_of(row) -> Optional[Tuple[int, int]]:
+        return None if row['window_start'] is None else (row['window_start'], row['window_end'])
+
+    for row in rows:
+        aligned = align_to_window(now, zone_of(row), window_of(row))
+        if aligned > now:
+            updates.append({'id': row['id'], 'status': PENDING, 'due_at': aligned})
+            counts['deferred'] += 1
+        else:
+            to_send.append(row)
+
+    response = client.send_personalized(
+        (row['recipient'], row['text'], row['sender'], row['callback_data']) for row in to_send
+    ) if to_send else {'results': []}
+
+    for row, result in zip(to_send, response['results']):
+        status = result['status'] or {}
+        refused = not result['error'] and status.get('groupName') != 'PENDING'
+        if refused:
+            result = dict(result, error=(
+                f"{status.get('groupName') or 'UNKNOWN'}: "
+                f"{status.get('description') or status.get('name') or 'not accepted'}"))
+        update = {'id': row['id'], 'error': result['error']}
+        if result['error']:
+            attempts = row['attempts'] + 1
+            if attempts < MAX_SEND_ATTEMPTS and not refused and result.get('retryable'):
+                update.update(status=PENDING, attempts=attempts,
+                              due_at=now + RETRY_DELAY * attempts)
+                counts['retried'] += 1
+                updates.append(update)
+                continue
+            outcome = UNKNOWN if not refused and result.get('ambiguous') else FAILED
+            counts[outcome] += 1
+            update.update(status=outcome, attempts=attempts, due_at=row['due_at'],
+                          message_id=result['messageId'], bulk_id=result['bulkId'])
+        else:
+            counts['sent'] += 1
+            update.update(status=SENT, attempts=0, runs=row['runs'] + 1, sent_at=now,
+                          due_at=row['due_at'], message_id=result['messageId'],
+                          bulk_id=result['bulkId'])
+
+        if row['recurrence']:
+            run_at, due_at = next_occurrence(row['run_at'], zone_of(row), row['recurrence'],
+                                             window_of(row), now)
+            if row['until'] is None or run_at <= row['until']:
+                update.update(status=PENDING, run_at=run_at, due_at=due_at, attempts=0)
+        updates.append(update)
+
+    store.record(updates)
+    return counts
+
+
+def run_scheduler(store: ScheduleStore, client, claim_size: int = DEFAULT_CLAIM_SIZE,
+                  max_sleep: float = DEFAULT_MAX_SLEEP, stale_after: float = DEFAULT_STALE_AFTER,
+                  once: bool = False,
+                  stop_event: Optional[threading.Event] = None) -> Dict[str, int]:
+    """
+    Release due messages until stopped
+
+    Sleeps until the next message is due; ScheduleStore.add() wakes it
+    early through the store's FIFO.
+
+    Args:
+        store: Schedule store to release messages from
+        client: SMSClient used to send
+        claim_size: Messages released per batch
+        max_sleep: Longest sleep between checks
+        stale_after: Seconds after which 'sending' messages are requeued;
+            checked at start and every REQUEUE_INTERVAL seconds after
+        once: Stop when no message is due
+        stop_event: Event that ends the loop when set (call
+            store.wake.poke() after setting it to interrupt a sleep)
+
+    Returns:
+        Totals of sent, failed, unknown, retried and deferred messages
+    """
+    stop_event = stop_event or threading.Event()
+    totals = {'sent': 0, 'failed': 0, 'unknown': 0, 'retried': 0, 'deferred': 0}
+
+    next_requeue = 0.0
+
+    if not once:
+        store.wake.listen()
+    try:
+        while not stop_event.is_set():
+            # Claims younger than stale_after when a restarted scheduler
+            # starts only become stale later, so the check is repeated
+            if time.monotonic() >= next_requeue:
+                requeued = store.requeue_stale(stale_after)
+                if requeued:
+                    print(f"♻️ Requeued {requeued} messages left in 'sending' by a previous run")
+                next_requeue = time.monotonic() + min(stale_after, REQUEUE_INTERVAL)
+
+            rows = store.claim_due(claim_size)
+            if rows:
+                start_time = time.time()
+                counts = process_due(store, client, rows)
+                for key, value in counts.items():
+                    totals[key] += value
+                print(f"📤 Sent {counts['sent']}/{len(rows)} scheduled messages "
+                      f"in {time.time() - start_time:.3f} seconds")
+                continue
+            if once:
+                break
+
+            next_due = store.next_due()
+            timeout = max_sleep if next_due is None else min(max_sleep, next_due - time.time())
+            store.wake.wait(min(timeout, next_requeue - time.monotonic()))
+    finally:
+        store.wake.close()
+
+    return totals
+
+
+def main():
+    """Run the scheduler"""
+    parser = argparse.ArgumentParser(description='Scheduled SMS sender')
+    parser.add_argument('--db', default=DEFAULT_SCHEDULE_PATH,
+                        help=f'Schedule database path (default {DEFAULT_SCHEDULE_PATH})')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_CLAIM_SIZE,
+                        help=f'Messages released per batch (default {DEFAULT_CLAIM_SIZE})')
+    parser.add_argument('--max-sleep', type=float, default=DEFAULT_MAX_SLEEP,
+                        help=f'Longest sleep between checks in seconds (default {DEFAULT_MAX_SLEEP})')
+    parser.add_argument('--once', action='store_true',
+                        help='Send what is due now and exit')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print message counts and exit')
+    parser.add_argument('--cancel', metavar='SCHEDULE_ID',
+                        help='Cancel the pending messages of a schedule and exit')
+    args = parser.parse_args()
+
+    store = ScheduleStore(args.db)
+    if args.stats:
+        for status, count in sorted(store.stats().items()):
+            print(f"  {status}: {count}")
+        next_due = store.next_due()
+        if next_due is not None:
+            print(f"  next due: {datetime.fromtimestamp(next_due, timezone.utc).isoformat()}")
+        return
+    if args.cancel:
+        cancelled = store.cancel(args.cancel)
+        if cancelled is None:
+            print(f"❌ Error: Unknown schedule {args.cancel}")
+            raise SystemExit(1)
+        print(f"🗑️ Cancelled {cancelled} pending messages")
+        return
+
+    from sms_application import SMSClient, API_KEY, API_BASE_URL, SENDER_ID
+
+    client = SMSClient(API_KEY, API_BASE_URL, SENDER_ID)
+    stop_event = threading.Event()
+
+    def stop(*_):
+        stop_event.set()
+        store.wake.poke()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"⏰ Scheduler releasing messages from {args.db}")
+    try:
+        totals = run_scheduler(store, client, claim_size=args.batch_size,
+                               max_sleep=args.max_sleep, once=args.once, stop_event=stop_event)
+        print(f"✅ Sent: {totals['sent']}  ❌ Failed: {totals['failed']}  "
+              f"❓ Unknown: {totals['unknown']}")
+    finally:
+        client.close()
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
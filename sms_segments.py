@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+SMS segment calculator
+
+Works out how a text will be encoded (GSM-7 or UCS-2) and how many
+segments it is billed as, following GSM 03.38 and the concatenation
+header rules. Results are cached, so repeated templates cost one lookup;
+per-recipient texts, which rarely repeat, are counted by count_segments()
+instead.
+"""
+
+import re
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+# GSM 03.38 default alphabet (the escape character itself is excluded)
+GSM7_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Extension table characters cost two septets (escape + character)
+GSM7_EXTENDED = frozenset("\f^{}\\[~]|€")
+GSM7_CHARS = GSM7_BASIC | GSM7_EXTENDED
+# Regex scans beat set operations on the per-recipient counting path
+NON_GSM7_PATTERN = re.compile('[^%s]' % re.escape(''.join(sorted(GSM7_CHARS))))
+GSM7_EXTENDED_PATTERN = re.compile('[%s]' % re.escape(''.join(sorted(GSM7_EXTENDED))))
+
+GSM7 = 'GSM-7'
+UCS2 = 'UCS-2'
+
+# Units per segment: (single message, each part of a concatenated message)
+SEGMENT_LIMITS = {
+    GSM7: (160, 153),
+    UCS2: (70, 67),
+}
+
+SEGMENT_CACHE_SIZE = 4096
+DEFAULT_PREVIEW_ROWS = 5
+
+
+def _unit_cost(char: str, encoding: str) -> int:
+    """Septets (GSM-7) or UTF-16 code units (UCS-2) used by one character"""
+    if encoding == GSM7:
+        return 2 if char in GSM7_EXTENDED else 1
+    return 2 if ord(char) > 0xFFFF else 1
+
+
+@lru_cache(maxsize=SEGMENT_CACHE_SIZE)
+def _segment(text: str) -> Tuple[str, int, Tuple[str, ...]]:
+    encoding = GSM7 if GSM7_CHARS.issuperset(text) else UCS2
+
+    if encoding == GSM7:
+        units = len(text) + sum(1 for char in text if char in GSM7_EXTENDED)
+    else:
+        units = len(text.encode('utf-16-le')) // 2
+
+    single, multi = SEGMENT_LIMITS[encoding]
+    if units <= single:
+        return encoding, units, (text,) if text else ()
+
+    # Split without breaking escape sequences or surrogate pairs
+    parts = []
+    start = used = 0
+    for i, char in enumerate(text):
+        cost = _unit_cost(char, encoding)
+        if used + cost > multi:
+            parts.append(text[start:i])
+            start, used = i, 0
+        used += cost
+    parts.append(text[start:])
+    return encoding, units, tuple(parts)
+
+
+def segment_text(text: str) -> Dict:
+    """
+    Calculate encoding and segments for an SMS text
+
+    Args:
+        text: SMS message text
+
+    Returns:
+        Dict with 'encoding' (GSM-7 or UCS-2), 'characters', 'units'
+        (septets or UTF-16 code units), 'segments', 'per_segment' (units
+        available in each segment) and 'parts' (the text of each segment)
+    """
+    encoding, units, parts = _segment(text)
+    single, multi = SEGMENT_LIMITS[encoding]
+    return {
+        'encoding': encoding,
+        'characters': len(text),
+        'units': units,
+        'segments': len(parts),
+        'per_segment': single if len(parts) <= 1 else multi,
+        'parts': list(parts)
+    }
+
+
+def estimate_campaign(text: str, recipients: int,
+                      price_per_segment: Optional[float] = None) -> Dict:
+    """
+    Estimate the billed segments (and optionally cost) of a send
+
+    Args:
+        text: SMS message text
+        recipients: Number of recipients
+        price_per_segment: Price of one segment (optional)
+
+    Returns:
+        Dict with the text's encoding and segment count, 'recipients',
+        'total_segments' and, if a price is given, 'estimated_cost'
+    """
+    info = segment_text(text)
+    estimate = {
+        'encoding': info['encoding'],
+        'characters': info['characters'],
+        'segments_per_message': info['segments'],
+        'recipients': recipients,
+        'total_segments': info['segments'] * recipients
+    }
+    if price_per_segment is not None:
+        estimate['price_per_segment'] = price_per_segment
+        estimate['estimated_cost'] = round(estimate['total_segments'] * price_per_segment, 4)
+    return estimate
+
+
+def count_segments(text: str) -> Tuple[str, int]:
+    """
+    Encoding and segment count of a text, without the cache
+
+    When every character costs one unit (no GSM-7 extension characters,
+    no characters outside the Basic Multilingual Plane) the count is
+    plain arithmetic; other texts are split like segment_text() does.
+
+    Returns:
+        (encoding, segments)
+    """
+    if not text:
+        return GSM7, 0
+    if NON_GSM7_PATTERN.search(text) is None:
+        encoding = GSM7
+        uniform = GSM7_EXTENDED_PATTERN.search(text) is None
+    else:
+        encoding = UCS2
+        uniform = max(text) <= '\uffff'
+    if not uniform:
+        return encoding, len(_segment(text)[2])
+
+    single, multi = SEGMENT_LIMITS[encoding]
+    units = len(text)
+    return encoding, 1 if units <= single else -(-units // multi)
+
+
+def estimate_personalized(rows: Iterable[Sequence[str]],
+                          price_per_segment: Optional[float] = None,
+                          preview: int = DEFAULT_PREVIEW_ROWS,
+                          on_row: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """
+    Estimate the billed segments of a send with one text per recipient
+
+    Rows are consumed one at a time, so a generator of rendered texts is
+    never held in memory.
+
+    Args:
+        rows: (recipient, text) pairs
+        price_per_segment: Price of one segment (optional)
+        preview: Leading rows returned with their segment counts
+        on_row: Called with every row's 'to', 'text', 'encoding' and
+            'segments', e.g. to write a per-row report
+
+    Returns:
+        Dict with 'recipients', 'total_segments', 'max_segments', the
+        number of recipients per segment count ('segments') and per
+        'encodings', 'preview' rows ('to', 'text', 'encoding',
+        'segments') and, if a price is given, 'estimated_cost'
+    """
+    histogram = {}
+    encodings = {GSM7: 0, UCS2: 0}
+    samples = []
+    recipients = total = 0
+    for row in rows:
+        encoding, segments = count_segments(row[1])
+        recipients += 1
+        total += segments
+        histogram[segments] = histogram.get(segments, 0) + 1
+        encodings[encoding] += 1
+        if on_row is not None or len(samples) < preview:
+            info = {'to': row[0], 'text': row[1], 'encoding': encoding, 'segments': segments}
+            if len(samples) < preview:
+                samples.append(info)
+            if on_row is not None:
+                on_row(info)
+
+    estimate = {
+        'recipients': recipients,
+        'total_segments': total,
+        'max_segments': max(histogram, default=0),
+        'segments': {str(n): histogram[n] for n in sorted(histogram)},
+        'encodings': encodings,
+        'preview': samples
+    }
+    if price_per_segment is not None:
+        estimate['price_per_segment'] = price_per_segment
+        estimate['estimated_cost'] = round(total * price_per_segment, 4)
+    return estimate
+
+
+def segment_cache_info():
+    """Hit/miss statistics of the segment cache"""
+    return _segment.cache_info()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Message templates
+
+A message with {column} placeholders is compiled once: the placeholders
+are resolved to CSV column positions and the text becomes a single
+%-format string, so rendering a row is one item lookup and one string
+formatting operation. Placeholders name a header column
+(case-insensitive) or give a zero-based column index ({1}); '{{' and
+'}}' stand for literal braces.
+
+Rows are rendered as they are read, so a contact file of a million rows
+never exists as a list of texts.
+"""
+
+import string
+from operator import itemgetter
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from sms_contacts import (column_index, is_column_name, iter_decompressed, iter_file_chunks,
+                          iter_lines, iter_rows)
+
+
+class TemplateError(ValueError):
+    """Raised for a malformed template or a placeholder with no matching column"""
+
+
+class MessageTemplate:
+    """A message text with {column} placeholders, compiled for fast rendering"""
+
+    def __init__(self, text: str):
+        """
+        Parse a template
+
+        Args:
+            text: Message text with {column} placeholders
+
+        Raises:
+            TemplateError: If the braces are unbalanced or a placeholder
+                uses a format spec or conversion
+        """
+        self.text = text
+        self.placeholders: List[str] = []
+        format_parts = []
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError as e:
+            raise TemplateError(f"Invalid template: {e}") from None
+
+        for literal, field, spec, conversion in parsed:
+            format_parts.append(literal.replace('%', '%%'))
+            if field is None:
+                continue
+            if not field.strip():
+                raise TemplateError("Empty placeholder {} in template; name a column")
+            if spec or conversion:
+                placeholder = (field + (f'!{conversion}' if conversion else '')
+                               + (f':{spec}' if spec else ''))
+                raise TemplateError(
+                    f"Formatting is not supported in placeholders: {{{placeholder}}}")
+            self.placeholders.append(field.strip())
+            format_parts.append('%s')
+        self._format = ''.join(format_parts)
+
+    @property
+    def fields(self) -> List[str]:
+        """Distinct placeholder names, in order of first use"""
+        return list(dict.fromkeys(self.placeholders))
+
+    @property
+    def needs_header(self) -> bool:
+        """Whether any placeholder names a column rather than indexing it"""
+        return any(is_column_name(field) for field in self.placeholders)
+
+    def compile(self, header: Optional[List[str]] = None) -> Callable[[Sequence[str]], str]:
+        """
+        Bind the placeholders to columns
+
+        Args:
+            header: The CSV header row; needed if placeholders name columns
+
+        Returns:
+            A function rendering one CSV row. Values are stripped of
+            surrounding whitespace; columns missing from a short row
+            render as empty strings.
+
+        Raises:
+            TemplateError: If a placeholder names a column not in header
+        """
+        fmt = self._format
+        if not self.placeholders:
+            text = fmt % ()
+            return lambda row: text
+
+        names = [name.strip().lower() for name in header or []]
+        missing = [field for field in self.fields
+                   if is_column_name(field) and field.lower() not in names]
+        if missing:
+            raise TemplateError(f"Template columns not found in header: {', '.join(missing)}")
+        indexes = [column_index(field, header) for field in self.placeholders]
+        width = max(indexes) + 1
+        getter = itemgetter(*indexes)
+        strip = str.strip
+
+        if len(indexes) == 1:
+            index = indexes[0]
+
+            def render(row: Sequence[str]) -> str:
+                return fmt % strip(row[index]) if len(row) > index else fmt % ''
+            return render
+
+        def render(row: Sequence[str]) -> str:
+            if len(row) < width:
+                row = list(row) + [''] * (width - len(row))
+            return fmt % tuple(map(strip, getter(row)))
+        return render
+
+
+def iter_rendered(rows: Iterable[List[str]], template: MessageTemplate,
+                  column: Union[int, str] = 0) -> Iterator[Tuple[str, str]]:
+    """
+    Render a template for each CSV row
+
+    Args:
+        rows: CSV rows; the first is the header if the template or
+            column refers to columns by name
+        template: Template filled from each row's columns
+        column: Phone column index or header name
+
+    Returns:
+        Generator of (phone, text) pairs, skipping rows without a phone
+
+    Raises:
+        ValueError: If the phone column or a template column is not in the
+            header (TemplateError for template columns)
+    """
+    rows = iter(rows)
+    header = None
+    if template.needs_header or is_column_name(column):
+        header = next(rows, None) or []
+    phone_index = column_index(column, header)
+    render = template.compile(header)
+
+    for row in rows:
+        if len(row) > phone_index:
+            phone = row[phone_index].strip()
+            if phone:
+                yield phone, render(row)
+
+
+def read_rendered(fileobj: BinaryIO, template: MessageTemplate, column: Union[int, str] = 0,
+                  max_bytes: Optional[int] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Stream (phone, text) pairs from a CSV or gzipped CSV file
+
+    Args:
+        fileobj: File opened in binary mode
+        template: Template filled from each row's columns
+        column: Phone column index or header name
+        max_bytes: Limit on the (decompressed) size read
+    """
+    chunks = iter_decompressed(iter_file_chunks(fileobj), max_bytes)
+    return iter_rendered(iter_rows(iter_lines(chunks)), template, column)
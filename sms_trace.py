@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Request lifecycle tracing
+
+Breaks each upstream request into timed spans: payload build, request
+preparation, connection acquisition (new or reused), TCP connect, TLS
+handshake, time to first byte, body read and JSON parse. Spans are plain
+dicts handed to hooks registered on a Tracer (SMSClient.add_hook);
+FileSpanExporter writes them as JSON lines and PhaseBreakdown sums them
+per phase for the CLI's --trace flag.
+
+Connection phases are observed through TracingAdapter, a requests
+HTTPAdapter whose urllib3 pools and connections time themselves. With no
+hooks registered nothing is recorded and the adapter adds one
+thread-local lookup per request.
+"""
+
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Phases in the order they happen, as reported by PhaseBreakdown
+PHASES = ('build', 'prepare', 'acquire', 'connect', 'tls', 'ttfb', 'read', 'parse')
+
+Hook = Callable[[Dict], None]
+
+# Trace of the request running on this thread, if it is being traced
+_local = threading.local()
+
+
+class _TraceContext:
+    """Spans open on one thread for one tracer"""
+
+    def __init__(self, tracer: 'Tracer'):
+        self.tracer = tracer
+        self.trace_id = uuid.uuid4().hex[:16]
+        # Converts perf_counter readings to wall-clock start times
+        self.offset = time.time() - time.perf_counter()
+        self.stack = []
+        self.next_id = 1
+        # Seconds spent acquiring and setting up connections so far
+        self.connection_time = 0.0
+
+    def new_id(self) -> int:
+        span_id = self.next_id
+        self.next_id += 1
+        return span_id
+
+    def record(self, name: str, start: float, duration: float,
+               span_id: Optional[int] = None, parent_id: Optional[int] = None, **attributes):
+        """Emit a finished span (start is a perf_counter reading)"""
+        if parent_id is None and self.stack:
+            parent_id = self.stack[-1][0]
+        self.tracer.emit({
+            'trace_id': self.trace_id,
+            'span_id': span_id if span_id is not None else self.new_id(),
+            'parent_id': parent_id,
+            'name': name,
+            'start': round(self.offset + start, 6),
+            'duration': round(duration, 6),
+            'attributes': attributes
+        })
+
+
+def _active() -> Optional[_TraceContext]:
+    return getattr(_local, 'context', None)
+
+
+class Tracer:
+    """Times spans and passes them to hooks"""
+
+    def __init__(self, hooks: Optional[List[Hook]] = None):
+        """
+        Args:
+            hooks: Callables receiving each finished span dict ('trace_id',
+                'span_id', 'parent_id', 'name', 'start' as a Unix time,
+                'duration' in seconds and 'attributes')
+        """
+        self.hooks = list(hooks or [])
+
+    def add_hook(self, hook: Hook):
+        """Register a span hook"""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Hook):
+        """Unregister a span hook"""
+        self.hooks.remove(hook)
+
+    def emit(self, span: Dict):
+        """Pass a finished span to every hook; hook errors never fail a send"""
+        for hook in list(self.hooks):
+            try:
+                hook(span)
+            except Exception as e:
+                print(f"Error in trace hook: {e}")
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Dict]:
+        """
+        Time the enclosed block as a span
+
+        Spans opened inside it on the same thread (including the adapter's
+        connection phases) become its children; the outermost span starts
+        a new trace. Yields the attributes dict, which the block may extend.
+        """
+        if not self.hooks:
+            yield attributes
+            return
+
+        previous = _active()
+        context = previous
+        if context is None or context.tracer is not self:
+            context = _local.context = _TraceContext(self)
+        span_id = context.new_id()
+        parent_id = context.stack[-1][0] if context.stack else None
+        start = time.perf_counter()
+        context.stack.append((span_id, start))
+        try:
+            yield attributes
+        except Exception as e:
+            attributes['error'] = type(e).__name__
+            raise
+        finally:
+            context.stack.pop()
+            context.record(name, start, time.perf_counter() - start,
+                           span_id=span_id, parent_id=parent_id, **attributes)
+            _local.context = previous
+
+
+class _TracedConnectionMixin:
+    """Times DNS + TCP connect and the TLS handshake of new connections"""
+
+    _tcp_time = 0.0
+
+    def _new_conn(self):
+        context = _active()
+        if context is None:
+            return super()._new_conn()
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        self._tcp_time = time.perf_counter() - start
+        context.connection_time += self._tcp_time
+        context.record('connect', start, self._tcp_time, host=self.host)
+        return sock
+
+    def connect(self):
+        context = _active()
+        if context is None:
+            return super().connect()
+        self._tcp_time = 0.0
+        start = time.perf_counter()
+        super().connect()
+        handshake = time.perf_counter() - start - self._tcp_time
+        if isinstance(self, HTTPSConnection):
+            context.connection_time += handshake
+            context.record('tls', start + self._tcp_time, handshake, host=self.host)
+
+
+class TracedHTTPConnection(_TracedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TracedHTTPSConnection(_TracedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TracedPoolMixin:
+    """
+    Times taking a connection from the pool and notes whether it is reused
+
+    Put it first among the bases of a connection pool class so that the
+    span covers whatever other pool mixins do when handing out a connection.
+    """
+
+    def _get_conn(self, timeout=None):
+        context = _active()
+        if context is None:
+            return super()._get_conn(timeout)
+        start = time.perf_counter()
+        conn = super()._get_conn(timeout)
+        elapsed = time.perf_counter() - start
+        context.connection_time += elapsed
+        context.record('acquire', start, elapsed, reused=getattr(conn, 'sock', None) is not None)
+        return conn
+
+
+class TracedHTTPConnectionPool(TracedPoolMixin, HTTPConnectionPool):
+    ConnectionCls = TracedHTTPConnection
+
+
+class TracedHTTPSConnectionPool(TracedPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = TracedHTTPSConnection
+
+
+class TracingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter recording connection, first-byte and body-read spans
+
+    Requests sent through a proxy are not broken down below 'ttfb'.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TracedHTTPConnectionPool,
+            'https': TracedHTTPSConnectionPool
+        }
+
+    def send(self, request, stream=False, **kwargs):
+        context = _active()
+        if context is None:
+            return super().send(request, stream=stream, **kwargs)
+
+        # From the enclosing span's start: building the PreparedRequest,
+        # including JSON encoding of the body
+        if context.stack:
+            opened = context.stack[-1][1]
+            context.record('prepare', opened, time.perf_counter() - opened)
+
+        setup_before = context.connection_time
+        start = time.perf_counter()
+        response = super().send(request, stream=stream, **kwargs)
+        setup = context.connection_time - setup_before
+        context.record('ttfb', start + setup, time.perf_counter() - start - setup,
+                       status_code=response.status_code)
+
+        if not stream:
+            start = time.perf_counter()
+            body = response.content
+            context.record('read', start, time.perf_counter() - start, bytes=len(body or b''))
+        return response
+
+
+class FileSpanExporter:
+    """Hook appending each span to a file as one JSON line"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: File to append spans to
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, span: Dict):
+        line = json.dumps(span, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        """Flush and close the file"""
+        with self._lock:
+            self._file.close()
+
+
+class PhaseBreakdown:
+    """Hook summing span durations per phase"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = {}
+        self.attempts = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def __call__(self, span: Dict):
+        name = span['name']
+        with self._lock:
+            self.durations.setdefault(name, []).append(span['duration'])
+            if name == 'attempt':
+                self.attempts += 1
+            elif name == 'acquire':
+                if span['attributes'].get('reused'):
+                    self.reused_connections += 1
+                else:
+                    self.new_connections += 1
+
+    def summary(self) -> List[Dict]:
+        """
+        Per-phase totals
+
+        Returns:
+            One dict per observed phase, in PHASES order, with 'phase',
+            'count', 'total', 'mean' and 'max' (seconds) and 'share' of
+            the time across all phases
+        """
+        with self._lock:
+            durations = {name: list(values) for name, values in self.durations.items()}
+        grand_total = sum(sum(durations.get(phase, ())) for phase in PHASES) or 1.0
+        rows = []
+        for phase in PHASES:
+            values = durations.get(phase)
+            if not values:
+                continue
+            total = sum(values)
+            rows.append({
+                'phase': phase,
+                'count': len(values),
+                'total': total,
+                'mean': total / len(values),
+                'max': max(values),
+                'share': total / grand_total
+            })
+        return rows
+
+    def format(self) -> str:
+        """Per-phase breakdown as a text table"""
+        lines = [f"🔍 Trace: {self.attempts} requests, {self.new_connections} new connections, "
+                 f"{self.reused_connections} reused",
+                 f"  {'Phase':<8} {'Count':>6} {'Total ms':>10} {'Mean ms':>9} {'Max ms':>9} {'Share':>6}"]
+        for row in self.summary():
+            lines.append(f"  {row['phase']:<8} {row['count']:>6} {row['total'] * 1000:>10.1f} "
+                         f"{row['mean'] * 1000:>9.2f} {row['max'] * 1000:>9.2f} "
+                         f"{row['share']:>6.1%}")
+        return '\n'.join(lines)
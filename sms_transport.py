@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+HTTP transport for SMSClient
+
+PooledAdapter is the requests adapter SMSClient mounts on its session.
+On top of TracingAdapter's connection timing it adds:
+
+- pool size and blocking: with pool_block, threads wait (up to
+  pool_timeout) for a free connection instead of opening extra ones that
+  are thrown away when returned to a full pool
+- idle reaping: a pooled connection idle for longer than idle_timeout is
+  closed when taken out and a fresh one is opened. Load balancers drop
+  idle keep-alive connections silently, and a send written to a dropped
+  connection fails ambiguously and is not retried.
+- optional TCP keep-alive probes on every connection
+- pool counters: hits (a kept-alive connection was reused), misses (a
+  new connection was opened), reaped, discarded (returned to a full
+  pool) and exhausted (no free connection within pool_timeout)
+
+Thread safety: urllib3 pools hand each connection to one thread at a
+time, so a session with this adapter mounted may be shared by any number
+of threads as long as its settings (headers, adapters) are not changed
+after setup.
+"""
+
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+from sms_trace import (TracingAdapter, TracedHTTPConnection, TracedHTTPSConnection,
+                       TracedPoolMixin)
+
+# Constants
+DEFAULT_POOL_SIZE = 10
+# Below the 60 second idle timeout common on load balancers
+DEFAULT_IDLE_TIMEOUT = 55.0
+DEFAULT_POOL_TIMEOUT = 5.0
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_PROBES = 3
+
+
+def keepalive_options(idle: float) -> List[Tuple[int, int, int]]:
+    """
+    Socket options enabling TCP keep-alive
+
+    Args:
+        idle: Seconds a connection is idle before the first probe
+
+    Returns:
+        (level, option, value) tuples for the options this platform has
+    """
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    idle_option = getattr(socket, 'TCP_KEEPIDLE', None) or getattr(socket, 'TCP_KEEPALIVE', None)
+    if idle_option is not None:
+        options.append((socket.IPPROTO_TCP, idle_option, max(1, int(idle))))
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL))
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_PROBES))
+    return options
+
+
+class _ManagedPoolMixin:
+    """Reaps idle connections, bounds blocking waits and counts pool events"""
+
+    # Set per adapter on the pool classes it creates
+    adapter = None
+    idle_timeout = None
+    pool_timeout = None
+
+    def _get_conn(self, timeout=None):
+        adapter = self.adapter
+        try:
+            conn = super()._get_conn(self.pool_timeout if timeout is None else timeout)
+        except EmptyPoolError:
+            adapter._count('exhausted')
+            raise
+
+        if getattr(conn, 'sock', None) is not None:
+            released = getattr(conn, '_sms_released_at', None)
+            if (self.idle_timeout and released is not None
+                    and time.monotonic() - released > self.idle_timeout):
+                conn.close()
+                adapter._count('reaped')
+        adapter._count('hits' if getattr(conn, 'sock', None) is not None else 'misses')
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn._sms_released_at = time.monotonic()
+            if self.pool is not None and self.pool.full():
+                self.adapter._count('discarded')
+        super()._put_conn(conn)
+
+
+# The tracing mixin goes first so its 'acquire' span sees reaped connections as new
+class PooledHTTPConnectionPool(TracedPoolMixin, _ManagedPoolMixin, HTTPConnectionPool):
+    ConnectionCls = TracedHTTPConnection
+
+
+class PooledHTTPSConnectionPool(TracedPoolMixin, _ManagedPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = TracedHTTPSConnection
+
+
+class PooledAdapter(TracingAdapter):
+    """TracingAdapter with idle reaping, TCP keep-alive and pool counters"""
+
+    def __init__(self, pool_maxsize: int = DEFAULT_POOL_SIZE, pool_block: bool = False,
+                 idle_timeout: Optional[float] = DEFAULT_IDLE_TIMEOUT,
+                 tcp_keepalive: Optional[float] = None,
+                 pool_timeout: float = DEFAULT_POOL_TIMEOUT, **kwargs):
+        """
+        Args:
+            pool_maxsize: Connections kept open per host
+            pool_block: Wait for a free connection rather than open one
+                beyond pool_maxsize
+            idle_timeout: Seconds after which an idle pooled connection is
+                replaced instead of reused; None or 0 disables
+            tcp_keepalive: Idle seconds before TCP keep-alive probes start;
+                None leaves keep-alive off
+            pool_timeout: Longest wait for a free connection with
+                pool_block; a request that times out raises ConnectTimeout
+            **kwargs: Passed on to HTTPAdapter (pool_connections, max_retries)
+        """
+        # init_poolmanager runs inside HTTPAdapter.__init__ and needs these
+        self.idle_timeout = idle_timeout
+        self.tcp_keepalive = tcp_keepalive
+        self.pool_timeout = pool_timeout
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'reaped': 0, 'discarded': 0, 'exhausted': 0}
+        super().__init__(pool_maxsize=pool_maxsize, pool_block=pool_block, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self.tcp_keepalive:
+            pool_kwargs['socket_options'] = (HTTPConnection.default_socket_options
+                                             + keepalive_options(self.tcp_keepalive))
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        settings = {'adapter': self, 'idle_timeout': self.idle_timeout,
+                    'pool_timeout': self.pool_timeout}
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('PooledHTTPConnectionPool', (PooledHTTPConnectionPool,), settings),
+            'https': type('PooledHTTPSConnectionPool', (PooledHTTPSConnectionPool,), settings)
+        }
+
+    def send(self, request, **kwargs):
+        try:
+            return super().send(request, **kwargs)
+        except EmptyPoolError as e:
+            # Nothing was sent, so callers may retry as for a connect timeout
+            raise requests.exceptions.ConnectTimeout(
+                f"No free connection within {self.pool_timeout}s: {e}", request=request)
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def snapshot(self) -> Dict:
+        """Copy of the pool counters, with 'hit_ratio' of connection checkouts"""
+        with self._lock:
+            stats = dict(self.stats)
+        checkouts = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / checkouts, 4) if checkouts else None
+        return stats
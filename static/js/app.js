@@ -7,7 +7,8 @@
 // Global Application State
 class SMSApp {
     constructor() {
-        this.currentUploadedContacts = [];
+        // Uploaded list kept server-side: { list_id, count, preview }
+        this.currentContactList = null;
         this.notifications = [];
         this.init();
     }
@@ -177,11 +178,14 @@ class SMSApp {
                     phone_numbers: [this.formatPhoneNumber(phoneNumber)],
                     message,
                     sender
-                });
+                }, this.draftIdempotencyKey(form));
                 
                 if (result.success) {
+                    delete form.dataset.idempotencyKey;
                     this.showNotification(
-                        `Message sent successfully! Delivery tracking: ${result.bulk_id}`,
+                        result.replayed
+                            ? `This message was already sent. Delivery tracking: ${result.bulk_id}`
+                            : `Message sent successfully! Delivery tracking: ${result.bulk_id}`,
                         'success'
                     );
                     form.reset();
@@ -213,30 +217,46 @@ class SMSApp {
             const message = formData.get('message')?.trim();
             const sender = formData.get('sender')?.trim() || '';
             
-            let phoneNumbers = this.getPhoneNumbers();
+            const contactList = this.currentContactList;
+            const phoneNumbers = contactList ? [] : this.getPhoneNumbers();
+            const recipientCount = contactList ? contactList.count : phoneNumbers.length;
             
-            if (!this.validateBulkSMSForm(message, phoneNumbers)) return;
+            if (!this.validateBulkSMSForm(message, recipientCount)) return;
             
             const submitBtn = form.querySelector('button[type="submit"]');
             this.setButtonLoading(submitBtn, 'Sending Bulk SMS...');
             
             try {
-                const result = await this.sendSMS({
-                    phone_numbers: phoneNumbers,
+                const recipients = contactList
+                    ? { list_id: contactList.list_id }
+                    : { phone_numbers: phoneNumbers };
+                // The send runs as a background job; follow its progress
+                // instead of holding one request open for the whole send
+                const submitted = await this.submitSendJob({
+                    ...recipients,
                     message,
                     sender
-                });
+                }, this.draftIdempotencyKey(form));
                 
-                if (result.success) {
+                if (!submitted.success) {
+                    this.showNotification(`Bulk send failed: ${submitted.error}`, 'error');
+                    return;
+                }
+                delete form.dataset.idempotencyKey;
+                
+                this.showSendProgress(submitted.job);
+                const job = await this.followJob(submitted, (progress) => this.showSendProgress(progress));
+                
+                if (job.status === 'done') {
                     this.showNotification(
-                        `Bulk SMS sent! ${result.successful}/${result.total_sent} delivered. ID: ${result.bulk_id}`,
+                        `Bulk SMS sent! ${job.sent}/${job.total} accepted. ID: ${job.bulk_ids[0] || job.job_id}`,
                         'success',
                         8000
                     );
                     form.reset();
                     this.clearUploadedContacts();
                 } else {
-                    this.showNotification(`Bulk send failed: ${result.error}`, 'error');
+                    this.showNotification(`Bulk send failed: ${job.error}`, 'error');
                 }
             } catch (error) {
                 this.showNotification('Network error during bulk send.', 'error');
@@ -309,7 +329,11 @@ class SMSApp {
             const result = await response.json();
             
             if (result.success) {
-                this.currentUploadedContacts = result.phone_numbers;
+                this.currentContactList = {
+                    list_id: result.list_id,
+                    count: result.count,
+                    preview: result.preview
+                };
                 this.showNotification(
                     `📱 ${result.count} contacts loaded from ${file.name}`,
                     'success'
@@ -325,16 +349,12 @@ class SMSApp {
     }
     
     validateFileType(file) {
-        const allowedTypes = ['.txt', '.csv'];
+        const allowedTypes = ['.txt', '.csv', '.txt.gz', '.csv.gz'];
         const fileName = file.name.toLowerCase();
         return allowedTypes.some(type => fileName.endsWith(type));
     }
     
     getPhoneNumbers() {
-        if (this.currentUploadedContacts.length > 0) {
-            return this.currentUploadedContacts;
-        }
-        
         const phoneTextarea = document.getElementById('phoneNumbers');
         if (!phoneTextarea) return [];
         
@@ -349,14 +369,15 @@ class SMSApp {
         const container = document.getElementById('uploadedContacts');
         if (!container) return;
         
-        if (this.currentUploadedContacts.length > 0) {
-            const preview = this.currentUploadedContacts.slice(0, 3).join(', ');
-            const remaining = this.currentUploadedContacts.length - 3;
+        const contactList = this.currentContactList;
+        if (contactList) {
+            const preview = contactList.preview.slice(0, 3).join(', ');
+            const remaining = contactList.count - 3;
             
             container.innerHTML = `
                 <div class="contacts-preview">
                     <div class="contacts-header">
-                        <span class="contacts-count">${this.currentUploadedContacts.length} contacts loaded</span>
+                        <span class="contacts-count">${contactList.count} contacts loaded</span>
                         <button type="button" class="btn btn-small btn-secondary" onclick="smsApp.clearUploadedContacts()">
                             Clear
                         </button>
@@ -373,7 +394,7 @@ class SMSApp {
     }
     
     clearUploadedContacts() {
-        this.currentUploadedContacts = [];
+        this.currentContactList = null;
         this.updateContactsDisplay();
         
         const fileInput = document.getElementById('phoneFile');
@@ -391,24 +412,33 @@ class SMSApp {
             e.preventDefault();
             
             const formData = new FormData(form);
-            const bulkId = formData.get('bulk_id')?.trim();
-            const limit = formData.get('limit') || 50;
+            const params = new URLSearchParams();
+            ['bulk_id', 'phone', 'status'].forEach(name => {
+                const value = formData.get(name)?.trim();
+                if (value) params.append(name, value);
+            });
+            params.append('limit', formData.get('limit') || 100);
             
             const submitBtn = form.querySelector('button[type="submit"]');
             this.setButtonLoading(submitBtn, 'Loading...');
             
+            // Rows are fetched a page at a time as the table scrolls
+            this.reportsView = {
+                params,
+                rows: [],
+                cursor: null,
+                done: false,
+                loading: false,
+                matching: 0
+            };
+            
             try {
-                const params = new URLSearchParams();
-                if (bulkId) params.append('bulk_id', bulkId);
-                params.append('limit', limit);
-                
-                const response = await fetch(`/api/reports?${params}`);
-                const result = await response.json();
+                const result = await this.fetchReportsPage();
                 
                 if (result.success) {
-                    this.displayReports(result.reports);
+                    this.displayReports();
                     this.showNotification(
-                        `Loaded ${result.reports?.length || 0} delivery reports`,
+                        `Found ${result.matching} delivery reports`,
                         'success'
                     );
                 } else {
@@ -423,11 +453,35 @@ class SMSApp {
         });
     }
     
-    displayReports(reports) {
+    async fetchReportsPage() {
+        const view = this.reportsView;
+        view.loading = true;
+        
+        try {
+            const params = new URLSearchParams(view.params);
+            if (view.cursor) params.append('cursor', view.cursor);
+            
+            const response = await fetch(`/api/reports?${params}`);
+            const result = await response.json();
+            
+            if (result.success && view === this.reportsView) {
+                view.rows.push(...result.reports);
+                view.cursor = result.next_cursor;
+                view.done = !result.next_cursor;
+                if (result.matching !== undefined) view.matching = result.matching;
+            }
+            return result;
+        } finally {
+            view.loading = false;
+        }
+    }
+    
+    displayReports() {
         const container = document.getElementById('reportsContainer');
         if (!container) return;
         
-        if (!reports || reports.length === 0) {
+        const view = this.reportsView;
+        if (!view || view.rows.length === 0) {
             container.innerHTML = `
                 <div class="empty-state">
                     <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
@@ -441,7 +495,9 @@ class SMSApp {
             return;
         }
         
-        const table = `
+        // Virtualized table: only the rows in view (plus a margin) are in
+        // the DOM; the spacer gives the scrollbar the height of every row
+        container.innerHTML = `
             <div class="reports-table">
                 <div class="table-header">
                     <div class="table-cell">Recipient</div>
@@ -451,26 +507,84 @@ class SMSApp {
                     <div class="table-cell">Sent</div>
                     <div class="table-cell">Delivered</div>
                 </div>
-                <div class="table-body">
-                    ${reports.map(report => `
-                        <div class="table-row">
-                            <div class="table-cell">${report.to || 'N/A'}</div>
-                            <div class="table-cell">
-                                <span class="status-badge status-${this.getStatusClass(report.status?.name)}">
-                                    ${report.status?.name || 'Unknown'}
-                                </span>
-                            </div>
-                            <div class="table-cell font-mono">${this.truncateId(report.messageId)}</div>
-                            <div class="table-cell">${this.formatPrice(report.price)}</div>
-                            <div class="table-cell">${this.formatDateTime(report.sentAt)}</div>
-                            <div class="table-cell">${this.formatDateTime(report.doneAt)}</div>
-                        </div>
-                    `).join('')}
+                <div class="table-body reports-viewport" id="reportsViewport">
+                    <div class="reports-spacer" id="reportsSpacer"></div>
+                    <div class="reports-window" id="reportsWindow"></div>
                 </div>
             </div>
         `;
         
-        container.innerHTML = table;
+        const viewport = document.getElementById('reportsViewport');
+        viewport.addEventListener('scroll', () => {
+            if (this.reportsFrame) return;
+            this.reportsFrame = requestAnimationFrame(() => {
+                this.reportsFrame = null;
+                this.renderVisibleReports();
+            });
+        });
+        this.renderVisibleReports();
+    }
+    
+    renderVisibleReports() {
+        const view = this.reportsView;
+        const viewport = document.getElementById('reportsViewport');
+        if (!view || !viewport) return;
+        
+        const rowHeight = parseInt(
+            getComputedStyle(viewport).getPropertyValue('--report-row-height'), 10
+        ) || 52;
+        const overscan = 10;
+        
+        document.getElementById('reportsSpacer').style.height =
+            `${Math.max(view.matching, view.rows.length) * rowHeight}px`;
+        
+        const first = Math.max(0, Math.floor(viewport.scrollTop / rowHeight) - overscan);
+        const last = Math.min(
+            view.rows.length,
+            Math.ceil((viewport.scrollTop + viewport.clientHeight) / rowHeight) + overscan
+        );
+        
+        const rowsWindow = document.getElementById('reportsWindow');
+        rowsWindow.style.transform = `translateY(${first * rowHeight}px)`;
+        rowsWindow.replaceChildren(
+            ...view.rows.slice(first, last).map(report => this.reportRow(report))
+        );
+        
+        // Fetch the next page before the loaded rows run out
+        if (!view.done && !view.loading && last + overscan >= view.rows.length) {
+            this.fetchReportsPage()
+                .then(() => this.renderVisibleReports())
+                .catch(error => console.error('Reports paging error:', error));
+        }
+    }
+    
+    reportRow(report) {
+        // Report fields come from webhook callbacks, so they are set as
+        // text and never parsed as HTML
+        const cell = (text, className = '') => {
+            const el = document.createElement('div');
+            el.className = `table-cell ${className}`.trim();
+            el.textContent = text;
+            return el;
+        };
+        
+        const status = document.createElement('span');
+        status.className = `status-badge status-${this.getStatusClass(report.status?.name)}`;
+        status.textContent = report.status?.name || 'Unknown';
+        const statusCell = cell('');
+        statusCell.appendChild(status);
+        
+        const row = document.createElement('div');
+        row.className = 'table-row';
+        row.append(
+            cell(report.to || 'N/A'),
+            statusCell,
+            cell(this.truncateId(report.messageId), 'font-mono'),
+            cell(this.formatPrice(report.price)),
+            cell(this.formatDateTime(report.sentAt)),
+            cell(this.formatDateTime(report.doneAt))
+        );
+        return row;
     }
     
     getStatusClass(status) {
@@ -516,7 +630,7 @@ class SMSApp {
             const result = await response.json();
             
             if (result.success) {
-                this.displayBalance(result.balance);
+                this.displayBalance(result.balance, result.age);
             } else {
                 container.innerHTML = `
                     <div class="error-state">
@@ -543,7 +657,7 @@ class SMSApp {
         }
     }
     
-    displayBalance(balance) {
+    displayBalance(balance, age = 0) {
         const container = document.getElementById('balanceContainer');
         if (!container) return;
         
@@ -572,6 +686,10 @@ class SMSApp {
                             <span class="label">Currency</span>
                             <span class="value">${balance.currency || 'N/A'}</span>
                         </div>
+                        <div class="info-item">
+                            <span class="label">Updated</span>
+                            <span class="value">${age < 1 ? 'just now' : `${Math.round(age)}s ago`}</span>
+                        </div>
                     </div>
                 </div>
             </div>
@@ -616,13 +734,13 @@ class SMSApp {
         return true;
     }
     
-    validateBulkSMSForm(message, phoneNumbers) {
+    validateBulkSMSForm(message, recipientCount) {
         if (!message) {
             this.showNotification('Please enter a message.', 'error');
             return false;
         }
         
-        if (phoneNumbers.length === 0) {
+        if (recipientCount === 0) {
             this.showNotification('Please provide phone numbers.', 'error');
             return false;
         }
@@ -630,18 +748,104 @@ class SMSApp {
         return true;
     }
     
-    async sendSMS(data) {
+    draftIdempotencyKey(form) {
+        // One key per filled-in form: resubmitting it (a double click or a
+        // retry after a dropped response) replays the first send instead of
+        // sending again. The key is dropped once the server has the send.
+        if (!form.dataset.idempotencyKey) {
+            form.dataset.idempotencyKey = window.crypto?.randomUUID
+                ? window.crypto.randomUUID()
+                : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        }
+        return form.dataset.idempotencyKey;
+    }
+    
+    async sendSMS(data, idempotencyKey) {
+        const headers = { 'Content-Type': 'application/json' };
+        if (idempotencyKey) headers['Idempotency-Key'] = idempotencyKey;
+        
         const response = await fetch('/api/send-sms', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers,
             body: JSON.stringify(data)
         });
         
         return await response.json();
     }
     
+    async submitSendJob(data, idempotencyKey) {
+        const headers = { 'Content-Type': 'application/json' };
+        if (idempotencyKey) headers['Idempotency-Key'] = idempotencyKey;
+        
+        const response = await fetch('/api/jobs', {
+            method: 'POST',
+            headers,
+            body: JSON.stringify(data)
+        });
+        
+        return await response.json();
+    }
+    
+    followJob(submitted, onProgress) {
+        // Resolves with the finished job. Progress arrives over Server-Sent
+        // Events; EventSource reconnects by itself when the server ends a
+        // stream, and browsers without it poll the status URL instead.
+        return new Promise((resolve, reject) => {
+            if (!window.EventSource) {
+                this.pollJob(submitted.status_url, onProgress).then(resolve, reject);
+                return;
+            }
+            
+            const source = new EventSource(submitted.events_url);
+            let failures = 0;
+            source.addEventListener('progress', (e) => {
+                failures = 0;
+                onProgress(JSON.parse(e.data));
+            });
+            source.addEventListener('done', (e) => {
+                source.close();
+                const job = JSON.parse(e.data);
+                onProgress(job);
+                resolve(job);
+            });
+            source.onerror = () => {
+                // Stream ends are routine; give up on SSE only if reconnects keep failing
+                if (++failures > 5) {
+                    source.close();
+                    this.pollJob(submitted.status_url, onProgress).then(resolve, reject);
+                }
+            };
+        });
+    }
+    
+    async pollJob(statusUrl, onProgress) {
+        while (true) {
+            const response = await fetch(statusUrl);
+            const result = await response.json();
+            if (!result.success) throw new Error(result.error);
+            
+            onProgress(result.job);
+            if (result.job.status === 'done' || result.job.status === 'failed') {
+                return result.job;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+    
+    showSendProgress(job) {
+        const panel = document.getElementById('sendProgress');
+        if (!panel) return;
+        
+        const done = job.sent + job.failed + (job.skipped || 0);
+        panel.style.display = 'block';
+        panel.querySelector('.send-progress-fill').style.width =
+            `${job.total ? (done / job.total) * 100 : 0}%`;
+        panel.querySelector('.send-progress-counts').textContent =
+            `${job.sent.toLocaleString()} sent · ${job.failed.toLocaleString()} failed · ` +
+            (job.skipped ? `${job.skipped.toLocaleString()} skipped · ` : '') +
+            `${job.remaining.toLocaleString()} remaining`;
+    }
+    
     setButtonLoading(button, text) {
         button.dataset.originalText = button.textContent;
         button.innerHTML = `<span class="loading-spinner"></span>${text}`;
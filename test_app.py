@@ -7,14 +7,22 @@ Run with: pytest test_app.py
 """
 
 import pytest
+import json
+import time
 import tempfile
 import os
 from unittest.mock import patch, MagicMock
-from io import StringIO
+import gzip
+from io import StringIO, BytesIO
 
 # Set up test configuration before importing app
 os.environ['TESTING'] = 'True'
 
+# Imported before sys.modules is patched below: unloading zoneinfo again
+# afterwards leaves its C module unusable
+from sms_schedule import (ScheduleStore, process_due, run_scheduler, align_to_window,
+                          next_occurrence, parse_send_time, parse_window, get_zone)
+
 # Mock the config import to avoid import errors during testing
 with patch.dict('sys.modules', {
     'config': MagicMock(
@@ -24,19 +32,58 @@ with patch.dict('sys.modules', {
     )
 }):
     import app
-    from sms_application import SMSClient
+    import requests
+    from sms_application import SMSClient, SMSAPIError, ResponseWriter, format_response
+    from sms_retry import RetryPolicy, RetryBudget, parse_retry_after
+    from sms_queue import SMSOutbox, run_worker
+    from sms_reports import DeliveryReportStore, ReportIngestor, sync_reports, parse_timestamp
+    from sms_numbers import normalize_number, normalize_numbers, normalize_stream
+    from sms_contacts import read_phone_numbers, iter_lines, UploadTooLarge, ContactListStore
+    from sms_segments import segment_text, estimate_campaign, count_segments, estimate_personalized
+    from sms_templates import MessageTemplate, TemplateError, iter_rendered
+    from sms_async import AsyncSMSClient
+    from sms_cache import SharedTTLCache
+    from sms_metrics import ClientMetrics, Registry, SnapshotDirectory
+    from sms_trace import FileSpanExporter, PhaseBreakdown
+    from sms_idempotency import SendCache, IdempotencyConflict
+    from sms_coalesce import SendCoalescer
+    from sms_breaker import CircuitBreaker, EndpointSet
+
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from sms_emulator import InfobipEmulator, parse_distribution
+
+
+def fake_send_post(url, json=None, timeout=None):
+    """Stand-in for Session.post that echoes one PENDING message per destination"""
+    response = MagicMock()
+    destinations = json['messages'][0]['destinations']
+    response.json.return_value = {
+        'bulkId': f"bulk-{destinations[0]['to']}",
+        'messages': [{
+            'messageId': f"id-{d['to']}",
+            'status': {'groupName': 'PENDING'},
+            'to': d['to']
+        } for d in destinations]
+    }
+    response.raise_for_status.return_value = None
+    return response
 
 
 class TestFlaskApp:
     """Test Flask web application"""
     
     @pytest.fixture
-    def client(self):
+    def client(self, tmp_path):
         """Create test client"""
         app.app.config['TESTING'] = True
         app.app.config['WTF_CSRF_ENABLED'] = False
+        app.app.config['CONTACTS_PATH'] = str(tmp_path / 'contacts')
+        app._contact_store = None
         with app.app.test_client() as client:
             yield client
+        app._contact_store = None
     
     def test_index_page(self, client):
         """Test dashboard loads correctly"""
@@ -94,6 +141,25 @@ class TestFlaskApp:
                              content_type='application/json')
         assert response.status_code == 400
     
+    def test_api_send_sms_bulk(self, client):
+        """Test SMS API sends lists larger than one upstream batch"""
+        phone_numbers = [f'+2547{i:08d}' for i in range(150)]
+        with patch.object(app.sms_client.session, 'post', side_effect=fake_send_post):
+            response = client.post('/api/send-sms',
+                                 json={'phone_numbers': phone_numbers, 'message': 'Test message'})
+        
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['successful'] == 150
+        assert len(data['chunks']) == 2
+        assert len(data['bulk_ids']) == 2
+    
+    def test_metrics_include_retries(self, client):
+        """Test retry counters are exposed on the metrics endpoint"""
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert 'retries' in response.get_json()['sms_client']
+    
     def test_file_upload_validation(self, client):
         """Test file upload validation"""
         # Test no file
@@ -124,7 +190,8 @@ class TestFlaskApp:
             assert response.status_code == 200
             data = response.get_json()
             assert data['success'] is True
-            assert len(data['phone_numbers']) == 2
+            assert data['count'] == 2
+            assert data['list_id']
         finally:
             os.unlink(temp_file)
 
@@ -191,6 +258,1179 @@ class TestSMSClient:
         phone_numbers = [f'+123456789{i:02d}' for i in range(101)]
         with pytest.raises(ValueError, match="Cannot send to more than"):
             client.send_sms(phone_numbers, 'Test message')
+    
+    def test_send_bulk_chunks_and_merges(self):
+        """Test bulk sending splits recipients and merges results in order"""
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender', max_workers=4)
+        client.session.post = MagicMock(side_effect=fake_send_post)
+        phone_numbers = [f'+2547{i:08d}' for i in range(250)]
+        
+        result = client.send_bulk(phone_numbers, 'Test message')
+        
+        assert client.session.post.call_count == 3
+        assert [m['to'] for m in result['messages']] == phone_numbers
+        assert [c['size'] for c in result['chunks']] == [100, 100, 50]
+        assert len(result['bulkIds']) == 3
+        assert result['bulkId'] == result['bulkIds'][0]
+        assert result['failedRecipients'] == []
+        assert all(c['duration'] >= 0 and c['error'] is None for c in result['chunks'])
+    
+    def test_send_bulk_partial_failure(self):
+        """Test a failed batch is reported without losing the others"""
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender',
+                           retry_policy=RetryPolicy(sleep=lambda s: None))
+        
+        def flaky_post(url, json=None, timeout=None):
+            if json['messages'][0]['destinations'][0]['to'] == '+254700000010':
+                raise requests.exceptions.ConnectionError('boom')
+            return fake_send_post(url, json=json, timeout=timeout)
+        
+        client.session.post = MagicMock(side_effect=flaky_post)
+        phone_numbers = [f'+2547000000{i:02d}' for i in range(20)]
+        
+        result = client.send_bulk(phone_numbers, 'Test message', chunk_size=10)
+        
+        assert len(result['messages']) == 10
+        assert result['failedRecipients'] == phone_numbers[10:]
+        assert result['chunks'][1]['error'] is not None
+        
+        # Every batch failing surfaces as an error
+        client.session.post = MagicMock(side_effect=requests.exceptions.ConnectionError('down'))
+        with pytest.raises(requests.RequestException):
+            client.send_bulk(phone_numbers, 'Test message', chunk_size=10)
+    
+    def test_send_personalized_packs_rows(self):
+        """Test personalized rows are packed and mapped back by message ID"""
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender')
+        payloads = []
+        
+        def packed_post(url, json=None, timeout=None):
+            payloads.append(json)
+            response = MagicMock()
+            destinations = [d for m in json['messages'] for d in m['destinations']]
+            # Respond out of order to prove mapping is by message ID
+            response.json.return_value = {
+                'bulkId': f'bulk-{len(payloads)}',
+                'messages': [{
+                    'messageId': d['messageId'],
+                    'status': {'groupName': 'PENDING'},
+                    'smsCount': 1,
+                    'to': d['to']
+                } for d in reversed(destinations)]
+            }
+            response.raise_for_status.return_value = None
+            return response
+        
+        client.session.post = MagicMock(side_effect=packed_post)
+        rows = [(f'+2547{i:08d}', f'Hi user {i}, your code is {i:04d}') for i in range(25)]
+        rows.append(('+254799999999', 'Shared reminder'))
+        rows.append(('+254799999998', 'Shared reminder', 'OtherSender'))
+        rows.append(('+254799999997', 'Shared reminder'))
+        rows.append(('invalid', 'Hi'))
+        
+        result = client.send_personalized(rows, max_messages=10)
+        
+        assert len(payloads) == 3
+        assert all(len(p['messages']) <= 10 for p in payloads)
+        # Identical text and sender share one message object
+        shared = [m for p in payloads for m in p['messages']
+                  if m['text'] == 'Shared reminder' and m['from'] == 'TestSender']
+        assert len(shared) == 1 and len(shared[0]['destinations']) == 2
+        
+        results = result['results']
+        assert [r['to'] for r in results] == [row[0] for row in rows]
+        assert all(r['status']['groupName'] == 'PENDING' for r in results[:-1])
+        assert 'Invalid phone number format' in results[-1]['error']
+        assert sum(r['recipients'] for r in result['requests']) == 28
+    
+    def test_send_personalized_byte_limit(self):
+        """Test requests are split when the payload byte limit is reached"""
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender',
+                           retry_policy=RetryPolicy(max_attempts=1))
+        client.session.post = MagicMock(side_effect=requests.exceptions.ConnectionError('down'))
+        rows = [(f'+2547{i:08d}', f'Message {i} ' + 'x' * 100) for i in range(10)]
+        
+        result = client.send_personalized(rows, max_bytes=1000)
+        
+        assert client.session.post.call_count > 1
+        assert all(r['error'] for r in result['results'])
+        for call in client.session.post.call_args_list:
+            assert len(json.dumps(call.kwargs['json'])) <= 1000
+    
+    def test_send_bulk_validation_error(self):
+        """Test bulk validation happens before anything is sent"""
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender')
+        client.session.post = MagicMock(side_effect=fake_send_post)
+        
+        with pytest.raises(ValueError, match="Invalid phone number format"):
+            client.send_bulk(['+254700000000'] * 150 + ['invalid'], 'Test message')
+        with pytest.raises(ValueError, match="Chunk size"):
+            client.send_bulk(['+254700000000'], 'Test message', chunk_size=101)
+        assert client.session.post.call_count == 0
+
+
+def make_infobip_stand_in(delay=0.0):
+    """Build a minimal local Infobip API stand-in recording request stats"""
+    stats = {'active': 0, 'peak': 0, 'requests': 0, 'peers': set()}
+    
+    async def send(request):
+        stats['requests'] += 1
+        stats['peers'].add(request.transport.get_extra_info('peername'))
+        stats['active'] += 1
+        stats['peak'] = max(stats['peak'], stats['active'])
+        try:
+            await asyncio.sleep(delay)
+            payload = await request.json()
+            destinations = payload['messages'][0]['destinations']
+            return web.json_response({
+                'bulkId': f"bulk-{destinations[0]['to']}",
+                'messages': [{
+                    'messageId': f"id-{d['to']}",
+                    'status': {'groupName': 'PENDING'},
+                    'to': d['to']
+                } for d in destinations]
+            })
+        finally:
+            stats['active'] -= 1
+    
+    async def reports(request):
+        return web.json_response({'results': [
+            {'bulkId': request.query.get('bulkId'), 'to': '+254700000000'}
+        ][:int(request.query['limit'])]})
+    
+    async def balance(request):
+        raise web.HTTPForbidden()
+    
+    stand_in = web.Application()
+    stand_in.router.add_post('/sms/2/text/advanced', send)
+    stand_in.router.add_get('/sms/1/reports', reports)
+    stand_in.router.add_get('/account/1/balance', balance)
+    return stand_in, stats
+
+
+class TestAsyncSMSClient:
+    """Test async SMS client against a local API stand-in"""
+    
+    def run(self, scenario, delay=0.0):
+        async def runner():
+            stand_in, stats = make_infobip_stand_in(delay)
+            async with TestServer(stand_in) as server:
+                base_url = str(server.make_url('')).rstrip('/')
+                await scenario(base_url, stats)
+        asyncio.run(runner())
+    
+    def test_send_sms_and_reports(self):
+        """Test async send, reports and balance mirror the sync client"""
+        async def scenario(base_url, stats):
+            async with AsyncSMSClient('test_key', base_url, 'TestSender') as client:
+                result = await client.send_sms('+254700000000', 'Test message')
+                assert result['messages'][0]['to'] == '+254700000000'
+                
+                reports = await client.get_delivery_reports(bulk_id='b-1', limit=1)
+                assert reports['results'][0]['bulkId'] == 'b-1'
+                
+                with pytest.raises(requests.RequestException, match="permissions"):
+                    await client.check_account_balance()
+                
+                with pytest.raises(ValueError, match="Invalid phone number format"):
+                    await client.send_sms('invalid', 'Test message')
+        self.run(scenario)
+    
+    def test_multipart_warning_on_stderr(self, capsys):
+        """Test the long-text warning stays off stdout, like the sync client"""
+        async def scenario(base_url, stats):
+            async with AsyncSMSClient('test_key', base_url, 'TestSender',
+                                      default_country='254') as client:
+                result = await client.send_sms('0700000000', 'x' * 200)
+                assert result['messages'][0]['to'] == '+254700000000'
+        self.run(scenario)
+        
+        captured = capsys.readouterr()
+        assert 'sent as 2 parts' in captured.err
+        assert 'Warning' not in captured.out
+    
+    def test_in_flight_cap_and_pooling(self):
+        """Test concurrent sends respect the in-flight cap and reuse connections"""
+        async def scenario(base_url, stats):
+            async with AsyncSMSClient('test_key', base_url, 'TestSender',
+                                      pool_size=4, max_in_flight=4) as client:
+                phones = [f'+2547{i:08d}' for i in range(40)]
+                results = await asyncio.gather(*(
+                    client.send_sms(phone, 'Test message') for phone in phones
+                ))
+                assert [r['messages'][0]['to'] for r in results] == phones
+                assert client.in_flight == 0
+            assert stats['requests'] == 40
+            assert stats['peak'] <= 4
+            assert len(stats['peers']) <= 4
+        self.run(scenario, delay=0.01)
+    
+    def test_send_bulk(self):
+        """Test async bulk sending merges batches like the sync client"""
+        async def scenario(base_url, stats):
+            async with AsyncSMSClient('test_key', base_url, 'TestSender') as client:
+                phones = [f'+2547{i:08d}' for i in range(250)]
+                result = await client.send_bulk(phones, 'Test message')
+                assert [m['to'] for m in result['messages']] == phones
+                assert [c['size'] for c in result['chunks']] == [100, 100, 50]
+        self.run(scenario)
+
+
+def http_error(status_code, retry_after=None):
+    """Build a requests HTTPError carrying a response with the given status"""
+    response = requests.Response()
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers['Retry-After'] = retry_after
+    return requests.exceptions.HTTPError(f'{status_code} Error', response=response)
+
+
+class TestRetryPolicy:
+    """Test retry classification, backoff and budget"""
+    
+    def test_classification(self):
+        """Test retryable vs fatal errors"""
+        policy = RetryPolicy()
+        assert policy.is_retryable(http_error(429)) is True
+        assert policy.is_retryable(http_error(503)) is True
+        assert policy.is_retryable(http_error(400)) is False
+        assert policy.is_retryable(http_error(401)) is False
+        assert policy.is_retryable(requests.exceptions.ConnectionError()) is True
+        assert policy.is_retryable(requests.exceptions.ReadTimeout(), idempotent=True) is True
+        assert policy.is_retryable(requests.exceptions.ReadTimeout(), idempotent=False) is False
+        assert policy.is_retryable(requests.exceptions.ConnectTimeout(), idempotent=False) is True
+        # Sends only retry failures the upstream cannot have acted on
+        assert policy.is_retryable(http_error(503), idempotent=False) is True
+        assert policy.is_retryable(http_error(502), idempotent=False) is False
+        assert policy.is_retryable(requests.exceptions.ConnectionError(
+            'Connection aborted.'), idempotent=False) is False
+    
+    def test_send_not_repeated_after_dropped_connection(self):
+        """Test a send whose connection drops after the request is not retried"""
+        import socket
+        import threading
+        
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(8)
+        received = []
+        
+        def serve():
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                except OSError:
+                    return
+                data = b''
+                while b'\r\n\r\n' not in data:
+                    data += conn.recv(65536)
+                head, body = data.split(b'\r\n\r\n', 1)
+                length = int(next(line.split(b':')[1] for line in head.split(b'\r\n')
+                                  if line.lower().startswith(b'content-length')))
+                while len(body) < length:
+                    body += conn.recv(65536)
+                received.append(head.split(b' ')[0])
+                # The request was read in full; drop the socket without answering
+                conn.close()
+        
+        threading.Thread(target=serve, daemon=True).start()
+        port = listener.getsockname()[1]
+        try:
+            client = SMSClient('test_key', f'http://127.0.0.1:{port}', 'TestSender',
+                               retry_policy=RetryPolicy(sleep=lambda s: None))
+            with pytest.raises(SMSAPIError):
+                client.send_sms('+254700000000', 'Test message')
+            assert received == [b'POST']
+            assert client.retry_policy.snapshot()['retries'] == 0
+            client.close()
+        finally:
+            listener.close()
+        
+        # Nothing listens on a port that was only bound, so the connection
+        # cannot open and the send is safe to retry
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+        unused.close()
+        client = SMSClient('test_key', f'http://127.0.0.1:{port}', 'TestSender',
+                           retry_policy=RetryPolicy(max_attempts=2, sleep=lambda s: None))
+        with pytest.raises(SMSAPIError) as excinfo:
+            client.send_sms('+254700000000', 'Test message')
+        assert excinfo.value.attempts == 2
+        client.close()
+    
+    def test_retry_after_and_backoff(self):
+        """Test Retry-After parsing and its use as a backoff floor"""
+        assert parse_retry_after('7') == 7.0
+        assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+        assert parse_retry_after('soon') is None
+        
+        policy = RetryPolicy(base_delay=0.1, max_delay=5.0)
+        assert all(0 <= policy.backoff(1) <= 0.1 for _ in range(50))
+        assert all(0 <= policy.backoff(10) <= 5.0 for _ in range(50))
+        assert policy.backoff(1, retry_after=3.0) >= 3.0
+    
+    def test_send_retries_429_then_succeeds(self):
+        """Test a rate-limited send is retried after Retry-After"""
+        sleeps = []
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender',
+                           retry_policy=RetryPolicy(sleep=sleeps.append))
+        responses = [http_error(429, retry_after='2'), None]
+        
+        def rate_limited_post(url, json=None, timeout=None):
+            error = responses.pop(0)
+            if error:
+                raise error
+            return fake_send_post(url, json=json, timeout=timeout)
+        
+        client.session.post = MagicMock(side_effect=rate_limited_post)
+        result = client.send_sms('+254700000000', 'Test message')
+        
+        assert result['messages'][0]['to'] == '+254700000000'
+        assert sleeps[0] >= 2.0
+        stats = client.retry_policy.snapshot()
+        assert stats['retries'] == 1
+        assert stats['succeeded_after_retry'] == 1
+        assert stats['backoff_seconds'] >= 2.0
+    
+    def test_fatal_error_keeps_status(self):
+        """Test fatal errors are not retried and keep the status code"""
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender',
+                           retry_policy=RetryPolicy(sleep=lambda s: None))
+        client.session.post = MagicMock(side_effect=http_error(401))
+        
+        with pytest.raises(SMSAPIError) as excinfo:
+            client.send_sms('+254700000000', 'Test message')
+        
+        assert excinfo.value.status_code == 401
+        assert excinfo.value.attempts == 1
+        assert client.session.post.call_count == 1
+        
+        client.session.post = MagicMock(side_effect=http_error(503))
+        with pytest.raises(SMSAPIError) as excinfo:
+            client.send_sms('+254700000000', 'Test message')
+        assert excinfo.value.status_code == 503
+        assert excinfo.value.attempts == 4
+    
+    def test_budget_limits_retries(self):
+        """Test the retry budget stops retry amplification"""
+        policy = RetryPolicy(max_attempts=10, sleep=lambda s: None,
+                             budget=RetryBudget(ratio=0.0, max_tokens=3))
+        failing = MagicMock(side_effect=http_error(503))
+        
+        with pytest.raises(requests.exceptions.HTTPError):
+            policy.call(failing)
+        with pytest.raises(requests.exceptions.HTTPError):
+            policy.call(failing)
+        
+        assert failing.call_count == 5  # 3 budgeted retries across both calls
+        assert policy.snapshot()['budget_denied'] == 2
+
+
+class TestSMSOutbox:
+    """Test the durable outbox and send worker"""
+    
+    def make_client(self, post=fake_send_post):
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender',
+                           retry_policy=RetryPolicy(max_attempts=1))
+        client.session.post = MagicMock(side_effect=post)
+        return client
+    
+    def test_enqueue_and_drain(self, tmp_path):
+        """Test queued messages are drained in batches and marked sent"""
+        outbox = SMSOutbox(str(tmp_path / 'outbox.db'))
+        phones = [f'+2547{i:08d}' for i in range(250)]
+        queued = outbox.enqueue(phones, 'Test message')
+        assert queued['count'] == 250
+        assert outbox.batch_status(queued['batch_id']) == {'queued': 250}
+        
+        def packed_post(url, json=None, timeout=None):
+            response = MagicMock()
+            response.json.return_value = {'bulkId': 'bulk-1', 'messages': [
+                {'messageId': d['messageId'], 'to': d['to'], 'status': {'groupName': 'PENDING'}}
+                for m in json['messages'] for d in m['destinations']
+            ]}
+            return response
+        
+        client = self.make_client(packed_post)
+        totals = run_worker(outbox, client, claim_size=100, once=True)
+        
+        assert totals == {'sent': 250, 'failed': 0, 'unknown': 0}
+        assert outbox.batch_status(queued['batch_id']) == {'sent': 250}
+        assert client.session.post.call_count == 3
+    
+    def test_crash_resume_and_failures(self, tmp_path):
+        """Test stale claims are requeued and failures retried then marked failed"""
+        outbox = SMSOutbox(str(tmp_path / 'outbox.db'), retry_delay=0)
+        queued = outbox.enqueue(['+254700000000', '+254700000001'], 'Test message')
+        
+        # A worker claims the rows and dies before recording results
+        assert len(outbox.claim(10)) == 2
+        assert outbox.claim(10) == []
+        assert outbox.requeue_stale(older_than=-1) == 2
+        
+        # Nothing reaches Infobip, so resending is safe
+        def down(url, json=None, timeout=None):
+            raise requests.exceptions.ConnectTimeout('down')
+        
+        client = self.make_client(down)
+        run_worker(outbox, client, once=True, stale_after=3600)
+        
+        # Three attempts in total (one spent by the crashed claim)
+        assert outbox.batch_status(queued['batch_id']) == {'failed': 2}
+        assert client.session.post.call_count == 2
+    
+    def test_failed_rows_back_off(self, tmp_path):
+        """Test a failed row is not claimed again until its retry delay passes"""
+        outbox = SMSOutbox(str(tmp_path / 'outbox.db'), retry_delay=30)
+        queued = outbox.enqueue(['+254700000000'], 'Test message')
+        
+        def down(url, json=None, timeout=None):
+            raise requests.exceptions.ConnectTimeout('down')
+        
+        client = self.make_client(down)
+        assert run_worker(outbox, client, once=True) == {'sent': 0, 'failed': 1, 'unknown': 0}
+        
+        # Still queued, but waiting: the one-shot worker stopped after one try
+        assert outbox.batch_status(queued['batch_id']) == {'queued': 1}
+        assert client.session.post.call_count == 1
+        assert outbox.claim(10) == []
+        
+        with patch('sms_queue.time.time', return_value=time.time() + 31):
+            assert len(outbox.claim(10)) == 1
+    
+    def test_rejected_rows_fail(self, tmp_path):
+        """Test rows Infobip rejects are marked failed, not sent or retried"""
+        outbox = SMSOutbox(str(tmp_path / 'outbox.db'), retry_delay=0)
+        queued = outbox.enqueue(['+254700000000', '+254700000001'], 'Test message')
+        
+        def rejecting_post(url, json=None, timeout=None):
+            response = MagicMock()
+            destinations = [d for m in json['messages'] for d in m['destinations']]
+            response.json.return_value = {'bulkId': 'bulk-1', 'messages': [
+                {'messageId': destinations[0]['messageId'], 'to': destinations[0]['to'],
+                 'status': {'groupName': 'PENDING'}},
+                {'messageId': destinations[1]['messageId'], 'to': destinations[1]['to'],
+                 'status': {'groupName': 'REJECTED', 'name': 'REJECTED_DESTINATION',
+                            'description': 'Destination blocked'}}
+            ]}
+            return response
+        
+        client = self.make_client(rejecting_post)
+        totals = run_worker(outbox, client, once=True)
+        
+        assert totals == {'sent': 1, 'failed': 1, 'unknown': 0}
+        assert outbox.batch_status(queued['batch_id']) == {'sent': 1, 'failed': 1}
+        assert client.session.post.call_count == 1
+        
+        failed = outbox._connect().execute(
+            "SELECT error, attempts FROM outbox WHERE status = 'failed'").fetchall()
+        assert [tuple(row) for row in failed] == [('REJECTED: Destination blocked', 1)]
+    
+    def test_ambiguous_and_refused_sends_not_resent(self, tmp_path):
+        """Test a 5xx marks rows unknown and a 4xx fails them, neither resent"""
+        for error, status in ((http_error(500), 'unknown'),
+                              (requests.exceptions.ReadTimeout('slow'), 'unknown'),
+                              (http_error(400), 'failed')):
+            outbox = SMSOutbox(str(tmp_path / f'{status}-{id(error)}.db'), retry_delay=0)
+            queued = outbox.enqueue(['+254700000000', '+254700000001'], 'Test message')
+            
+            def failing(url, json=None, timeout=None):
+                raise error
+            
+            client = self.make_client(failing)
+            totals = run_worker(outbox, client, once=True)
+            
+            assert outbox.batch_status(queued['batch_id']) == {status: 2}
+            assert totals['unknown'] == (2 if status == 'unknown' else 0)
+            assert client.session.post.call_count == 1
+        
+        # Rows that fail validation are never sent or retried
+        outbox = SMSOutbox(str(tmp_path / 'invalid.db'), retry_delay=0)
+        queued = outbox.enqueue(['not-a-number'], 'Test message')
+        client = self.make_client()
+        run_worker(outbox, client, once=True)
+        assert outbox.batch_status(queued['batch_id']) == {'failed': 1}
+        assert client.session.post.call_count == 0
+    
+    def test_api_send_sms_queue(self, tmp_path):
+        """Test the send API can hand batches to the outbox"""
+        app.app.config['OUTBOX_PATH'] = str(tmp_path / 'outbox.db')
+        app._outbox = None
+        try:
+            with app.app.test_client() as client:
+                response = client.post('/api/send-sms', json={
+                    'phone_numbers': ['+254700000000', '+254700000001'],
+                    'message': 'Test message',
+                    'queue': True
+                })
+                assert response.status_code == 202
+                batch_id = response.get_json()['batch_id']
+                
+                response = client.get(f'/api/outbox/{batch_id}')
+                assert response.get_json()['counts'] == {'queued': 2}
+                assert client.get('/api/outbox/unknown').status_code == 404
+        finally:
+            app._outbox = None
+
+
+class TestDeliveryReportWebhook:
+    """Test pushed delivery report handling"""
+    
+    def test_notify_url_and_callback_data(self):
+        """Test notifyUrl and callbackData are sent when configured"""
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender',
+                           notify_url='https://sms.example.com/webhooks/delivery-reports')
+        client.session.post = MagicMock(side_effect=fake_send_post)
+        
+        client.send_sms('+254700000000', 'Test message', callback_data='campaign-7')
+        
+        message = client.session.post.call_args.kwargs['json']['messages'][0]
+        assert message['notifyUrl'] == 'https://sms.example.com/webhooks/delivery-reports'
+        assert message['callbackData'] == 'campaign-7'
+    
+    def test_ingestor_batches_reports(self, tmp_path):
+        """Test the ingestor writes queued reports in batches"""
+        store = DeliveryReportStore(str(tmp_path / 'reports.db'))
+        ingestor = ReportIngestor(store, batch_size=100, flush_interval=0.05)
+        reports = [{'messageId': f'm-{i}', 'bulkId': 'b-1', 'to': f'+2547{i:08d}',
+                    'status': {'groupName': 'DELIVERED', 'name': 'DELIVERED_TO_HANDSET'}}
+                   for i in range(250)]
+        
+        assert ingestor.submit(reports) is True
+        ingestor.flush()
+        
+        assert store.count() == 250
+        assert ingestor.stats['batches'] <= 10
+        assert store.get('m-3')['to'] == '+254700000003'
+        
+        # Later reports for the same message replace earlier ones
+        ingestor.submit([{'messageId': 'm-3', 'status': {'groupName': 'UNDELIVERABLE'}}])
+        ingestor.stop()
+        assert store.count() == 250
+        assert store.get('m-3')['status']['groupName'] == 'UNDELIVERABLE'
+    
+    def test_ingestor_retries_failed_writes(self, tmp_path):
+        """Test a batch whose write fails is retried, then dropped if it keeps failing"""
+        import sqlite3
+        store = DeliveryReportStore(str(tmp_path / 'reports.db'))
+        upsert_many = store.upsert_many
+        failures = iter([sqlite3.OperationalError('database is locked')] * 2)
+        
+        def flaky(reports):
+            error = next(failures, None)
+            if error is not None:
+                raise error
+            return upsert_many(reports)
+        
+        store.upsert_many = MagicMock(side_effect=flaky)
+        ingestor = ReportIngestor(store, flush_interval=0.05, retry_delay=0.01)
+        ingestor.submit([{'messageId': 'm-1', 'status': {'groupName': 'DELIVERED'}}])
+        ingestor.flush()
+        
+        assert store.count() == 1
+        assert store.upsert_many.call_count == 3
+        assert (ingestor.stats['write_retries'], ingestor.stats['dropped']) == (2, 0)
+        
+        store.upsert_many = MagicMock(side_effect=sqlite3.OperationalError('disk I/O error'))
+        ingestor.submit([{'messageId': 'm-2', 'status': {'groupName': 'DELIVERED'}}])
+        ingestor.stop()
+        
+        assert store.upsert_many.call_count == 5
+        assert ingestor.stats['dropped'] == 1
+        assert store.count() == 1
+    
+    def test_ingestor_survives_bad_reports(self, tmp_path):
+        """Test malformed reports are skipped and do not stop the writer thread"""
+        store = DeliveryReportStore(str(tmp_path / 'reports.db'))
+        ingestor = ReportIngestor(store, flush_interval=0.05)
+        ingestor.submit([1, 'x', {'messageId': 5}, {'messageId': 'm-1', 'status': 'bad'},
+                         {'messageId': 'm-2', 'status': {'groupName': 'DELIVERED'}}])
+        ingestor.flush()
+        assert store.count() == 1 and store.get('m-2') is not None
+        
+        # An unexpected error drops only its own batch
+        upsert_many = store.upsert_many
+        store.upsert_many = MagicMock(side_effect=TypeError('boom'))
+        ingestor.submit([{'messageId': 'm-3'}])
+        ingestor.flush()
+        store.upsert_many = upsert_many
+        ingestor.submit([{'messageId': 'm-4'}])
+        ingestor.stop()
+        
+        assert ingestor.stats['dropped'] == 1
+        assert store.get('m-3') is None and store.get('m-4') is not None
+    
+    def test_webhook_endpoint(self, tmp_path):
+        """Test the webhook checks the token and hands reports to the ingestor"""
+        app.app.config['REPORTS_PATH'] = str(tmp_path / 'reports.db')
+        app.app.config['WEBHOOK_TOKEN'] = 'secret'
+        app._report_ingestor = None
+        app._report_store = None
+        payload = {'results': [{'messageId': 'm-1', 'bulkId': 'b-1', 'to': '+254700000000',
+                                'status': {'groupName': 'DELIVERED'}}]}
+        try:
+            with app.app.test_client() as client:
+                response = client.post('/webhooks/delivery-reports', json=payload)
+                assert response.status_code == 403
+                
+                response = client.post('/webhooks/delivery-reports?token=secret', json={})
+                assert response.status_code == 400
+                
+                # Malformed reports are refused before anything is queued
+                for results in ([1], [{'to': '+254700000000'}], [{'messageId': 7}],
+                                [{'messageId': 'm-2', 'status': 'DELIVERED'}]):
+                    response = client.post('/webhooks/delivery-reports?token=secret',
+                                           json={'results': results})
+                    assert response.status_code == 400
+                    assert 'results[0]' in response.get_json()['error']
+                
+                response = client.post('/webhooks/delivery-reports?token=secret', json=payload)
+                assert response.status_code == 202
+                assert response.get_json()['accepted'] == 1
+            
+            app._report_ingestor.flush()
+            assert app._report_ingestor.store.get('m-1')['bulkId'] == 'b-1'
+            assert app._report_ingestor.store.count() == 1
+            
+            # Without a token the webhook refuses every call
+            app.app.config['WEBHOOK_TOKEN'] = ''
+            with app.app.test_client() as client:
+                response = client.post('/webhooks/delivery-reports?token=', json=payload)
+                assert response.status_code == 403
+        finally:
+            app.app.config['WEBHOOK_TOKEN'] = ''
+            if app._report_ingestor:
+                app._report_ingestor.stop()
+            app._report_ingestor = None
+            app._report_store = None
+
+
+class TestReportStore:
+    """Test the local delivery report store and sync"""
+    
+    @staticmethod
+    def make_reports(count, start=0, bulk_id='b-1'):
+        statuses = ['DELIVERED', 'PENDING', 'UNDELIVERABLE']
+        return [{'messageId': f'm-{i}', 'bulkId': bulk_id, 'to': f'+2547{i % 10:08d}',
+                 'sentAt': f'2024-05-{1 + i % 28:02d}T10:00:00.000+0000',
+                 'status': {'groupName': statuses[i % 3], 'name': statuses[i % 3] + '_X'}}
+                for i in range(start, start + count)]
+    
+    def test_sync_pages_until_short_page(self, tmp_path):
+        """Test sync keeps fetching pages until Infobip runs out"""
+        store = DeliveryReportStore(str(tmp_path / 'reports.db'))
+        pages = [self.make_reports(1000), self.make_reports(1000, 1000), self.make_reports(20, 2000)]
+        client = MagicMock()
+        client.get_delivery_reports.side_effect = [{'results': page} for page in pages]
+        
+        totals = sync_reports(client, store)
+        
+        assert totals == {'pages': 3, 'fetched': 2020, 'written': 2020}
+        assert store.count() == 2020
+        assert store.get_state('last_sync') is not None
+        client.get_delivery_reports.assert_called_with(limit=1000)
+    
+    def test_query_filters(self, tmp_path):
+        """Test queries by bulk, recipient, status and time range"""
+        store = DeliveryReportStore(str(tmp_path / 'reports.db'))
+        store.upsert_many(self.make_reports(300) + self.make_reports(30, 300, bulk_id='b-2'))
+        
+        assert len(store.query(bulk_id='b-2', limit=1000)) == 30
+        by_phone = store.query(recipient='+254700000003', limit=1000)
+        assert by_phone and all(r['to'] == '+254700000003' for r in by_phone)
+        assert all(r['status']['groupName'] == 'PENDING' for r in store.query(status='pending'))
+        assert len(store.query(status='DELIVERED_X', limit=1000)) == 110
+        
+        may_2 = store.query(since=parse_timestamp('2024-05-02'),
+                            until=parse_timestamp('2024-05-03'), limit=1000)
+        assert {r['sentAt'][:10] for r in may_2} == {'2024-05-02'}
+        
+        newest_first = [parse_timestamp(r['sentAt']) for r in store.query(limit=1000)]
+        assert newest_first == sorted(newest_first, reverse=True)
+        assert store.status_counts('b-1') == {'DELIVERED': 100, 'PENDING': 100,
+                                              'UNDELIVERABLE': 100}
+        
+        plan = store._connect().execute(
+            "EXPLAIN QUERY PLAN SELECT raw FROM reports WHERE recipient = ? "
+            "ORDER BY sent_ts DESC", ('+254700000003',)).fetchall()
+        assert 'idx_reports_recipient' in ' '.join(row[-1] for row in plan)
+    
+    def test_keyset_pages(self, tmp_path):
+        """Test pages cover every report once, in order, in both directions"""
+        store = DeliveryReportStore(str(tmp_path / 'reports.db'))
+        # 28 distinct send times for 500 reports, so many rows tie on sent_ts
+        store.upsert_many(self.make_reports(500))
+        
+        for ascending in (False, True):
+            seen, cursor = [], None
+            while True:
+                page, cursor = store.page(limit=64, cursor=cursor, ascending=ascending,
+                                          status='DELIVERED')
+                seen.extend(page)
+                if cursor is None:
+                    break
+            ids = [r['messageId'] for r in seen]
+            assert len(ids) == len(set(ids)) == store.count(status='DELIVERED') == 167
+            times = [parse_timestamp(r['sentAt']) for r in seen]
+            assert times == sorted(times, reverse=not ascending)
+        
+        _, cursor = store.page(limit=10)
+        with pytest.raises(ValueError, match="sort order"):
+            store.page(limit=10, cursor=cursor, ascending=True)
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            store.page(cursor='not-a-cursor')
+    
+    def test_reports_endpoint_pages(self, tmp_path):
+        """Test /api/reports returns a cursor and the matching count"""
+        app.app.config['REPORTS_PATH'] = str(tmp_path / 'reports.db')
+        app._report_store = None
+        try:
+            app.get_report_store().upsert_many(self.make_reports(120))
+            with app.app.test_client() as client:
+                first = client.get('/api/reports?bulk_id=b-1&limit=100&sort=sent').get_json()
+                second = client.get('/api/reports?bulk_id=b-1&limit=100&sort=sent'
+                                    f"&cursor={first['next_cursor']}").get_json()
+                assert client.get('/api/reports?sort=status').status_code == 400
+            
+            assert first['matching'] == 120 and first['total'] == 100
+            assert second['total'] == 20 and second['next_cursor'] is None
+            assert 'matching' not in second
+            ids = {r['messageId'] for r in first['reports'] + second['reports']}
+            assert len(ids) == 120
+        finally:
+            app._report_store = None
+    
+    def test_reports_endpoint_is_local(self, tmp_path):
+        """Test /api/reports answers from the store without calling Infobip"""
+        app.app.config['REPORTS_PATH'] = str(tmp_path / 'reports.db')
+        app._report_store = None
+        try:
+            app.get_report_store().upsert_many(self.make_reports(60))
+            with patch.object(app.sms_client, 'get_delivery_reports') as upstream:
+                with app.app.test_client() as client:
+                    result = client.get('/api/reports?bulk_id=b-1&status=DELIVERED&limit=5').get_json()
+                    assert client.get('/api/reports?since=yesterday').status_code == 400
+                upstream.assert_not_called()
+            
+            assert result['success'] is True and result['total'] == 5
+            assert all(r['status']['groupName'] == 'DELIVERED' for r in result['reports'])
+            
+            with patch.object(app.sms_client, 'get_delivery_reports',
+                              return_value={'results': self.make_reports(3, 100)}):
+                with app.app.test_client() as client:
+                    synced = client.post('/api/reports/sync').get_json()
+            assert synced['written'] == 3
+            assert app.get_report_store().count() == 63
+        finally:
+            app._report_store = None
+
+
+class TestPhoneNormalization:
+    """Test E.164 canonicalization and deduplication"""
+    
+    def test_normalize_number(self):
+        """Test single number canonicalization and reject reasons"""
+        assert normalize_number('+254 700-000000') == ('+254700000000', None)
+        assert normalize_number('254700000000') == ('+254700000000', None)
+        assert normalize_number('00254 (700) 000000') == ('+254700000000', None)
+        assert normalize_number('0700000000', '254') == ('+254700000000', None)
+        assert normalize_number('0700000000', '+254') == ('+254700000000', None)
+        
+        assert normalize_number('0700000000') == (None, 'missing country code')
+        assert normalize_number('') == (None, 'empty')
+        assert normalize_number('abc123') == (None, 'invalid characters')
+        assert normalize_number('+0254700000000') == (None, 'invalid country code')
+        assert normalize_number('123') == (None, 'too short')
+        assert normalize_number('+1234567890123456') == (None, 'too long')
+    
+    def test_normalize_numbers_batch(self):
+        """Test batch normalization dedups formatting variants and explains rejects"""
+        numbers = ['+254 700-000000', '254700000000', '0700000000', '+1 (234) 567-8901',
+                   'not a number', '0711111111', '', '+254711111111']
+        result = normalize_numbers(numbers, default_country='254')
+        
+        assert result['numbers'] == ['+254700000000', '+12345678901', '+254711111111']
+        assert result['duplicates'] == 3
+        assert result['rejects'] == [('not a number', 'invalid characters'), ('', 'empty')]
+        
+        # The batch path agrees with the single-number path
+        for phone in numbers + ['+0254700000000', '000254700000000', '++254700000000']:
+            single, _ = normalize_number(phone, '254')
+            batch = normalize_numbers([phone], '254')['numbers']
+            assert batch == ([single] if single else [])
+        
+        # Inputs containing newlines still work
+        assert normalize_numbers(['+254700000000\n1'])['rejects'][0][1] == 'invalid characters'
+    
+    def test_non_ascii_digits_rejected(self):
+        """Test the batch path rejects non-ASCII digits like the single-number path"""
+        numbers = ['0０700000000', '+２５４700000000', '+254٧٠٠٠٠٠٠٠٠', '07۰۰۰۰۰۰۰۰',
+                   '+254७००००००००', '+254700000000']
+        result = normalize_numbers(numbers, default_country='254')
+        singles = [normalize_number(phone, '254') for phone in numbers]
+        assert result['numbers'] == [number for number, _ in singles if number]
+        assert result['rejects'] == [(phone, reason) for phone, (number, reason)
+                                     in zip(numbers, singles) if number is None]
+        assert result['numbers'] == ['+254700000000']
+        with pytest.raises(ValueError):
+            normalize_numbers(numbers, default_country='２５４')
+    
+    def test_client_uses_normalized_numbers(self):
+        """Test sends go to unique canonical numbers"""
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender',
+                           default_country='254')
+        client.session.post = MagicMock(side_effect=fake_send_post)
+        
+        result = client.send_bulk(['+254 700-000000', '254700000000', '0700000000',
+                                   '0711111111'], 'Test message')
+        
+        destinations = client.session.post.call_args.kwargs['json']['messages'][0]['destinations']
+        assert [d['to'] for d in destinations] == ['+254700000000', '+254711111111']
+        assert result['duplicates'] == 2
+        
+        with pytest.raises(ValueError, match="missing country code"):
+            SMSClient('k', 'https://test.api.infobip.com', 'S').send_sms('0700000000', 'Hi')
+
+
+class TestStreamingUpload:
+    """Test streaming contact file parsing"""
+    
+    @pytest.fixture
+    def client(self, tmp_path):
+        """Create test client"""
+        app.app.config['TESTING'] = True
+        app.app.config['CONTACTS_PATH'] = str(tmp_path / 'contacts')
+        app._contact_store = None
+        with app.app.test_client() as client:
+            yield client
+        app._contact_store = None
+    
+    def test_reader_columns_and_gzip(self):
+        """Test CSV column selection by index and header, and gzip input"""
+        content = b'name,phone\n# comment\nJohn,+254700000000\n\n"Doe, Jane",+254711111111\n'
+        assert list(read_phone_numbers(BytesIO(content), 'phone')) == ['+254700000000',
+                                                                       '+254711111111']
+        assert list(read_phone_numbers(BytesIO(gzip.compress(content)), 1))[1:] == [
+            '+254700000000', '+254711111111']
+        with pytest.raises(ValueError, match="not found"):
+            list(read_phone_numbers(BytesIO(content), 'mobile'))
+        with pytest.raises(UploadTooLarge):
+            list(read_phone_numbers(BytesIO(gzip.compress(b'1' * 10000)), max_bytes=1000))
+    
+    def test_gzip_limit_counts_flushed_bytes(self):
+        """Test output held back until the final flush still counts toward the limit"""
+        from sms_contacts import UploadTooLarge, iter_decompressed
+        data = gzip.compress(b'1' * 10000)
+        assert b''.join(iter_decompressed([data], max_bytes=10000)) == b'1' * 10000
+        
+        decompressor = MagicMock()
+        decompressor.decompress.return_value = b''
+        decompressor.flush.return_value = b'1' * 2000
+        with patch('sms_contacts.zlib.decompressobj', return_value=decompressor):
+            with pytest.raises(UploadTooLarge):
+                list(iter_decompressed([data], max_bytes=1000))
+    
+    def test_lines_split_across_chunks(self):
+        """Test lines and multi-byte characters spanning chunk boundaries"""
+        data = 'é1\r\n22\n333'.encode('utf-8')
+        chunks = [data[i:i + 1] for i in range(len(data))]
+        assert list(iter_lines(chunks)) == ['é1', '22', '333']
+    
+    def test_normalize_stream_dedups_across_batches(self):
+        """Test duplicates are removed across batch boundaries"""
+        numbers = ['+254700000000', 'bad', '254700000000', '+254711111111', '0700000000']
+        result = normalize_stream(iter(numbers), '254', batch_size=2, max_rejects=0)
+        assert result['numbers'] == ['+254700000000', '+254711111111']
+        assert result['duplicates'] == 2
+        assert result['rejected'] == 1
+        assert result['rejects'] == []
+    
+    def test_upload_gzip_csv_column(self, client):
+        """Test a gzipped CSV upload with a named phone column"""
+        content = b'name,phone\nJohn,+254700000000\nJane,+254 711 111111\nJohn,254700000000\n'
+        data = {'file': (BytesIO(gzip.compress(content)), 'contacts.csv.gz')}
+        with patch('tempfile.NamedTemporaryFile') as temp_file:
+            response = client.post('/api/upload-phones?column=phone', data=data)
+            temp_file.assert_not_called()
+        
+        assert response.status_code == 200
+        result = response.get_json()
+        assert result['preview'] == ['+254700000000', '+254711111111']
+        assert result['duplicates'] == 1
+    
+    def test_send_to_uploaded_list(self, client):
+        """Test uploads are stored server-side and sent by list_id"""
+        numbers = ''.join(f'+2547{i:08d}\n' for i in range(250)).encode()
+        data = {'file': (BytesIO(numbers), 'phones.txt')}
+        result = client.post('/api/upload-phones', data=data).get_json()
+        
+        assert result['count'] == 250
+        assert 'phone_numbers' not in result
+        assert result['preview'] == [f'+2547{i:08d}' for i in range(5)]
+        
+        with patch.object(app.sms_client.session, 'post', side_effect=fake_send_post) as post:
+            response = client.post('/api/send-sms', json={'list_id': result['list_id'],
+                                                          'message': 'Test message'})
+        assert response.status_code == 200
+        assert response.get_json()['total_sent'] == 250
+        sent = [d['to'] for call in post.call_args_list
+                for d in call.kwargs['json']['messages'][0]['destinations']]
+        assert sorted(sent) == [f'+2547{i:08d}' for i in range(250)]
+        
+        info = client.get(f"/api/contact-lists/{result['list_id']}").get_json()
+        assert info['count'] == 250 and info['filename'] == 'phones.txt'
+        assert client.delete(f"/api/contact-lists/{result['list_id']}").status_code == 200
+        response = client.post('/api/send-sms', json={'list_id': result['list_id'],
+                                                      'message': 'Test message'})
+        assert response.status_code == 404
+        assert client.get('/api/contact-lists/not-a-list').status_code == 404
+    
+    def test_contact_list_store(self, tmp_path):
+        """Test lists round-trip through the packed on-disk format"""
+        store = ContactListStore(str(tmp_path))
+        numbers = ['+12345678901', '+254700000000', '+999999999999999']
+        info = store.create(numbers, duplicates=1)
+        
+        assert store.numbers(info['list_id']) == numbers
+        assert store.preview(info['list_id'], 2) == numbers[:2]
+        assert os.path.getsize(tmp_path / f"{info['list_id']}.bin") == 8 * len(numbers)
+        assert store.info(info['list_id'])['duplicates'] == 1
+        
+        assert store.purge(older_than=-1) == 1
+        with pytest.raises(KeyError):
+            store.numbers(info['list_id'])
+    
+    def test_expired_lists_removed_on_create(self, tmp_path):
+        """Test creating a list removes lists past the retention period"""
+        store = ContactListStore(str(tmp_path), retention=3600)
+        old = store.create(['+254700000000'])
+        kept = store.create(['+254700000001'])
+        meta = tmp_path / f"{old['list_id']}.json"
+        meta.write_text(json.dumps(dict(old, created_at=time.time() - 7200)))
+        
+        store._next_purge = 0
+        new = store.create(['+254700000002'])
+        assert store.info(old['list_id']) is None
+        assert not (tmp_path / f"{old['list_id']}.bin").exists()
+        assert store.info(kept['list_id']) and store.info(new['list_id'])
+        
+        # Without a retention period lists stay until deleted
+        meta = tmp_path / f"{kept['list_id']}.json"
+        meta.write_text(json.dumps(dict(kept, created_at=0)))
+        ContactListStore(str(tmp_path), retention=0).create(['+254700000003'])
+        assert store.info(kept['list_id']) is not None
+    
+    def test_upload_limits(self, client):
+        """Test the streaming size limit applies to decompressed content"""
+        data = {'file': (BytesIO(gzip.compress(b'+254700000000\n' * 1000)), 'phones.txt.gz')}
+        with patch.dict(app.app.config, {'MAX_UPLOAD_BYTES': 1000}):
+            response = client.post('/api/upload-phones', data=data)
+        assert response.status_code == 413
+        
+        data = {'file': (BytesIO(b'+254700000000\n'), 'phones.exe')}
+        assert client.post('/api/upload-phones', data=data).status_code == 400
+        
+        data = {'file': (BytesIO(b'a,b\n'), 'phones.csv')}
+        response = client.post('/api/upload-phones?column=phone', data=data)
+        assert response.status_code == 400
+
+
+class TestBalanceCache:
+    """Test the shared balance cache"""
+    
+    def test_shared_between_instances(self, tmp_path):
+        """Test a value fetched by one process is served to another"""
+        path = str(tmp_path / 'cache.db')
+        fetch = MagicMock(return_value={'balance': 12.5, 'currency': 'EUR'})
+        
+        first = SharedTTLCache(path, ttl=60).get('balance', fetch)
+        second = SharedTTLCache(path, ttl=60).get('balance', fetch)
+        
+        assert fetch.call_count == 1
+        assert first['cached'] is False
+        assert second['cached'] is True and second['stale'] is False
+        assert second['value'] == {'balance': 12.5, 'currency': 'EUR'}
+        assert second['age'] >= 0
+    
+    def test_stale_while_revalidate(self, tmp_path):
+        """Test expired values are served stale and refreshed once in the background"""
+        cache = SharedTTLCache(str(tmp_path / 'cache.db'), ttl=0.5, stale_ttl=60)
+        cache.get('balance', lambda: {'balance': 1})
+        time.sleep(0.6)
+        
+        refreshed = []
+        def fetch():
+            refreshed.append(True)
+            return {'balance': 2}
+        
+        entry = cache.get('balance', fetch)
+        # Another process sees the stale or refreshed value but does not refetch
+        again = SharedTTLCache(cache.path, ttl=0.5, stale_ttl=60).get('balance', fetch)
+        assert entry['stale'] is True and entry['value'] == {'balance': 1}
+        assert again['cached'] is True
+        
+        deadline = time.time() + 5
+        while cache.stats['refreshes'] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        assert refreshed == [True]
+        assert cache.get('balance', fetch)['value'] == {'balance': 2}
+    
+    def test_permission_errors_are_cached(self, tmp_path):
+        """Test a 403 is cached while other errors propagate"""
+        cache = SharedTTLCache(str(tmp_path / 'cache.db'))
+        fetch = MagicMock(side_effect=SMSAPIError('No permission', status_code=403))
+        is_permanent = lambda e: getattr(e, 'status_code', None) if isinstance(e, SMSAPIError) else None
+        
+        assert cache.get('balance', fetch, is_permanent)['status_code'] == 403
+        entry = cache.get('balance', fetch, is_permanent)
+        assert fetch.call_count == 1
+        assert entry['error'] == 'No permission' and entry['cached'] is True
+        
+        with pytest.raises(requests.RequestException):
+            cache.get('other', MagicMock(side_effect=requests.RequestException('down')),
+                      is_permanent)
+    
+    def test_balance_endpoint_reports_age(self, tmp_path):
+        """Test /api/balance answers from the cache and says how old it is"""
+        app.app.config['CACHE_PATH'] = str(tmp_path / 'cache.db')
+        app._balance_cache = None
+        try:
+            with patch.object(app.sms_client, 'check_account_balance',
+                              return_value={'balance': 3.2, 'currency': 'USD'}) as check:
+                with app.app.test_client() as client:
+                    first = client.get('/api/balance').get_json()
+                    second = client.get('/api/balance').get_json()
+            
+            assert check.call_count == 1
+            assert first['success'] is True and first['cached'] is False
+            assert second['cached'] is True and second['balance']['balance'] == 3.2
+            assert 'age' in second and second['stale'] is False
+        finally:
+            app._balance_cache = None
+
+
+class TestSegmentCalculator:
+    """Test GSM-7/UCS-2 segment counting"""
+    
+    def test_gsm7_segments(self):
+        """Test GSM-7 single and concatenated messages"""
+        assert segment_text('a' * 160)['segments'] == 1
+        info = segment_text('a' * 161)
+        assert info['encoding'] == 'GSM-7'
+        assert info['segments'] == 2
+        assert info['per_segment'] == 153
+        assert [len(p) for p in info['parts']] == [153, 8]
+        assert segment_text('a' * 306)['segments'] == 2
+        assert segment_text('a' * 307)['segments'] == 3
+    
+    def test_gsm7_extension_characters(self):
+        """Test extension characters cost two septets and are never split"""
+        info = segment_text('€' * 80)
+        assert info['encoding'] == 'GSM-7'
+        assert info['units'] == 160
+        assert info['segments'] == 1
+        
+        info = segment_text('a' * 152 + '{' + 'b' * 10)
+        assert info['units'] == 164
+        assert info['parts'][0] == 'a' * 152
+        assert info['parts'][1] == '{' + 'b' * 10
+    
+    def test_ucs2_segments(self):
+        """Test Unicode text and surrogate pairs"""
+        info = segment_text('Hello Zoë ✓')
+        assert info['encoding'] == 'UCS-2'
+        assert info['segments'] == 1
+        
+        assert segment_text('ж' * 70)['segments'] == 1
+        assert segment_text('ж' * 71)['segments'] == 2
+        
+        info = segment_text('a' * 66 + '😀' + 'b')
+        assert info['units'] == 69
+        assert info['segments'] == 1
+        info = segment_text('a' * 66 + '😀' + 'b' * 4)
+        assert info['parts'][0] == 'a' * 66
+        assert info['parts'][1].startswith('😀')
+    
+    def test_estimate_and_cache(self):
+        """Test campaign estimates and template caching"""
+        estimate = estimate_campaign('ж' * 100, 1000, price_per_segment=0.01)
+        assert estimate['segments_per_message'] == 2
+        assert estimate['total_segments'] == 2000
+        assert estimate['estimated_cost'] == 20.0
+        
+        parts = segment_text('cached template')['parts']
+        parts.append('mutated')
+        assert segment_text('cached template')['parts'] == ['cached template']
+    
+    def test_api_estimate(self):
+        """Test the estimate endpoint dedups numbers and never sends"""
+        with app.app.test_client() as client:
+            with patch.object(app.sms_client.session, 'post') as post:
+                response = client.post('/api/estimate', json={
+                    'message': 'a' * 200,
+                    'phone_numbers': ['+254700000000', '+254 700 000000', '+254711111111']
+                })
+                assert post.call_count == 0
+            estimate = response.get_json()['estimate']
+            assert estimate['recipients'] == 2
+            assert estimate['total_segments'] == 4
+            
+            assert client.post('/api/estimate', json={}).status_code == 400
+
+
+class TestResponseWriter:
+    """Test streaming result output"""
+    
+    @staticmethod
+    def make_response(count):
+        return {'bulkId': 'b-1', 'messages': [
+            {'to': f'+2547{i:08d}', 'messageId': f'm-{i}', 'smsCount': 1,
+             'status': {'groupName': 'PENDING' if i % 4 else 'REJECTED', 'description': 'd'}}
+            for i in range(count)]}
+    
+    def test_format_response_large_batch(self):
+        """Test the text format stays linear for very large batches"""
+        start = time.time()
+        text = format_response(self.make_response(200000), show_details=True)
+        assert time.time() - start < 5
+        assert text.count('\n✅ Message') == 150000
+        assert '❌ Failed: 50000' in text and '📦 Bulk ID: b-1' in text
+    
+    def test_machine_formats(self):
+        """Test ndjson and csv write one line per message plus failures"""
+        out = StringIO()
+        writer = ResponseWriter(out, 'ndjson')
+        writer.start(3)
+        writer.write_response(self.make_response(2))
+        writer.write_chunk({'error': 'HTTP 500', 'recipients': ['+254711111111'], 'response': None})
+        totals = writer.close()
+        
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert [line['status'] for line in lines] == ['REJECTED', 'PENDING', 'FAILED']
+        assert lines[1]['bulkId'] == 'b-1' and lines[2]['error'] == 'HTTP 500'
+        assert totals == {'count': 3, 'successful': 1, 'failed': 2,
+                          'statuses': {'REJECTED': 1, 'PENDING': 1, 'FAILED': 1}}
+        
+        out = StringIO()
+        writer = ResponseWriter(out, 'csv')
+        writer.start()
+        writer.write_response(self.make_response(2))
+        writer.close()
+        rows = out.getvalue().splitlines()
+        assert rows[0].startswith('to,status,') and len(rows) == 3
+    
+    def test_send_bulk_streams_chunks(self):
+        """Test send_bulk reports each batch, in order, before returning"""
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender', max_workers=4)
+        client.session.post = MagicMock(side_effect=fake_send_post)
+        out = StringIO()
+        writer = ResponseWriter(out, 'ndjson')
+        
+        phones = [f'+2547{i:08d}' for i in range(250)]
+        client.send_bulk(phones, 'Test message', on_chunk=writer.write_chunk)
+        
+        assert [json.loads(line)['to'] for line in out.getvalue().splitlines()] == phones
 
 
 class TestUtilityFunctions:
@@ -202,10 +1442,12 @@ class TestUtilityFunctions:
         assert app.allowed_file('test.csv') is True
         assert app.allowed_file('test.TXT') is True
         assert app.allowed_file('test.CSV') is True
+        assert app.allowed_file('test.csv.gz') is True
         
         assert app.allowed_file('test.exe') is False
         assert app.allowed_file('test.jpg') is False
         assert app.allowed_file('test') is False
+        assert app.allowed_file('test.gz') is False
     
     def test_parse_phone_numbers_from_file(self):
         """Test phone number parsing from file"""
@@ -247,3 +1489,1061 @@ class TestUtilityFunctions:
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
 
+
+
+class TestMetrics:
+    """Test Prometheus instrumentation and exposition"""
+    
+    @pytest.fixture
+    def client(self):
+        """Create test client"""
+        app.app.config['TESTING'] = True
+        with app.app.test_client() as client:
+            yield client
+    
+    def test_client_records_attempts_and_statuses(self):
+        """Test upstream attempts, batch sizes and status groups are recorded"""
+        metrics = ClientMetrics(Registry())
+        client = SMSClient('key', 'https://api.example.com', 'Sender', metrics=metrics,
+                           retry_policy=RetryPolicy(max_attempts=1))
+        client.session.post = MagicMock(side_effect=fake_send_post)
+        client.send_sms(['+254711111111', '+254722222222'], 'Hi')
+        
+        error = requests.exceptions.HTTPError('503 Server Error')
+        error.response = MagicMock(status_code=503, headers={})
+        client.session.get = MagicMock(side_effect=error)
+        with pytest.raises(SMSAPIError):
+            client.get_delivery_reports()
+        
+        assert metrics.latency.count('send', '2xx') == 1
+        assert metrics.latency.count('reports', '5xx') == 1
+        assert metrics.messages.value('PENDING') == 2
+        assert metrics.batch_size.count() == 1
+    
+    def test_render_text_format(self):
+        """Test histograms render cumulative buckets, sum and count"""
+        registry = Registry()
+        histogram = registry.histogram('latency_seconds', 'Latency', ('endpoint',), (0.1, 1.0))
+        histogram.observe(0.05, 'send')
+        histogram.observe(0.5, 'send')
+        registry.counter('sent_total', 'Sent', ('group',)).inc('PENDING', amount=3)
+        
+        text = registry.render()
+        assert '# TYPE latency_seconds histogram' in text
+        assert 'latency_seconds_bucket{endpoint="send",le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{endpoint="send",le="+Inf"} 2' in text
+        assert 'latency_seconds_count{endpoint="send"} 2' in text
+        assert 'sent_total{group="PENDING"} 3' in text
+        with pytest.raises(ValueError):
+            histogram.observe(0.1)
+    
+    def test_snapshot_directory_sums_workers(self, tmp_path):
+        """Test a scrape reports the totals of every worker's snapshot"""
+        registry = Registry()
+        registry.counter('sent_total', 'Sent').inc(amount=2)
+        (tmp_path / '1.json').write_text(json.dumps(registry.snapshot()))
+        
+        snapshots = SnapshotDirectory(registry, str(tmp_path)).collect()
+        assert 'sent_total 4' in registry.render(snapshots)
+    
+    def test_metrics_endpoint_negotiates_format(self, client):
+        """Test scrapers get the text format with request timings"""
+        client.get('/health')
+        response = client.get('/metrics', headers={
+            'Accept': 'application/openmetrics-text;version=1.0.0,text/plain;version=0.0.4;q=0.5'})
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain')
+        text = response.get_data(as_text=True)
+        assert 'sms_http_request_duration_seconds_count{route="/health",method="GET",status="200"}' in text
+        assert 'sms_retry_budget_tokens' in text
+        
+        assert client.get('/metrics?format=prometheus').content_type.startswith('text/plain')
+        assert client.get('/metrics').is_json
+
+
+class TestTracing:
+    """Test request lifecycle spans"""
+    
+    @pytest.fixture
+    def server(self):
+        """Local HTTP/1.1 server answering every GET with a small JSON body"""
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def do_GET(self):
+                body = b'{"balance": 10.5, "currency": "KES"}'
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        yield f'http://127.0.0.1:{httpd.server_port}'
+        httpd.shutdown()
+        httpd.server_close()
+    
+    def test_connection_phases(self, server):
+        """Test a new connection is timed and then reused"""
+        spans = []
+        breakdown = PhaseBreakdown()
+        client = SMSClient('key', server, 'Sender', hooks=[spans.append, breakdown])
+        client.check_account_balance()
+        client.check_account_balance()
+        client.close()
+        
+        first = [span['name'] for span in spans if span['trace_id'] == spans[0]['trace_id']]
+        assert first == ['prepare', 'acquire', 'connect', 'ttfb', 'read', 'parse', 'attempt']
+        acquires = [span['attributes']['reused'] for span in spans if span['name'] == 'acquire']
+        assert acquires == [False, True]
+        attempt = spans[len(first) - 1]
+        assert attempt['parent_id'] is None
+        assert attempt['attributes'] == {'endpoint': 'balance', 'attempt': 1, 'outcome': '2xx'}
+        
+        assert breakdown.attempts == 2 and breakdown.reused_connections == 1
+        phases = [row['phase'] for row in breakdown.summary()]
+        assert phases == ['prepare', 'acquire', 'connect', 'ttfb', 'read', 'parse']
+        assert 'connect' in breakdown.format()
+    
+    def test_send_spans_exported(self, tmp_path):
+        """Test send spans share a trace and are written as JSON lines"""
+        path = str(tmp_path / 'spans.jsonl')
+        exporter = FileSpanExporter(path)
+        client = SMSClient('key', 'https://api.example.com', 'Sender', hooks=[exporter])
+        client.session.post = MagicMock(side_effect=fake_send_post)
+        client.send_sms('+254711111111', 'Hi')
+        exporter.close()
+        
+        with open(path) as f:
+            spans = [json.loads(line) for line in f]
+        assert [span['name'] for span in spans] == ['build', 'parse', 'attempt', 'send']
+        assert len({span['trace_id'] for span in spans}) == 1
+        assert spans[0]['attributes'] == {'recipients': 1}
+    
+    def test_no_hooks_records_nothing(self):
+        """Test a client without hooks opens no trace"""
+        import sms_trace
+        client = SMSClient('key', 'https://api.example.com', 'Sender')
+        with client.tracer.span('send') as attributes:
+            assert sms_trace._active() is None
+        assert attributes == {}
+
+
+class TestBenchmarks:
+    """Test the benchmark suite keeps working as the code changes"""
+    
+    def test_cases_run(self, monkeypatch):
+        """Test every benchmark case runs at a tiny size"""
+        import importlib.util
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'run.py')
+        spec = importlib.util.spec_from_file_location('bench_run', path)
+        bench = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(bench)
+        monkeypatch.setattr(bench, 'MIN_TIME', 0)
+        
+        results = bench.run_suite(list(bench.CASES), [50], repeat=1, report=lambda line: None)
+        assert set(results) == set(bench.CASES)
+        assert all(by_size['50'] > 0 for by_size in results.values())
+        
+        slower = {'calibration': 1.0, 'results': {'format_response': {'50': 2.0}}}
+        baseline = {'calibration': 1.0, 'results': {'format_response': {'50': 1.0}}}
+        assert len(bench.compare(slower, baseline, 0.25)) == 1
+        baseline['calibration'] = 0.5  # baseline machine was twice as fast
+        assert bench.compare(slower, baseline, 0.25) == []
+
+
+class TestEmulator:
+    """Test the local Infobip API emulator and the load test harness"""
+    
+    def run(self, emulator, scenario):
+        async def runner():
+            async with TestServer(emulator.make_app()) as server:
+                await scenario(str(server.make_url('')).rstrip('/'))
+        asyncio.run(runner())
+    
+    def test_send_reports_and_balance(self):
+        """Test accepted messages get one report each and are charged"""
+        emulator = InfobipEmulator(latency='fixed:0', report_delay='fixed:0',
+                                   outcomes='DELIVERED=1', balance=10, price=0.5, seed=1)
+        
+        async def scenario(base_url):
+            async with AsyncSMSClient('key', base_url, 'Sender') as client:
+                sent = await client.send_sms(['+254700000001', '+254700000002'], 'Hello')
+                assert [m['status']['groupName'] for m in sent['messages']] == ['PENDING'] * 2
+                
+                reports = await client.get_delivery_reports(bulk_id=sent['bulkId'], limit=10)
+                assert {r['messageId'] for r in reports['results']} == \
+                    {m['messageId'] for m in sent['messages']}
+                assert reports['results'][0]['status']['groupName'] == 'DELIVERED'
+                again = await client.get_delivery_reports(limit=10)
+                assert again['results'] == []
+                
+                balance = await client.check_account_balance()
+                assert balance['balance'] == 9.0
+        self.run(emulator, scenario)
+    
+    def test_fault_injection(self):
+        """Test injected 429s carry Retry-After and bad keys are refused"""
+        emulator = InfobipEmulator(latency='fixed:0', throttle_rate=1.0, retry_after=7,
+                                   api_key='secret')
+        
+        async def scenario(base_url):
+            import aiohttp
+            async with aiohttp.ClientSession() as session:
+                url = f'{base_url}/account/1/balance'
+                async with session.get(url, headers={'Authorization': 'App wrong'}) as response:
+                    assert response.status == 401
+                async with session.get(url, headers={'Authorization': 'App secret'}) as response:
+                    assert response.status == 429
+                    assert response.headers['Retry-After'] == '7'
+            assert emulator.stats['throttled'] == 1 and emulator.stats['unauthorized'] == 1
+        self.run(emulator, scenario)
+    
+    def test_distributions(self):
+        """Test latency specs are parsed in milliseconds"""
+        import random
+        rng = random.Random(0)
+        assert parse_distribution('fixed:40')(rng) == 0.04
+        assert parse_distribution('25')(rng) == 0.025
+        assert 0.01 <= parse_distribution('uniform:10,20')(rng) <= 0.02
+        assert parse_distribution('lognormal:40,0')(rng) == pytest.approx(0.04)
+        with pytest.raises(ValueError):
+            parse_distribution('gamma:1,2')
+        with pytest.raises(ValueError):
+            parse_distribution('uniform:10')
+    
+    def test_load_summary(self):
+        """Test the load harness's percentiles and saturation check"""
+        import importlib.util
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks',
+                            'load_test.py')
+        spec = importlib.util.spec_from_file_location('load_test', path)
+        load_test = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(load_test)
+        
+        results = [{'ok': True, 'messages': 2, 'latency': i / 100} for i in range(1, 101)]
+        results.append({'ok': False, 'messages': 0, 'latency': 5.0})
+        step = load_test.summarize(50, results, 2.0)
+        assert (step['p50'], step['p95'], step['p99']) == (0.5, 0.95, 0.99)
+        assert step['rps'] == 50 and step['mps'] == 100 and step['errors'] == 1
+        assert load_test.saturated(step, slo_p99=1.0, max_error_rate=0.05) is None
+        assert 'p99' in load_test.saturated(step, slo_p99=0.5, max_error_rate=0.05)
+        assert 'errors' in load_test.saturated(step, slo_p99=1.0, max_error_rate=0.001)
+
+
+class TestSendJobs:
+    """Test background send jobs and their progress stream"""
+    
+    @pytest.fixture
+    def client(self, tmp_path):
+        app.app.config['JOBS_PATH'] = str(tmp_path / 'jobs.db')
+        app.app.config['JOB_STREAM_TIMEOUT'] = 5
+        app._job_store = None
+        app._job_runner = None
+        original_post = app.sms_client.session.post
+        app.sms_client.session.post = MagicMock(side_effect=fake_send_post)
+        try:
+            with app.app.test_client() as client:
+                yield client
+        finally:
+            if app._job_runner is not None:
+                app._job_runner.shutdown()
+            app.sms_client.session.post = original_post
+            app._job_store = None
+            app._job_runner = None
+    
+    def test_job_runs_in_background(self, client):
+        """Test a job is accepted at once and its progress streamed"""
+        phones = [f'+2547{i:08d}' for i in range(250)] + ['+254700000000']
+        response = client.post('/api/jobs', json={'phone_numbers': phones,
+                                                  'message': 'Test message'})
+        assert response.status_code == 202
+        submitted = response.get_json()
+        assert submitted['job']['total'] == 250 and submitted['job']['duplicates'] == 1
+        
+        app._job_runner.shutdown()
+        job = client.get(submitted['status_url']).get_json()['job']
+        assert (job['status'], job['sent'], job['failed'], job['remaining']) == ('done', 250, 0, 0)
+        assert len(job['bulk_ids']) == 3
+        
+        body = client.get(submitted['events_url']).get_data(as_text=True)
+        events = [block for block in body.split('\n\n') if block.startswith('id:')]
+        assert len(events) == 1 and 'event: done' in events[0]
+        assert json.loads(events[0].split('data: ', 1)[1])['sent'] == 250
+    
+    def test_failed_job(self, client):
+        """Test a job whose batches all fail is reported failed"""
+        app.sms_client.session.post.side_effect = requests.exceptions.HTTPError('400 Bad Request')
+        response = client.post('/api/jobs', json={'phone_numbers': ['+254700000001'],
+                                                  'message': 'Test message'})
+        job_id = response.get_json()['job']['job_id']
+        app._job_runner.shutdown()
+        
+        job = client.get(f'/api/jobs/{job_id}').get_json()['job']
+        assert (job['status'], job['sent'], job['failed']) == ('failed', 0, 1)
+        assert '400' in job['error']
+    
+    def test_rejected_submissions(self, client):
+        """Test invalid jobs are refused before anything runs"""
+        response = client.post('/api/jobs', json={'phone_numbers': ['invalid'],
+                                                  'message': 'Test message'})
+        assert response.status_code == 400
+        assert client.post('/api/jobs', json={'message': 'Test message'}).status_code == 400
+        assert client.get('/api/jobs/unknown').status_code == 404
+        assert client.get('/api/jobs/unknown/events').status_code == 404
+    
+    def test_watch_resumes(self, tmp_path):
+        """Test a reconnecting stream skips states the client has seen"""
+        from sms_jobs import JobStore
+        store = JobStore(str(tmp_path / 'jobs.db'))
+        job_id = store.create(10)
+        store.progress(job_id, 4, 1, 'bulk-1')
+        
+        seen = list(store.watch(job_id, timeout=0))
+        assert [job['sent'] for job in seen] == [4]
+        assert list(store.watch(job_id, seen[-1]['version'], timeout=0)) == []
+        
+        store.finish(job_id)
+        final = list(store.watch(job_id, seen[-1]['version'], timeout=0))
+        assert final[0]['status'] == 'done' and final[0]['failed'] == 6
+    
+    def test_suppressed_recipients_skipped(self, tmp_path):
+        """Test recipients suppressed by the dedup window are skipped, not failed"""
+        from sms_jobs import JobStore, SendJobRunner
+        store = JobStore(str(tmp_path / 'jobs.db'))
+        sms = MagicMock()
+        sms._normalize_recipients.return_value = (['+254700000001', '+254700000002'], 0)
+        
+        def send_bulk(to, text, on_chunk, **kwargs):
+            on_chunk({'recipients': ['+254700000002'], 'error': None,
+                      'response': {'bulkId': 'bulk-1', 'messages': [
+                          {'to': '+254700000002', 'status': {'groupName': 'PENDING'}}]}})
+            return {'suppressed': ['+254700000001']}
+        
+        sms.send_bulk.side_effect = send_bulk
+        runner = SendJobRunner(sms, store)
+        job_id = runner.submit(['+254700000001', '+254700000002'], 'Test message')['job_id']
+        runner.shutdown()
+        
+        job = store.get(job_id)
+        assert (job['status'], job['sent'], job['failed'], job['skipped'],
+                job['remaining']) == ('done', 1, 0, 1, 0)
+    
+    def test_jobs_table_migrated(self, tmp_path):
+        """Test a job table created before skipped existed gains the column"""
+        import sqlite3
+        from sms_jobs import JobStore
+        path = str(tmp_path / 'jobs.db')
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL DEFAULT "
+                     "'queued', total INTEGER NOT NULL, sent INTEGER NOT NULL DEFAULT 0, "
+                     "failed INTEGER NOT NULL DEFAULT 0, duplicates INTEGER NOT NULL DEFAULT 0, "
+                     "bulk_ids TEXT NOT NULL DEFAULT '[]', error TEXT, version INTEGER NOT NULL "
+                     "DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+                     "finished_at REAL)")
+        conn.commit()
+        conn.close()
+        
+        store = JobStore(path)
+        job_id = store.create(3)
+        store.progress(job_id, 1, 0, skipped=1)
+        store.finish(job_id)
+        job = store.get(job_id)
+        assert (job['sent'], job['failed'], job['skipped']) == (1, 1, 1)
+    
+    def test_orphaned_jobs_fail(self, tmp_path):
+        """Test running jobs of a dead worker are failed when the store opens"""
+        from sms_jobs import JobStore
+        path = str(tmp_path / 'jobs.db')
+        store = JobStore(path)
+        orphan, active = store.create(10), store.create(10)
+        store.start(orphan)
+        store.progress(orphan, 3, 0)
+        store.start(active)
+        store._connect().execute("UPDATE jobs SET updated_at = updated_at - 3600 WHERE id = ?",
+                                 (orphan,))
+        
+        JobStore(path)
+        job = store.get(orphan)
+        assert (job['status'], job['sent'], job['failed']) == ('failed', 3, 7)
+        assert 'Interrupted' in job['error']
+        assert store.get(active)['status'] == 'running'
+    
+    def test_submit_failure_releases_slot(self, tmp_path):
+        """Test a job that cannot be started does not hold a pending slot"""
+        import sqlite3
+        from sms_jobs import JobStore, SendJobRunner
+        store = JobStore(str(tmp_path / 'jobs.db'))
+        runner = SendJobRunner(app.sms_client, store, max_pending=1)
+        runner.shutdown()
+        
+        with pytest.raises(RuntimeError):
+            runner.submit(['+254700000001'], 'Test message')
+        assert runner.pending == 0
+        job = store._connect().execute("SELECT status, error FROM jobs").fetchone()
+        assert job['status'] == 'failed' and 'Could not start job' in job['error']
+        
+        with patch.object(store, 'create', side_effect=sqlite3.OperationalError('locked')):
+            with pytest.raises(sqlite3.OperationalError):
+                runner.submit(['+254700000001'], 'Test message')
+        assert runner.pending == 0
+
+
+class TestIdempotency:
+    """Test idempotency keys and recent-send dedup"""
+    
+    def make_client(self, tmp_path, **cache_args):
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender',
+                           send_cache=SendCache(str(tmp_path / 'sends.db'), **cache_args))
+        client.session.post = MagicMock(side_effect=fake_send_post)
+        return client
+    
+    def test_key_replays_first_result(self, tmp_path):
+        """Test a repeated key returns the stored result without sending"""
+        client = self.make_client(tmp_path)
+        phones = [f'+2547{i:08d}' for i in range(150)]
+        
+        first = client.send_bulk(phones, 'Test message', idempotency_key='k-1')
+        again = client.send_bulk(phones, 'Test message', idempotency_key='k-1')
+        assert client.session.post.call_count == 2
+        assert again['replayed'] is True and 'replayed' not in first
+        assert again['bulkIds'] == first['bulkIds']
+        
+        with pytest.raises(IdempotencyConflict, match='different request'):
+            client.send_bulk(phones, 'Other message', idempotency_key='k-1')
+        
+        with pytest.raises(ValueError):
+            SMSClient('key', 'https://test.api.infobip.com', 'Sender').send_sms(
+                '+254700000000', 'Test message', idempotency_key='k-2')
+    
+    def test_failed_send_releases_key(self, tmp_path):
+        """Test a key whose send failed can be retried"""
+        client = self.make_client(tmp_path)
+        client.retry_policy = RetryPolicy(max_attempts=1)
+        client.session.post.side_effect = requests.exceptions.ConnectionError('down')
+        with pytest.raises(requests.RequestException):
+            client.send_sms('+254700000000', 'Test message', idempotency_key='k-1')
+        
+        client.session.post.side_effect = fake_send_post
+        result = client.send_sms('+254700000000', 'Test message', idempotency_key='k-1')
+        assert result['messages'][0]['status']['groupName'] == 'PENDING'
+        assert 'replayed' not in result
+    
+    def test_keys_are_bounded(self, tmp_path):
+        """Test the oldest keys are evicted past max_keys"""
+        cache = SendCache(str(tmp_path / 'sends.db'), max_keys=2)
+        calls = []
+        for key in ('a', 'b', 'c'):
+            cache.run(key, 'fp', lambda: calls.append(key) or {'key': key})
+        assert cache.stats['evicted'] == 1
+        assert cache.run('c', 'fp', lambda: {'key': 'new'})['replayed'] is True
+        assert cache.run('a', 'fp', lambda: {'key': 'new'}) == {'key': 'new'}
+    
+    def test_recent_sends_suppressed(self, tmp_path):
+        """Test (recipient, text) pairs sent within the window are skipped"""
+        client = self.make_client(tmp_path, dedup_window=60)
+        client.send_sms(['+254700000001', '+254700000002'], 'Test message')
+        
+        result = client.send_bulk(['+254700000001', '+254700000003'], 'Test message')
+        assert result['suppressed'] == ['+254700000001']
+        assert [m['to'] for m in result['messages']] == ['+254700000003']
+        
+        # Another text to the same number is not a duplicate
+        other = client.send_sms('+254700000001', 'Another message')
+        assert len(other['messages']) == 1
+        
+        skipped = client.send_sms('+254700000002', 'Test message')
+        assert skipped['messages'] == [] and skipped['suppressed'] == ['+254700000002']
+        assert client.session.post.call_count == 3
+    
+    def test_send_endpoint(self, tmp_path):
+        """Test /api/send-sms replays requests with the same Idempotency-Key"""
+        original_cache = app.sms_client.send_cache
+        original_post = app.sms_client.session.post
+        app.sms_client.send_cache = SendCache(str(tmp_path / 'sends.db'))
+        app.sms_client.session.post = MagicMock(side_effect=fake_send_post)
+        body = {'phone_numbers': ['+254700000000'], 'message': 'Test message'}
+        try:
+            with app.app.test_client() as client:
+                first = client.post('/api/send-sms', json=body,
+                                    headers={'Idempotency-Key': 'k-1'}).get_json()
+                again = client.post('/api/send-sms', json=body,
+                                    headers={'Idempotency-Key': 'k-1'}).get_json()
+                assert (first['replayed'], again['replayed']) == (False, True)
+                assert again['bulk_id'] == first['bulk_id']
+                assert app.sms_client.session.post.call_count == 1
+                
+                response = client.post('/api/send-sms', json=dict(body, message='Changed'),
+                                       headers={'Idempotency-Key': 'k-1'})
+                assert response.status_code == 422
+        finally:
+            app.sms_client.send_cache = original_cache
+            app.sms_client.session.post = original_post
+
+
+class TestCoalescer:
+    """Test merging of concurrent sends into shared requests"""
+    
+    def make_client(self):
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender')
+        payloads = []
+        
+        def packed_post(url, json=None, timeout=None):
+            payloads.append(json)
+            response = MagicMock()
+            destinations = [d for m in json['messages'] for d in m['destinations']]
+            response.json.return_value = {
+                'bulkId': f'bulk-{len(payloads)}',
+                'messages': [{
+                    'messageId': d['messageId'],
+                    'status': {'groupName': 'REJECTED' if d['to'].endswith('9') else 'PENDING'},
+                    'smsCount': 1,
+                    'to': d['to']
+                } for d in destinations]
+            }
+            response.raise_for_status.return_value = None
+            return response
+        
+        client.session.post = MagicMock(side_effect=packed_post)
+        return client, payloads
+    
+    def send_concurrently(self, coalescer, calls):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+            futures = [executor.submit(coalescer.send, *call) for call in calls]
+            return [future.result() for future in futures]
+    
+    def test_concurrent_calls_share_request(self):
+        """Test calls within the window become one request, results split per caller"""
+        client, payloads = self.make_client()
+        coalescer = SendCoalescer(client, window=0.2)
+        calls = [([f'+2547{i:08d}'], 'Your code is ready') for i in range(20)]
+        calls.append((['+254711111111', '+254711111119'], 'Other text'))
+        calls.append((['+254722222222'], 'Your code is ready', None, 'campaign-1'))
+        
+        results = self.send_concurrently(coalescer, calls)
+        coalescer.close()
+        
+        assert len(payloads) == 1
+        texts = sorted((m['text'], m['callbackData'], len(m['destinations']))
+                       for m in payloads[0]['messages'])
+        assert texts == [('Other text', '', 2), ('Your code is ready', '', 20),
+                         ('Your code is ready', 'campaign-1', 1)]
+        for (phones, *_), result in zip(calls, results):
+            assert len(result['messages']) == len(phones)
+            assert result['bulkId'] == 'bulk-1' and result['coalesced'] == 22
+        assert [m['status']['groupName'] for m in results[20]['messages']] == ['PENDING', 'REJECTED']
+        assert coalescer.stats == {'calls': 22, 'recipients': 23, 'batches': 1, 'requests': 1}
+    
+    def test_max_batch_flushes_early(self):
+        """Test a full batch is sent without waiting for the window"""
+        client, payloads = self.make_client()
+        coalescer = SendCoalescer(client, window=30, max_batch=5)
+        start = time.monotonic()
+        results = self.send_concurrently(
+            coalescer, [([f'+2547{i:08d}'], 'Test message') for i in range(5)])
+        assert time.monotonic() - start < 5
+        assert len(payloads) == 1 and all(r['coalesced'] == 5 for r in results)
+        coalescer.close()
+    
+    def test_errors_reach_each_caller(self):
+        """Test invalid input raises in the caller and upstream failures reach every call"""
+        client, payloads = self.make_client()
+        coalescer = SendCoalescer(client, window=0.01)
+        with pytest.raises(ValueError):
+            coalescer.send(['not-a-number'], 'Test message')
+        with pytest.raises(ValueError):
+            coalescer.send(['+254700000000'], '  ')
+        
+        client.retry_policy = RetryPolicy(max_attempts=1)
+        client.session.post.side_effect = requests.exceptions.ConnectionError('down')
+        with pytest.raises(requests.RequestException, match='down'):
+            coalescer.send(['+254700000000'], 'Test message')
+        coalescer.close()
+        with pytest.raises(RuntimeError):
+            coalescer.send(['+254700000000'], 'Test message')
+    
+    def test_send_endpoint(self):
+        """Test /api/send-sms goes through the coalescer when a window is set"""
+        client, payloads = self.make_client()
+        coalescer = SendCoalescer(client, window=0.01)
+        with patch.object(app, 'get_coalescer', return_value=coalescer):
+            with app.app.test_client() as test_client:
+                response = test_client.post('/api/send-sms', json={
+                    'phone_numbers': ['+254700000000'], 'message': 'Test message'})
+        coalescer.close()
+        data = response.get_json()
+        assert response.status_code == 200
+        assert data['successful'] == 1 and data['coalesced'] == 1
+        assert len(payloads) == 1
+
+
+class TestTemplates:
+    """Test compiled message templates and personalized sends"""
+    
+    def test_render_rows(self):
+        """Test placeholders are filled by header name or index"""
+        template = MessageTemplate('Hi {Name}, you owe {balance} (100%). {{ref}} {0}')
+        assert template.fields == ['Name', 'balance', '0']
+        render = template.compile(['phone', 'name', 'balance'])
+        assert render(['+254700000000', ' Ann ', '12']) == \
+            'Hi Ann, you owe 12 (100%). {ref} +254700000000'
+        # Short rows render missing columns as empty
+        assert render(['+254700000000']) == 'Hi , you owe  (100%). {ref} +254700000000'
+        assert MessageTemplate('No placeholders').compile()(['x']) == 'No placeholders'
+    
+    def test_template_errors(self):
+        """Test malformed templates and unknown columns are rejected"""
+        for text in ('Hi {name', 'Hi {}', 'Hi {name:>5}'):
+            with pytest.raises(TemplateError):
+                MessageTemplate(text)
+        with pytest.raises(TemplateError, match='nmae'):
+            MessageTemplate('Hi {nmae}').compile(['phone', 'name'])
+    
+    def test_rendered_stream(self):
+        """Test rows are rendered lazily, as they are read"""
+        read = []
+        
+        def rows():
+            yield ['phone', 'name']
+            for i in range(1000000):
+                read.append(i)
+                yield [f'+2547{i:08d}', f'Customer {i}']
+        
+        rendered = iter_rendered(rows(), MessageTemplate('Hello {name}'), 'phone')
+        assert next(rendered) == ('+254700000000', 'Hello Customer 0')
+        assert next(rendered) == ('+254700000001', 'Hello Customer 1')
+        assert len(read) == 2
+    
+    def test_segment_counts(self):
+        """Test the uncached per-row count agrees with segment_text"""
+        texts = ['', 'Hi', 'x' * 160, 'x' * 161, '€' * 80, '€' * 81, 'é' * 400,
+                 '你' * 70, '你' * 71, '😀' * 34, 'a' * 152 + '€' + 'b' * 10]
+        for text in texts:
+            info = segment_text(text)
+            assert count_segments(text) == (info['encoding'], info['segments']), text
+        
+        seen = []
+        estimate = estimate_personalized(
+            [('+254700000001', 'Short'), ('+254700000002', 'x' * 200), ('+254700000003', '你好')],
+            price_per_segment=0.5, preview=1, on_row=seen.append)
+        assert estimate['total_segments'] == 4 and estimate['max_segments'] == 2
+        assert estimate['segments'] == {'1': 2, '2': 1}
+        assert estimate['encodings'] == {'GSM-7': 2, 'UCS-2': 1}
+        assert estimate['estimated_cost'] == 2.0
+        assert len(estimate['preview']) == 1 and [r['segments'] for r in seen] == [1, 2, 1]
+    
+    def test_send_stream_in_windows(self):
+        """Test a rendered stream is sent a window at a time"""
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender')
+        
+        def packed_post(url, json=None, timeout=None):
+            response = MagicMock()
+            response.json.return_value = {'bulkId': f'bulk-{client.session.post.call_count}',
+                                          'messages': [{
+                                              'messageId': d['messageId'],
+                                              'status': {'groupName': 'PENDING'},
+                                              'to': d['to']
+                                          } for m in json['messages'] for d in m['destinations']]}
+            response.raise_for_status.return_value = None
+            return response
+        
+        client.session.post = MagicMock(side_effect=packed_post)
+        rows = ([f'+2547{i:08d}', f'Customer {i}'] for i in range(250))
+        rendered = iter_rendered(rows, MessageTemplate('Hello {1}'))
+        batches = []
+        totals = client.send_personalized_stream(rendered, window=100, on_batch=batches.append)
+        
+        assert [len(b['results']) for b in batches] == [100, 100, 50]
+        assert totals['rows'] == totals['sent'] == 250 and totals['failed'] == 0
+        assert totals['requests'] == client.session.post.call_count == 3
+        assert len(totals['bulkIds']) == 3
+    
+    def test_estimate_endpoint(self):
+        """Test /api/estimate-template renders an uploaded CSV"""
+        csv_data = 'phone,name\n+254700000001,Ann\n+254700000002,Zoë 你好\n'
+        with app.app.test_client() as client:
+            response = client.post('/api/estimate-template?column=phone', data={
+                'message': 'Hello {name}',
+                'file': (BytesIO(csv_data.encode()), 'contacts.csv')
+            }, content_type='multipart/form-data')
+            data = response.get_json()
+            assert response.status_code == 200
+            assert data['fields'] == ['name']
+            assert data['estimate']['recipients'] == 2
+            assert data['estimate']['encodings'] == {'GSM-7': 1, 'UCS-2': 1}
+            assert data['estimate']['preview'][1]['text'] == 'Hello Zoë 你好'
+            
+            response = client.post('/api/estimate-template', data={
+                'message': 'Hello {nmae}',
+                'file': (BytesIO(csv_data.encode()), 'contacts.csv')
+            }, content_type='multipart/form-data')
+            assert response.status_code == 400
+
+
+def fake_personalized(rows, fail=(), reject=(), ambiguous=()):
+    """
+    Stand-in for SMSClient.send_personalized returning one result per row
+    
+    Rows in fail could not be sent (safe to retry); rows in ambiguous got
+    a 5xx that Infobip may have acted on.
+    """
+    def status(to):
+        if to in fail or to in ambiguous:
+            return None
+        if to in reject:
+            return {'groupName': 'REJECTED', 'name': 'REJECTED_DESTINATION',
+                    'description': 'Destination blocked'}
+        return {'groupName': 'PENDING'}
+    
+    return {'results': [{
+        'to': to, 'text': text, 'bulkId': 'bulk-1', 'messageId': f'id-{to}',
+        'status': status(to), 'smsCount': 1,
+        'error': ('Connection refused' if to in fail
+                  else '502 Bad Gateway' if to in ambiguous else None),
+        'retryable': to in fail, 'ambiguous': to in ambiguous
+    } for to, text, sender, callback_data in rows], 'requests': []}
+
+
+class TestScheduler:
+    """Test scheduled sends, send windows and the scheduler loop"""
+    
+    def test_window_and_dst(self):
+        """Test messages are held to local windows and daily runs keep local time"""
+        nairobi = get_zone('Africa/Nairobi')
+        window = parse_window('08:00-20:00')
+        # 21:00 Nairobi is outside the window: due at 08:00 the next day
+        late = parse_send_time('2024-05-01T21:00', 'Africa/Nairobi')
+        assert align_to_window(late, nairobi, window) == \
+            parse_send_time('2024-05-02T08:00', 'Africa/Nairobi')
+        assert align_to_window(late, nairobi, parse_window('20:00-02:00')) == late
+        
+        # A daily 09:00 London run stays at 09:00 across the March clock change
+        london = get_zone('Europe/London')
+        run_at = parse_send_time('2024-03-30T09:00', 'Europe/London')
+        scheduled, due = next_occurrence(run_at, london, 'daily', now=run_at)
+        assert scheduled == due == parse_send_time('2024-03-31T09:00', 'Europe/London')
+        assert scheduled - run_at == 23 * 3600
+        
+        for bad in ('8-20', '25:00-26:00'):
+            with pytest.raises(ValueError):
+                parse_window(bad)
+        with pytest.raises(ValueError):
+            get_zone('Mars/Olympus')
+    
+    def test_due_messages_sent_and_repeated(self, tmp_path):
+        """Test due messages are sent, retried, and recurring ones re-armed"""
+        store = ScheduleStore(str(tmp_path / 'schedule.db'))
+        now = time.time()
+        once = store.add(['+254700000001', '+254700000002'], 'Once', now - 1)
+        daily = store.add(['+254700000003'], 'Daily', now - 1, recurrence='daily')
+        store.add(['+254700000004'], 'Later', now + 3600)
+        assert once['count'] == 2
+        
+        client = MagicMock()
+        client.send_personalized.side_effect = lambda rows: fake_personalized(
+            list(rows), fail={'+254700000002'})
+        rows = store.claim_due(now=now)
+        assert len(rows) == 3 and store.claim_due(now=now) == []
+        counts = process_due(store, client, rows, now=now)
+        assert counts == {'sent': 2, 'failed': 0, 'unknown': 0, 'retried': 1, 'deferred': 0}
+        
+        first = store.get(once['schedule_id'])
+        assert first['counts'] == {'sent': 1, 'pending': 1} and first['runs'] == 1
+        repeating = store.get(daily['schedule_id'])
+        assert repeating['counts'] == {'pending': 1} and repeating['runs'] == 1
+        assert abs(repeating['next_due'] - (now - 1 + 24 * 3600)) < 1
+        
+        assert store.cancel(once['schedule_id']) == 1
+        assert store.cancel('unknown') is None
+        assert store.stats() == {'sent': 1, 'pending': 2, 'cancelled': 1}
+    
+    def test_cancel_during_send(self, tmp_path):
+        """Test messages in flight when their schedule is cancelled are not re-armed"""
+        store = ScheduleStore(str(tmp_path / 'schedule.db'))
+        now = time.time()
+        daily = store.add(['+254700000001', '+254700000002'], 'Daily', now - 1,
+                          recurrence='daily')
+        stuck = store.add(['+254700000003'], 'Stuck', now - 1, recurrence='daily')
+        
+        client = MagicMock()
+        client.send_personalized.side_effect = lambda rows: fake_personalized(
+            list(rows), fail={'+254700000002'})
+        rows = [row for row in store.claim_due(now=now)
+                if row['schedule_id'] == daily['schedule_id']]
+        
+        # Cancelled while sending: the sent daily message and the failed one
+        # (which would be retried) both end up cancelled, not pending
+        assert store.cancel(daily['schedule_id']) == 0
+        assert store.cancel(stuck['schedule_id']) == 0
+        process_due(store, client, rows, now=now)
+        assert store.get(daily['schedule_id'])['counts'] == {'cancelled': 2}
+        assert store.get(daily['schedule_id'])['runs'] == 1
+        
+        # A claim abandoned by a crash is cancelled rather than requeued
+        assert store.requeue_stale(older_than=-1) == 1
+        assert store.get(stuck['schedule_id'])['counts'] == {'cancelled': 1}
+        assert store.claim_due(now=now + 2 * 24 * 3600) == []
+    
+    def test_rejected_messages_fail(self, tmp_path):
+        """Test rejected and ambiguous sends are not retried"""
+        store = ScheduleStore(str(tmp_path / 'schedule.db'))
+        now = time.time()
+        added = store.add(['+254700000001', '+254700000002', '+254700000003'], 'Once', now - 1)
+        
+        client = MagicMock()
+        client.send_personalized.side_effect = lambda rows: fake_personalized(
+            list(rows), reject={'+254700000002'}, ambiguous={'+254700000003'})
+        counts = process_due(store, client, store.claim_due(now=now), now=now)
+        
+        assert counts == {'sent': 1, 'failed': 1, 'unknown': 1, 'retried': 0, 'deferred': 0}
+        assert store.get(added['schedule_id'])['counts'] == {'sent': 1, 'failed': 1,
+                                                             'unknown': 1}
+    
+    def test_scheduler_wakes_on_add(self, tmp_path):
+        """Test a sleeping scheduler is woken by a newly added schedule"""
+        import threading
+        store = ScheduleStore(str(tmp_path / 'schedule.db'))
+        client = MagicMock()
+        sent = threading.Event()
+        
+        def send(rows):
+            result = fake_personalized(list(rows))
+            sent.set()
+            return result
+        client.send_personalized.side_effect = send
+        
+        stop = threading.Event()
+        thread = threading.Thread(target=run_scheduler, args=(store, client),
+                                  kwargs={'max_sleep': 30, 'stop_event': stop})
+        thread.start()
+        try:
+            time.sleep(0.2)
+            ScheduleStore(store.path).add(['+254700000001'], 'Now', time.time())
+            assert sent.wait(5)
+        finally:
+            stop.set()
+            store.wake.poke()
+            thread.join(5)
+        assert not thread.is_alive()
+        assert store.stats() == {'sent': 1}
+    
+    def test_schedule_endpoints(self, tmp_path):
+        """Test schedules are created, inspected and cancelled over the API"""
+        app.app.config['SCHEDULE_PATH'] = str(tmp_path / 'schedule.db')
+        app._schedule_store = None
+        try:
+            with app.app.test_client() as client:
+                response = client.post('/api/schedules', json={
+                    'phone_numbers': ['+254700000001', '+447700900000'],
+                    'message': 'Reminder', 'send_at': '2099-05-01T09:00',
+                    'timezone': 'Africa/Nairobi', 'window': '08:00-20:00',
+                    'recurrence': 'weekly',
+                    'recipient_timezones': {'+447700900000': 'Europe/London'}
+                })
+                assert response.status_code == 201
+                created = response.get_json()
+                assert created['count'] == 2
+                assert created['next_due'] == parse_send_time('2099-05-01T09:00',
+                                                               'Africa/Nairobi')
+                
+                schedule = client.get(created['status_url']).get_json()['schedule']
+                assert schedule['counts'] == {'pending': 2}
+                assert (schedule['window'], schedule['recurrence']) == ('08:00-20:00', 'weekly')
+                
+                response = client.delete(created['status_url'])
+                assert response.get_json()['cancelled'] == 2
+                assert client.get('/api/schedules/unknown').status_code == 404
+                assert client.delete('/api/schedules/unknown').status_code == 404
+                
+                for body in ({'timezone': 'Mars/Olympus'}, {'window': 'soon'},
+                             {'recurrence': 'yearly'}, {'phone_numbers': ['invalid']}):
+                    body = dict({'phone_numbers': ['+254700000001'], 'message': 'Hi'}, **body)
+                    assert client.post('/api/schedules', json=body).status_code == 400
+        finally:
+            app._schedule_store = None
+
+
+class TestConnectionPool:
+    """Test connection reuse, idle reaping and pool limits of SMSClient"""
+    
+    @pytest.fixture
+    def server(self):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            delay = 0
+            
+            def do_GET(self):
+                time.sleep(self.delay)
+                body = b'{"balance": 10.0, "currency": "EUR"}'
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        httpd.daemon_threads = True
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield Handler, f'http://127.0.0.1:{httpd.server_port}'
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+    
+    def test_reuse_and_idle_reaping(self, server):
+        """Test kept-alive connections are reused until idle too long"""
+        import socket
+        handler, base_url = server
+        client = SMSClient('test_key', base_url, 'TestSender', idle_timeout=0.2, tcp_keepalive=30)
+        client.check_account_balance()
+        client.check_account_balance()
+        stats = client.pool_stats()
+        assert (stats['hits'], stats['misses'], stats['hit_ratio']) == (1, 1, 0.5)
+        
+        options = client.adapter.poolmanager.connection_pool_kw['socket_options']
+        assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in options
+        
+        time.sleep(0.3)
+        client.check_account_balance()
+        assert client.pool_stats()['reaped'] == 1
+        client.close()
+    
+    def test_blocking_pool_limit(self, server):
+        """Test threads wait for a pooled connection and give up after the timeout"""
+        from concurrent.futures import ThreadPoolExecutor
+        handler, base_url = server
+        handler.delay = 0.3
+        client = SMSClient('test_key', base_url, 'TestSender', pool_size=1, pool_block=True,
+                           connect_timeout=0.1, retry_policy=RetryPolicy(max_attempts=1))
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(client.check_account_balance) for _ in range(2)]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        assert len(errors) == 1 and isinstance(errors[0], requests.RequestException)
+        stats = client.pool_stats()
+        assert (stats['misses'], stats['exhausted'], stats['discarded']) == (1, 1, 0)
+        client.close()
+    
+    def test_separate_timeouts(self):
+        """Test connect and read timeouts are passed separately"""
+        client = SMSClient('test_key', 'https://test.api.infobip.com', 'TestSender',
+                           connect_timeout=2, read_timeout=15)
+        client.session.post = MagicMock(side_effect=fake_send_post)
+        client.send_sms('+254700000001', 'Test message')
+        assert client.session.post.call_args[1]['timeout'] == (2, 15)
+
+
+class TestCircuitBreaker:
+    """Test per-endpoint circuit breakers and failover to alternate URLs"""
+    
+    PRIMARY = 'https://primary.api.infobip.com'
+    FALLBACK = 'https://fallback.api.infobip.com'
+    
+    def make_client(self, urls, **breaker_args):
+        client = SMSClient('test_key', urls[0], 'TestSender',
+                           retry_policy=RetryPolicy(sleep=lambda delay: None),
+                           endpoints=EndpointSet(urls, **breaker_args))
+        
+        def get(url, timeout=None, params=None):
+            if url.startswith(self.PRIMARY):
+                raise requests.exceptions.ConnectionError('Connection refused')
+            response = MagicMock()
+            response.json.return_value = {'balance': 10.0, 'currency': 'EUR'}
+            response.raise_for_status.return_value = None
+            return response
+        client.session.get = MagicMock(side_effect=get)
+        return client
+    
+    def test_breaker_states(self):
+        """Test the breaker opens on failures, probes after the timeout and closes"""
+        now = [0.0]
+        breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, slow_call=1.0,
+                                 reset_timeout=30, clock=lambda: now[0])
+        for success, duration in ((True, 0.1), (True, 0.1), (False, 0.1)):
+            assert breaker.allow()
+            breaker.record(success, duration)
+        assert breaker.state == 'closed'
+        breaker.record(True, 2.0)
+        assert breaker.state == 'open' and not breaker.allow()
+        
+        now[0] = 31
+        assert breaker.allow() and not breaker.allow()
+        assert breaker.state == 'half_open'
+        breaker.record(False)
+        assert breaker.state == 'open'
+        
+        now[0] = 62
+        assert breaker.allow()
+        breaker.record(True, 0.1)
+        stats = breaker.snapshot()
+        assert stats['state'] == 'closed'
+        assert (stats['opened'], stats['rejected'], stats['slow_calls']) == (2, 2, 1)
+    
+    def test_failover_to_alternate_url(self):
+        """Test a connection failure is retried on the next endpoint"""
+        client = self.make_client([self.PRIMARY, self.FALLBACK], min_calls=2)
+        assert client.check_account_balance()['balance'] == 10.0
+        urls = [call[0][0] for call in client.session.get.call_args_list]
+        assert urls == [f'{self.PRIMARY}/account/1/balance', f'{self.FALLBACK}/account/1/balance']
+        
+        client.check_account_balance()
+        # The primary's circuit is now open, so it is skipped without a request
+        client.session.get.reset_mock()
+        client.check_account_balance()
+        assert client.session.get.call_count == 1
+        assert [e['state'] for e in client.endpoints.snapshot()] == ['open', 'closed']
+    
+    def test_open_circuit_fails_fast(self):
+        """Test calls fail without a request once every circuit is open"""
+        client = self.make_client([self.PRIMARY], min_calls=1)
+        with pytest.raises(SMSAPIError):
+            client.check_account_balance()
+        client.session.get.reset_mock()
+        with pytest.raises(SMSAPIError, match='circuit open'):
+            client.check_account_balance()
+        assert client.session.get.call_count == 0
+        with pytest.raises(ValueError):
+            EndpointSet([' ', ''])
+    
+    def test_health_reports_circuits(self):
+        """Test /health stays up and /ready reports unavailable upstreams"""
+        original = app.sms_client.endpoints
+        try:
+            endpoints = EndpointSet([self.PRIMARY, self.FALLBACK], min_calls=1)
+            app.sms_client.endpoints = endpoints
+            with app.app.test_client() as client:
+                assert client.get('/health').get_json()['upstream_status'] == 'healthy'
+                assert client.get('/ready').status_code == 200
+                
+                endpoints.breakers[self.PRIMARY].record(False)
+                response = client.get('/health')
+                data = response.get_json()
+                assert response.status_code == 200 and data['upstream_status'] == 'degraded'
+                assert [e['state'] for e in data['upstream']] == ['open', 'closed']
+                assert client.get('/ready').get_json()['status'] == 'degraded'
+                
+                # Liveness holds with every circuit open; readiness does not
+                endpoints.breakers[self.FALLBACK].record(False)
+                response = client.get('/health')
+                assert response.status_code == 200
+                assert response.get_json()['status'] == 'healthy'
+                assert response.get_json()['upstream_status'] == 'unavailable'
+                response = client.get('/ready')
+                assert response.status_code == 503
+                assert response.get_json()['status'] == 'unavailable'
+        finally:
+            app.sms_client.endpoints = original